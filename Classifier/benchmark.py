@@ -0,0 +1,278 @@
+"""
+Benchmarks the crypto scam classifier on quality and inference cost, so that a model can only replace the one
+bot.py loads if it is at least as accurate and not much slower or bigger.
+
+For every training set (CT, Discord, mixed) a model is trained with train_model and evaluated on every test set:
+accuracy, precision/recall/F1 of the Spam class and ROC AUC. Each model is also timed on single messages and on
+batches through get_predictions, and through the pickle-free compiled export the bot actually runs, and its
+vocabulary size, pickled size, exported size and resident size are recorded. Exported models (e.g. the one in
+DiscordBot/crypto_scam_classifier/model_disc) can be benchmarked alongside with --compiled-model.
+
+    python benchmark.py --json results.json
+    python benchmark.py --baseline results.json --max-quality-drop 0.02 --max-latency-ratio 1.5
+
+With --baseline, the run exits with status 1 if any model is worse than in the baseline by more than the
+allowed margins.
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, precision_recall_fscore_support, roc_auc_score, roc_curve
+from naive_bayes_classifier import load_crypto_tweet_dataset, load_our_discord_dataset, train_model, \
+    get_predictions, export_compiled_model
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "DiscordBot", "crypto_scam_classifier"))
+from compiled_model import load_compiled_model
+
+BATCH_SIZES = (8, 32, 128) # 32 is the bot's SCORING_MAX_BATCH_SIZE
+ROC_POINTS = 21 # points of the ROC curve kept in the output
+MIN_SAMPLES = 50 # min timings per batch size, however few batches the test set makes
+
+
+def load_datasets(seed):
+    """
+    Returns {name: (X_train, X_test, Y_train, Y_test)} for the CT, Discord and mixed datasets, sampled as in
+    naive_bayes_classifier's __main__
+    """
+    np.random.seed(seed)
+    ct = load_crypto_tweet_dataset()
+    disc = load_our_discord_dataset()
+    mixed = tuple(pd.concat([a, b], ignore_index=True) for a, b in zip(ct, disc))
+    return {"ct": ct, "discord": disc, "mixed": mixed}
+
+
+def quality(Y_true, spam_proba, threshold=0.5):
+    """
+    Quality metrics of the Spam probabilities spam_proba against the labels Y_true
+    """
+    y = (np.asarray(Y_true) == "Spam").astype(int)
+    predicted = (spam_proba >= threshold).astype(int)
+    precision, recall, f1, _ = precision_recall_fscore_support(y, predicted, average="binary", zero_division=0)
+    result = {
+        "n": len(y),
+        "accuracy": float(accuracy_score(y, predicted)),
+        "precision": float(precision),
+        "recall": float(recall),
+        "f1": float(f1),
+        "roc_auc": None,
+        "roc": None,
+    }
+    if 0 < y.sum() < len(y):
+        fpr, tpr, _ = roc_curve(y, spam_proba)
+        grid = np.linspace(0, 1, ROC_POINTS)
+        result["roc_auc"] = float(roc_auc_score(y, spam_proba))
+        result["roc"] = {"fpr": grid.tolist(), "tpr": np.round(np.interp(grid, fpr, tpr), 4).tolist()}
+    return result
+
+
+def percentiles_us(samples):
+    samples = np.asarray(samples) * 1e6
+    return {"p50_us": float(np.percentile(samples, 50)), "p99_us": float(np.percentile(samples, 99)),
+            "mean_us": float(samples.mean())}
+
+
+def time_predictions(predict_proba, messages, repeat):
+    """
+    Times predict_proba on one message at a time, and on batches of each of BATCH_SIZES messages. Batch latencies
+    are per batch; per_message_us is the batch latency divided by the batch size.
+    """
+    messages = list(messages)
+    predict_proba(messages[:1]) # warm up caches and lazy imports
+    single = []
+    for _ in range(repeat):
+        for message in messages:
+            start = time.perf_counter()
+            predict_proba([message])
+            single.append(time.perf_counter() - start)
+    result = {"single": percentiles_us(single), "batched": {}}
+    for batch_size in BATCH_SIZES:
+        pool = messages * (batch_size // len(messages) + 1)
+        batches = [pool[i:i+batch_size] for i in range(0, len(pool) - batch_size + 1, batch_size)]
+        samples = []
+        for _ in range(max(repeat, -(-MIN_SAMPLES // len(batches)))):
+            for batch in batches:
+                start = time.perf_counter()
+                predict_proba(batch)
+                samples.append(time.perf_counter() - start)
+        stats = percentiles_us(samples)
+        stats["per_message_us"] = stats["p50_us"] / batch_size
+        result["batched"][str(batch_size)] = stats
+    return result
+
+
+def resident_bytes(load):
+    """
+    Returns the memory still allocated (by Python and NumPy) after load() returns, with what load() returned kept
+    alive
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        obj = load()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del obj
+    return size
+
+
+def directory_bytes(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def benchmark_compiled(path, datasets, repeat):
+    """
+    Quality, latency and size of the compiled model exported to path, as the bot loads it
+    """
+    compiled = load_compiled_model(path)
+    spam = compiled.classes.index("Spam")
+    result = {
+        "vocabulary_size": len(compiled.vocabulary),
+        "exported_bytes": directory_bytes(path),
+        "resident_bytes": resident_bytes(lambda: load_compiled_model(path, mmap=False)),
+        "quality": {},
+    }
+    for name, (_, X_test, _, Y_test) in datasets.items():
+        result["quality"][name] = quality(Y_test, compiled.predict_proba(list(X_test))[:, spam])
+    result["latency"] = time_predictions(compiled.predict_proba, datasets["mixed"][1], repeat)
+    return result
+
+
+def benchmark_trained(name, datasets, repeat):
+    """
+    Trains a model on the training set of datasets[name] and benchmarks it, and its compiled export
+    """
+    X_train, _, Y_train, _ = datasets[name]
+    start = time.perf_counter()
+    vectorizer, model = train_model(X_train, Y_train)
+    train_seconds = time.perf_counter() - start
+    spam = list(model.classes_).index("Spam")
+    pickled = pickle.dumps((vectorizer, model))
+    result = {
+        "train_size": len(X_train),
+        "train_seconds": train_seconds,
+        "vocabulary_size": len(vectorizer.vocabulary_),
+        "pickled_bytes": len(pickled),
+        "resident_bytes": resident_bytes(lambda: pickle.loads(pickled)),
+        "quality": {},
+    }
+    for test_name, (_, X_test, _, Y_test) in datasets.items():
+        proba = get_predictions(X_test, model, vectorizer, predict_proba=True)[:, spam]
+        result["quality"][test_name] = quality(Y_test, proba)
+    result["latency"] = time_predictions(lambda X: get_predictions(X, model, vectorizer, predict_proba=True),
+                                         datasets["mixed"][1], repeat)
+    with tempfile.TemporaryDirectory() as path:
+        export_compiled_model(vectorizer, model, path)
+        result["compiled"] = benchmark_compiled(path, datasets, repeat)
+    return result
+
+
+def run(seed=5, repeat=3, compiled_models=()):
+    datasets = load_datasets(seed)
+    results = {
+        "seed": seed,
+        "test_sizes": {name: len(data[1]) for name, data in datasets.items()},
+        "models": {},
+    }
+    for name in datasets:
+        results["models"][name] = benchmark_trained(name, datasets, repeat)
+    for path in compiled_models:
+        results["models"][path] = {"compiled": benchmark_compiled(path, datasets, repeat)}
+    return results
+
+
+def regressions(results, baseline, max_quality_drop, max_latency_ratio, max_size_ratio):
+    """
+    Returns a description of every metric of a model in results that is worse than the same model's in baseline
+    by more than the allowed margin. Quality is compared on accuracy, F1 and ROC AUC; latency on the p50 of single
+    messages and of batches; size on the resident size.
+    """
+    failures = []
+
+    def compare(label, new, old):
+        for test_name, metrics in new.get("quality", {}).items():
+            for metric in ("accuracy", "f1", "roc_auc"):
+                old_value = old.get("quality", {}).get(test_name, {}).get(metric)
+                if old_value is not None and metrics[metric] is not None \
+                        and metrics[metric] < old_value - max_quality_drop:
+                    failures.append(f"{label}: {metric} on {test_name} dropped from {old_value:.3f} to "
+                                    f"{metrics[metric]:.3f}")
+        if "latency" in new and "latency" in old:
+            pairs = [("single", new["latency"]["single"], old["latency"]["single"])]
+            pairs += [(f"batch of {size}", stats, old["latency"]["batched"].get(size))
+                      for size, stats in new["latency"]["batched"].items()]
+            for kind, stats, old_stats in pairs:
+                if old_stats is not None and stats["p50_us"] > old_stats["p50_us"] * max_latency_ratio:
+                    failures.append(f"{label}: p50 latency of {kind} went from {old_stats['p50_us']:.0f} us to "
+                                    f"{stats['p50_us']:.0f} us")
+        if "resident_bytes" in new and old.get("resident_bytes") \
+                and new["resident_bytes"] > old["resident_bytes"] * max_size_ratio:
+            failures.append(f"{label}: resident size went from {old['resident_bytes']} to {new['resident_bytes']} bytes")
+
+    for name, model in results["models"].items():
+        old = baseline.get("models", {}).get(name)
+        if old is None:
+            continue
+        if "quality" in model:
+            compare(name, model, old)
+        if "compiled" in model and "compiled" in old:
+            compare(f"{name} (compiled)", model["compiled"], old["compiled"])
+    return failures
+
+
+def print_summary(results):
+    header = f"{'model':<12}{'test':<10}{'acc':>7}{'prec':>7}{'rec':>7}{'f1':>7}{'auc':>7}"
+    for name, model in results["models"].items():
+        for label, entry in (("sklearn", model), ("compiled", model.get("compiled"))):
+            if entry is None or "quality" not in entry:
+                continue
+            print(f"{os.path.basename(name.rstrip('/'))} ({label}): vocabulary {entry['vocabulary_size']}, "
+                  f"resident {entry['resident_bytes'] / 1024:.0f} KiB, single p50 "
+                  f"{entry['latency']['single']['p50_us']:.0f} us, batch of 32 "
+                  f"{entry['latency']['batched']['32']['per_message_us']:.0f} us/message")
+        print(header)
+        for test_name, q in (model.get("quality") or model["compiled"]["quality"]).items():
+            auc = f"{q['roc_auc']:.3f}" if q["roc_auc"] is not None else "-"
+            print(f"{os.path.basename(name.rstrip('/')):<12}{test_name:<10}{q['accuracy']:>7.3f}{q['precision']:>7.3f}"
+                  f"{q['recall']:>7.3f}{q['f1']:>7.3f}{auc:>7}")
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classifier quality and inference cost benchmark")
+    parser.add_argument('--seed', type=int, default=5, help="seed for the datasets' random Ham sampling")
+    parser.add_argument('--repeat', type=int, default=3, help="passes over the test messages when timing")
+    parser.add_argument('--compiled-model', action='append', default=[],
+                        help="also benchmark this exported model directory (repeatable)")
+    parser.add_argument('--json', help="write the results to this file ('-' for stdout)")
+    parser.add_argument('--baseline', help="results of a previous run to check for regressions against")
+    parser.add_argument('--max-quality-drop', type=float, default=0.02)
+    parser.add_argument('--max-latency-ratio', type=float, default=1.5)
+    parser.add_argument('--max-size-ratio', type=float, default=1.5)
+    args = parser.parse_args()
+
+    results = run(seed=args.seed, repeat=args.repeat, compiled_models=args.compiled_model)
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_summary(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = regressions(results, baseline, args.max_quality_drop, args.max_latency_ratio,
+                               args.max_size_ratio)
+        for failure in failures:
+            print("REGRESSION", failure, file=sys.stderr)
+        sys.exit(1 if failures else 0)
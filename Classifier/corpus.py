@@ -0,0 +1,261 @@
+"""
+Columnar cache of every classifier dataset, so that experiments don't re-list, re-read and re-parse the raw data on
+every run. All sources are ingested into data/cache once:
+- text.bin: the normalized texts, UTF-8 encoded back to back, and offsets.npy: text i is text.bin[offsets[i]:offsets[i+1]]
+- label.npy, source.npy, split.npy: int8 codes into the label, source and split names listed in manifest.json
+- row.npy: the row of the text in its source file (0 for one-message files)
+- manifest.json: the names, and for every source file its size, mtime, SHA-256 and range of rows in the cache
+
+Everything is memory-mapped when loaded, and texts are only decoded when asked for, so selecting rows by label,
+source or split doesn't touch the text at all.
+
+Rebuilds are incremental: a source file whose size and mtime are unchanged, or whose content hash is unchanged, keeps
+its rows (copied from the previous cache without parsing); only new or changed files are parsed. load_corpus()
+rebuilds the cache first if any source changed.
+
+    python corpus.py # build or update the cache
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import unicodedata
+import numpy as np
+import pandas as pd
+
+DATA_DIR = "data"
+CACHE_DIR = "data/cache"
+CRYPTO_TWEET_CSV = "crypto_tweet/crypto_tweet_aggregateddata.csv"
+DISCORD_DIR = "custom_discord_dataset"
+SPLITS = ["", "train", "test"] # "" for sources without a predefined split
+CSV_CHUNK_SIZE = 100000 # rows parsed at a time
+FORMAT_VERSION = 1
+
+
+def normalize(text):
+    """
+    Texts are stored NFC-normalized, on one line
+    """
+    return unicodedata.normalize("NFC", text).replace("\r", " ").replace("\n", " ")
+
+
+def list_sources(data_dir=DATA_DIR):
+    """
+    Returns the (path relative to data_dir, source name, split) of every source file, in cache order
+    """
+    sources = []
+    if os.path.isfile(os.path.join(data_dir, CRYPTO_TWEET_CSV)):
+        sources.append((CRYPTO_TWEET_CSV, "crypto_tweet", ""))
+    for split in ("train", "test"):
+        path = os.path.join(data_dir, DISCORD_DIR, split)
+        if os.path.isdir(path):
+            with os.scandir(path) as entries:
+                names = sorted(entry.name for entry in entries if entry.is_file() and entry.name.endswith(".txt"))
+            sources.extend((f"{DISCORD_DIR}/{split}/{name}", "discord", split) for name in names)
+    return sources
+
+
+def parse_source(path, source):
+    """
+    Yields the (text, label, row) of every message in a source file, normalized
+    """
+    if source == "crypto_tweet":
+        row = 0
+        for chunk in pd.read_csv(path, chunksize=CSV_CHUNK_SIZE):
+            for tweet, category in zip(chunk["Tweet"], chunk["Category"]):
+                yield normalize(str(tweet)), str(category), row
+                row += 1
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield normalize(f.read()), "Spam", 0 # the Discord dataset only has scam messages
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Corpus(object):
+    """
+    A loaded cache. label, source, split and row are arrays with one entry per text; labels, sources and splits
+    are the names of their codes.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        with open(os.path.join(cache_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.labels = self.manifest["labels"]
+        self.sources = self.manifest["sources"]
+        self.splits = self.manifest["splits"]
+        self.offsets = np.load(os.path.join(cache_dir, "offsets.npy"), mmap_mode="r")
+        self.label = np.load(os.path.join(cache_dir, "label.npy"), mmap_mode="r")
+        self.source = np.load(os.path.join(cache_dir, "source.npy"), mmap_mode="r")
+        self.split = np.load(os.path.join(cache_dir, "split.npy"), mmap_mode="r")
+        self.row = np.load(os.path.join(cache_dir, "row.npy"), mmap_mode="r")
+        text_path = os.path.join(cache_dir, "text.bin")
+        # np.memmap can't map an empty file
+        self.blob = np.memmap(text_path, dtype=np.uint8, mode="r") if os.path.getsize(text_path) else np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.label)
+
+    def text(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def texts(self, idxs):
+        return [self.text(i) for i in idxs]
+
+    def select(self, source=None, split=None, labels=None):
+        """
+        Returns the indices of the texts from the given source and split, with one of the given labels, in cache
+        order. Names the cache doesn't know match nothing.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if source is not None:
+            mask &= self.source == self._code(self.sources, source)
+        if split is not None:
+            mask &= self.split == self._code(self.splits, split)
+        if labels is not None:
+            mask &= np.isin(self.label, [self._code(self.labels, label) for label in labels])
+        return np.flatnonzero(mask)
+
+    def label_names(self, idxs):
+        return np.array(self.labels, dtype=object)[self.label[idxs]]
+
+    @staticmethod
+    def _code(names, name):
+        return names.index(name) if name in names else -1
+
+
+def _source_is_current(entry, path, stat):
+    if entry is None:
+        return False
+    if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    return entry["size"] == stat.st_size and entry["sha256"] == file_hash(path)
+
+
+def build_corpus(data_dir=DATA_DIR, cache_dir=CACHE_DIR, verbose=False):
+    """
+    Builds or updates the cache in cache_dir from the sources in data_dir, and returns how many source files were
+    reused, parsed and removed. Does nothing if no source changed.
+    """
+    old = None
+    if os.path.isfile(os.path.join(cache_dir, "manifest.json")):
+        old = Corpus(cache_dir)
+        if old.manifest.get("version") != FORMAT_VERSION:
+            old = None
+    old_files = old.manifest["files"] if old is not None else {}
+
+    sources = list_sources(data_dir)
+    stats = {"reused": 0, "parsed": 0, "removed": len(set(old_files) - {path for path, _, _ in sources})}
+    plan = []
+    for path, source, split in sources:
+        full_path = os.path.join(data_dir, path)
+        stat = os.stat(full_path)
+        entry = old_files.get(path)
+        if _source_is_current(entry, full_path, stat):
+            plan.append((path, source, split, stat, entry))
+        else:
+            plan.append((path, source, split, stat, None))
+    if old is not None and not stats["removed"] and len(plan) == len(old_files) \
+            and all(entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+                    for _, _, _, stat, entry in plan):
+        stats["reused"] = len(plan)
+        return stats
+
+    labels = list(old.labels) if old is not None else []
+    source_names = list(old.sources) if old is not None else []
+    tmp_dir = cache_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    columns = {"label": [], "source": [], "split": [], "row": []}
+    offsets = [np.zeros(1, dtype=np.int64)]
+    files = {}
+    n, n_bytes = 0, 0
+    with open(os.path.join(tmp_dir, "text.bin"), "wb") as text_file:
+        for path, source, split, stat, entry in plan:
+            if source not in source_names:
+                source_names.append(source)
+            start = n
+            if entry is not None:
+                # Unchanged: copy the rows and text bytes from the previous cache
+                rows = slice(entry["start"], entry["stop"])
+                begin, end = int(old.offsets[entry["start"]]), int(old.offsets[entry["stop"]])
+                text_file.write(old.blob[begin:end].tobytes())
+                offsets.append(np.asarray(old.offsets[entry["start"] + 1:entry["stop"] + 1], dtype=np.int64) - begin + n_bytes)
+                for name in columns:
+                    columns[name].append(np.array(getattr(old, name)[rows]))
+                n += entry["stop"] - entry["start"]
+                n_bytes += end - begin
+                sha256 = entry["sha256"]
+                stats["reused"] += 1
+            else:
+                full_path = os.path.join(data_dir, path)
+                sha256 = file_hash(full_path)
+                label_codes, row_numbers, ends = [], [], []
+                for text, label, row in parse_source(full_path, source):
+                    if label not in labels:
+                        labels.append(label)
+                    encoded = text.encode("utf-8")
+                    text_file.write(encoded)
+                    n_bytes += len(encoded)
+                    ends.append(n_bytes)
+                    label_codes.append(labels.index(label))
+                    row_numbers.append(row)
+                count = len(label_codes)
+                offsets.append(np.array(ends, dtype=np.int64))
+                columns["label"].append(np.array(label_codes, dtype=np.int8))
+                columns["source"].append(np.full(count, source_names.index(source), dtype=np.int8))
+                columns["split"].append(np.full(count, SPLITS.index(split), dtype=np.int8))
+                columns["row"].append(np.array(row_numbers, dtype=np.int64))
+                n += count
+                stats["parsed"] += 1
+                if verbose:
+                    print(f"Parsed {count} rows from {path}")
+            files[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256, "start": start,
+                           "stop": n}
+
+    np.save(os.path.join(tmp_dir, "offsets.npy"), np.concatenate(offsets))
+    dtypes = {"label": np.int8, "source": np.int8, "split": np.int8, "row": np.int64}
+    for name, parts in columns.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.concatenate(parts).astype(dtypes[name]) if parts
+                else np.zeros(0, dtype=dtypes[name]))
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump({"version": FORMAT_VERSION, "labels": labels, "sources": source_names, "splits": SPLITS,
+                   "files": files}, f, indent=1)
+
+    del old # close the memory maps before replacing the files they map
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.replace(tmp_dir, cache_dir)
+    return stats
+
+
+def load_corpus(data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """
+    Updates the cache if any source changed, and loads it
+    """
+    build_corpus(data_dir, cache_dir)
+    return Corpus(cache_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the classifier dataset cache")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--rebuild', action='store_true', help="ignore the existing cache")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+    start = time.perf_counter()
+    stats = build_corpus(args.data_dir, args.cache_dir, verbose=True)
+    corpus = Corpus(args.cache_dir)
+    print(f"{len(corpus)} texts from {stats['reused'] + stats['parsed']} files ({stats['parsed']} parsed, "
+          f"{stats['reused']} reused, {stats['removed']} removed) in {time.perf_counter() - start:.2f} s")
@@ -1,9 +1,15 @@
 import pandas as pd
-from sklearn.naive_bayes import MultinomialNB, ComplementNB
+from sklearn.naive_bayes import MultinomialNB, ComplementNB, BernoulliNB
 from sklearn.model_selection import train_test_split
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer, HashingVectorizer
 import numpy as np
 import os
+import sys
+import zlib
+from corpus import load_corpus
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "DiscordBot", "crypto_scam_classifier"))
+from compiled_model import write_compiled_model
 np.random.seed(5)
 
 
@@ -22,26 +28,16 @@ def load_our_discord_dataset():
     but it is difficult to collect a large dataset of this kind, from our position. Nevertheless, this classifier serves
     as a prototype of a pipeline that can generalize well to larger datasets to achieve stronger performance.
     """
-    # Read in spam data from our collected Discord dataset
-    train_data, test_data = [], []
-    train_path = 'data/custom_discord_dataset/train'
-    test_path = 'data/custom_discord_dataset/test'
-
-    num_train, num_test = len(os.listdir(train_path)), len(os.listdir(test_path))
-    for filename in os.listdir(train_path):
-        with open(os.path.join(train_path, filename), 'r') as f:
-            message_text = f.read().replace('\n', ' ')
-            train_data.append(message_text)
+    corpus = load_corpus()
 
-    for filename in os.listdir(test_path):
-        with open(os.path.join(test_path, filename), 'r') as f:
-            message_text = f.read().replace('\n', ' ')
-            test_data.append(message_text)
+    # Read in spam data from our collected Discord dataset
+    train_data = corpus.texts(corpus.select("discord", "train"))
+    test_data = corpus.texts(corpus.select("discord", "test"))
+    num_train, num_test = len(train_data), len(test_data)
 
     # Read in Ham data from Crypto-Tweet GitHub repo, and randomly select messages to use
-    ham_data = pd.read_csv("data/crypto_tweet/crypto_tweet_aggregateddata.csv")
-    ham_data = ham_data[ham_data['Category'] == "Ham"]
-    ham_data = ham_data.iloc[np.random.choice(np.arange(len(ham_data)), num_train+num_test), :]['Tweet'].tolist()
+    ham_idxs = corpus.select("crypto_tweet", labels=["Ham"])
+    ham_data = corpus.texts(ham_idxs[np.random.choice(np.arange(len(ham_idxs)), num_train+num_test)])
 
     train_data.extend(ham_data[:num_train])
     test_data.extend(ham_data[num_train:])
@@ -60,16 +56,19 @@ def load_crypto_tweet_dataset():
     and balance it so that it has balanced classes (for ham vs. spam)
     """
     # Read in dataset
-    data = pd.read_csv("data/crypto_tweet/crypto_tweet_aggregateddata.csv")
-    data = data[data['Category'].isin(['Spam', 'Ham'])] # Ignore "Listings"
+    corpus = load_corpus()
+    idxs = corpus.select("crypto_tweet", labels=["Spam", "Ham"]) # Ignore "Listings"
+    categories = corpus.label_names(idxs)
 
     # Balance classes (to have half spam, half ham)
-    spam_idxs = np.where(data['Category']=="Spam")[0]
-    ham_idxs = np.where(data['Category'] == "Ham")[0]
+    spam_idxs = np.where(categories == "Spam")[0]
+    ham_idxs = np.where(categories == "Ham")[0]
     assert len(ham_idxs) > len(spam_idxs)
     ham_idxs_to_use = np.random.choice(ham_idxs, size=len(spam_idxs))
-    idxs_to_keep = np.concatenate([ham_idxs_to_use, spam_idxs])
-    data = data.iloc[idxs_to_keep, :]
+    idxs_to_keep = idxs[np.concatenate([ham_idxs_to_use, spam_idxs])]
+    rows = np.asarray(corpus.row[idxs_to_keep]) # index the tweets by their row in the CSV
+    data = pd.DataFrame({"Tweet": corpus.texts(idxs_to_keep), "Category": corpus.label_names(idxs_to_keep)},
+                        index=rows)
 
     # Train/test split
     X_train, X_test, Y_train, Y_test = train_test_split(data['Tweet'],
@@ -80,25 +79,141 @@ def load_crypto_tweet_dataset():
     return X_train, X_test, Y_train, Y_test
 
 
-def train_model(X_train, Y_train):
+DEFAULT_CONFIG = {
+    "vectorizer": "tfidf", # "tfidf", "tfidf_sublinear" (log of term counts), "count" or "binary" (word presence)
+    "ngram_range": (1, 1),
+    "classifier": "multinomial", # "multinomial", "complement" or "bernoulli"
+    "alpha": 1.0, # additive smoothing
+}
+
+
+def make_vectorizer(config, analyzer=None):
+    """
+    Returns an unfitted vectorizer for config (see DEFAULT_CONFIG). Stop words are always removed. An analyzer
+    (e.g. one working on pre-tokenized documents) replaces the built-in tokenizer, stop words and n-grams.
+    """
+    kind = config["vectorizer"]
+    if analyzer is not None:
+        options = {"analyzer": analyzer}
+    else:
+        options = {"stop_words": "english", "ngram_range": tuple(config["ngram_range"])}
+    if kind == "tfidf":
+        return TfidfVectorizer(**options)
+    if kind == "tfidf_sublinear":
+        return TfidfVectorizer(sublinear_tf=True, **options)
+    if kind == "count":
+        return CountVectorizer(**options)
+    if kind == "binary":
+        return CountVectorizer(binary=True, **options)
+    raise ValueError(f"Unknown vectorizer {kind}")
+
+
+def make_classifier(config):
+    kind = config["classifier"]
+    if kind == "multinomial":
+        return MultinomialNB(alpha=config["alpha"])
+    if kind == "complement":
+        return ComplementNB(alpha=config["alpha"])
+    if kind == "bernoulli":
+        return BernoulliNB(alpha=config["alpha"])
+    raise ValueError(f"Unknown classifier {kind}")
+
+
+def train_model(X_train, Y_train, config=None):
     """
     Trains the Naive Bayes model on X_train and Y_train
-    Uses TF-IDF when converting raw documents to a matrix of counts (so instead of raw counts, it downweights
+    By default, uses TF-IDF when converting raw documents to a matrix of counts (so instead of raw counts, it downweights
     common words using TF-IDF). We also completely ignore stop words like "the", etc. since these are not very meaningful
+    Other vectorizers, n-grams and Naive Bayes variants can be chosen with config (see DEFAULT_CONFIG, and sweep.py
+    to compare them). Only TF-IDF + MultinomialNB models can be exported with export_compiled_model.
     """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+
     # Vectorizer that creates the matrix of word counts (technically, TF-IDF features)
-    vectorizer = TfidfVectorizer(stop_words="english").fit(X_train)
-    # vectorizer = CountVectorizer(ngram_range=(1, 2), stop_words="english").fit(X_train)
+    vectorizer = make_vectorizer(config).fit(X_train)
 
     # Create Naive Bayes classifier
-    model = MultinomialNB()
-    # model = ComplementNB()
+    model = make_classifier(config)
 
     # Train classifier
     model.fit(vectorizer.transform(X_train), Y_train)
 
     return vectorizer, model
 
+def stream_our_discord_dataset(split):
+    """
+    Yields (message, "Spam") for every message in the given split ("train" or "test") of our custom Discord dataset,
+    reading one message at a time from the corpus cache
+    """
+    corpus = load_corpus()
+    for i in corpus.select("discord", split):
+        yield corpus.text(i), "Spam"
+
+
+def stream_crypto_tweet_dataset(split, train_fraction=0.65):
+    """
+    Yields (tweet, category) for the Spam/Ham rows of the crypto tweet dataset, reading one row at a time from the
+    corpus cache. Rows are assigned to the "train" or "test" split by a hash of their text, so the split is stable
+    across runs without ever holding the whole dataset in memory.
+    """
+    corpus = load_corpus()
+    for i in corpus.select("crypto_tweet", labels=["Spam", "Ham"]):
+        tweet = corpus.text(i)
+        in_train = zlib.crc32(tweet.encode('utf-8')) % 1000 < train_fraction * 1000
+        if in_train == (split == "train"):
+            yield tweet, corpus.labels[corpus.label[i]]
+
+
+def iter_chunks(documents, chunk_size):
+    """
+    Groups an iterable of (message, label) pairs into lists of messages and labels of at most chunk_size each
+    """
+    X_chunk, Y_chunk = [], []
+    for message, label in documents:
+        X_chunk.append(message)
+        Y_chunk.append(label)
+        if len(X_chunk) == chunk_size:
+            yield X_chunk, Y_chunk
+            X_chunk, Y_chunk = [], []
+    if X_chunk:
+        yield X_chunk, Y_chunk
+
+
+def make_hashing_vectorizer(n_features=2**20):
+    """
+    Stateless vectorizer for out-of-core training: words are hashed into n_features columns, so there is no
+    vocabulary to fit or hold in memory. TF-IDF needs corpus-wide document frequencies, so we use L2-normalized
+    term frequencies instead, and non-negative values since MultinomialNB requires them.
+    """
+    return HashingVectorizer(stop_words="english", n_features=n_features, alternate_sign=False, norm="l2")
+
+
+def update_model(vectorizer, model, X, Y):
+    """
+    Folds a batch of newly labelled messages (e.g. moderator decisions) into a model trained by
+    train_model_streaming, without retraining from scratch
+    """
+    model.partial_fit(vectorizer.transform(X), Y, classes=["Ham", "Spam"])
+    return model
+
+
+def train_model_streaming(documents, chunk_size=1000, n_features=2**20, vectorizer=None, model=None):
+    """
+    Out-of-core version of train_model: trains a Naive Bayes model on an iterable of (message, label) pairs
+    chunk_size messages at a time, so memory stays constant no matter how large the corpus is.
+    Since we cannot downsample Ham without a first pass over the data, we use a uniform class prior instead
+    of balancing the classes.
+    Pass an existing vectorizer and model to continue training them.
+    """
+    if vectorizer is None:
+        vectorizer = make_hashing_vectorizer(n_features)
+    if model is None:
+        model = MultinomialNB(fit_prior=False)
+    for X_chunk, Y_chunk in iter_chunks(documents, chunk_size):
+        update_model(vectorizer, model, X_chunk, Y_chunk)
+    return vectorizer, model
+
+
 def get_predictions(X_test, model, vectorizer, predict_proba=False):
     """
     Using the given model, gets spam vs. ham predictions on X_test
@@ -111,6 +226,36 @@ def get_predictions(X_test, model, vectorizer, predict_proba=False):
     return predictions
 
 
+def export_compiled_model(vectorizer, model, path):
+    """
+    Exports a fitted TfidfVectorizer + MultinomialNB pair to a pickle-free directory that
+    compiled_model.load_compiled_model can load with NumPy alone (see compiled_model.write_compiled_model for the
+    format), including the Naive Bayes counts so the model can be updated online
+    """
+    terms = [None] * len(vectorizer.vocabulary_)
+    for term, i in vectorizer.vocabulary_.items():
+        terms[i] = term
+
+    tfidf = vectorizer._tfidf
+    if not tfidf.use_idf:
+        idf = np.ones(len(terms))
+    elif hasattr(tfidf, "_idf_diag"):
+        idf = np.asarray(tfidf._idf_diag.diagonal()) # models pickled with older scikit-learn versions
+    else:
+        idf = np.asarray(tfidf.idf_)
+
+    write_compiled_model(path, terms, idf, model.feature_log_prob_.T, model.class_log_prior_, model.classes_, {
+        "token_pattern": vectorizer.token_pattern,
+        "lowercase": vectorizer.lowercase,
+        "stop_words": sorted(vectorizer.get_stop_words() or []),
+        "ngram_range": list(vectorizer.ngram_range),
+        "norm": tfidf.norm,
+        "sublinear_tf": tfidf.sublinear_tf,
+        "alpha": float(model.alpha),
+        "fit_prior": model.fit_prior
+    }, feature_count=model.feature_count_.T, class_count=model.class_count_)
+
+
 if __name__ == "__main__":
     # Load both datasets
     X_train_ct, X_test_ct, Y_train_ct, Y_test_ct = load_crypto_tweet_dataset()
@@ -140,10 +285,10 @@ if __name__ == "__main__":
 
     ########## Mixed dataset models
     # Create mixed datasets
-    X_train_mixed = X_train_ct.append(X_train_disc)
-    X_test_mixed = X_test_ct.append(X_test_disc)
-    Y_train_mixed = Y_train_ct.append(Y_train_disc)
-    Y_test_mixed = Y_test_ct.append(Y_test_disc)
+    X_train_mixed = pd.concat([X_train_ct, X_train_disc])
+    X_test_mixed = pd.concat([X_test_ct, X_test_disc])
+    Y_train_mixed = pd.concat([Y_train_ct, Y_train_disc])
+    Y_test_mixed = pd.concat([Y_test_ct, Y_test_disc])
 
     vectorizer_mixed, model_mixed = train_model(X_train_mixed, Y_train_mixed)
 
@@ -172,3 +317,4 @@ if __name__ == "__main__":
     # import pickle
     # pickle.dump(vectorizer_disc, open("models/trained_on_discord/vectorizer_disc.pickle", "wb"))
     # pickle.dump(model_disc, open("models/trained_on_discord/model_disc.pickle", "wb"))
+    # export_compiled_model(vectorizer_disc, model_disc, "models/trained_on_discord/model_disc")
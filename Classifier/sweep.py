@@ -0,0 +1,156 @@
+"""
+Compares vectorizer, n-gram, Naive Bayes and smoothing settings (see DEFAULT_CONFIG in naive_bayes_classifier.py)
+with k-fold cross-validation on a process pool, and reports the Pareto front of accuracy against inference cost.
+
+    python sweep.py --dataset mixed --folds 5 --json sweep.json
+
+The corpus is tokenized once (lowercased words without stop words, as train_model's vectorizers see them), and the
+token lists are handed to each worker when the pool starts; configurations then only build their n-grams and
+vectorize from the shared tokens instead of re-reading and re-tokenizing the documents. Cross-validation uses the
+training split only, so the test split stays untouched for benchmark.py.
+
+Inference cost is the time per message to turn the fold's held-out tokens into features and score them, measured in
+the workers while the pool is busy. Compare costs within a sweep rather than across machines.
+"""
+import argparse
+import functools
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+from naive_bayes_classifier import DEFAULT_CONFIG, make_vectorizer, make_classifier
+from benchmark import load_datasets
+
+# Worker state, set once per process by init_worker
+_tokens = None # token list of every document
+_labels = None # np.array of labels
+_folds = None # [(train indices, test indices)]
+
+
+def tokenize(X):
+    analyzer = make_vectorizer(DEFAULT_CONFIG).build_analyzer() # unigrams, so these are the plain tokens
+    return [analyzer(x) for x in X]
+
+
+def word_ngrams(tokens, ngram_range):
+    """
+    The n-grams of a token list, as CountVectorizer(ngram_range=ngram_range) would produce them
+    """
+    min_n, max_n = ngram_range
+    if max_n == 1:
+        return tokens
+    terms = list(tokens) if min_n == 1 else []
+    for n in range(max(min_n, 2), max_n + 1):
+        terms.extend(" ".join(tokens[i:i+n]) for i in range(len(tokens) - n + 1))
+    return terms
+
+
+def init_worker(tokens, labels, folds):
+    global _tokens, _labels, _folds
+    _tokens, _labels, _folds = tokens, labels, folds
+
+
+def evaluate(config, fold):
+    """
+    Trains config on the training part of a fold and returns its accuracy, seconds per message to score the
+    held-out part, and number of features
+    """
+    train_idx, test_idx = _folds[fold]
+    analyzer = functools.partial(word_ngrams, ngram_range=tuple(config["ngram_range"]))
+    vectorizer = make_vectorizer(config, analyzer=analyzer)
+    model = make_classifier(config)
+    model.fit(vectorizer.fit_transform([_tokens[i] for i in train_idx]), _labels[train_idx])
+
+    held_out = [_tokens[i] for i in test_idx]
+    start = time.perf_counter()
+    proba = model.predict_proba(vectorizer.transform(held_out))
+    seconds_per_message = (time.perf_counter() - start) / len(held_out)
+    predictions = model.classes_[proba.argmax(axis=1)]
+    return (predictions == _labels[test_idx]).mean(), seconds_per_message, len(vectorizer.vocabulary_)
+
+
+def make_grid(vectorizers, max_ngrams, classifiers, alphas):
+    return [{"vectorizer": v, "ngram_range": (1, n), "classifier": c, "alpha": a}
+            for v, n, c, a in itertools.product(vectorizers, max_ngrams, classifiers, alphas)]
+
+
+def pareto_front(results):
+    """
+    Returns the results no other result beats on both accuracy and inference cost, cheapest first
+    """
+    front = []
+    for result in sorted(results, key=lambda r: (r["latency_us"], -r["accuracy"])):
+        if not front or result["accuracy"] > front[-1]["accuracy"]:
+            front.append(result)
+    return front
+
+
+def sweep(X, Y, grid, folds=5, seed=0, processes=None):
+    """
+    Cross-validates every configuration of grid on the documents X with labels Y. Returns one result per
+    configuration, with its mean and standard deviation of accuracy over the folds, median inference cost in
+    microseconds per message and mean number of features.
+    """
+    tokens = tokenize(X)
+    labels = np.asarray(Y)
+    splits = [(train, test) for train, test in
+              StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(np.zeros(len(labels)), labels)]
+    tasks = [(config, fold) for config in grid for fold in range(folds)]
+    with ProcessPoolExecutor(processes, initializer=init_worker, initargs=(tokens, labels, splits)) as pool:
+        scores = list(pool.map(evaluate, *zip(*tasks), chunksize=max(1, len(tasks) // (4 * (processes or os.cpu_count())))))
+
+    results = []
+    for i, config in enumerate(grid):
+        accuracies, seconds, n_features = zip(*scores[i*folds:(i+1)*folds])
+        results.append(dict(config, ngram_range=list(config["ngram_range"]),
+                            accuracy=float(np.mean(accuracies)), accuracy_std=float(np.std(accuracies)),
+                            latency_us=float(np.median(seconds) * 1e6), n_features=float(np.mean(n_features))))
+    return results
+
+
+def describe(result):
+    return (f"{result['vectorizer']:<16}{'1-' + str(result['ngram_range'][1]):<7}{result['classifier']:<13}"
+            f"{result['alpha']:<7}{result['accuracy']:>7.3f} +- {result['accuracy_std']:.3f}"
+            f"{result['latency_us']:>9.1f}{result['n_features']:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validated sweep of classifier configurations")
+    parser.add_argument('--dataset', choices=["ct", "discord", "mixed"], default="mixed")
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--seed', type=int, default=5)
+    parser.add_argument('--vectorizers', default="tfidf,tfidf_sublinear,count,binary")
+    parser.add_argument('--max-ngrams', default="1,2", help="n-gram ranges to try, as their largest n")
+    parser.add_argument('--classifiers', default="multinomial,complement,bernoulli")
+    parser.add_argument('--alphas', default="0.01,0.1,0.5,1.0")
+    parser.add_argument('--top', type=int, default=10, help="configurations to print besides the Pareto front")
+    parser.add_argument('--json', help="write every configuration's results and the Pareto front to this file")
+    args = parser.parse_args()
+
+    grid = make_grid(args.vectorizers.split(","), [int(n) for n in args.max_ngrams.split(",")],
+                     args.classifiers.split(","), [float(a) for a in args.alphas.split(",")])
+    X_train, _, Y_train, _ = load_datasets(args.seed)[args.dataset]
+    start = time.perf_counter()
+    results = sweep(list(X_train), list(Y_train), grid, folds=args.folds, seed=args.seed, processes=args.processes)
+    front = pareto_front(results)
+    print(f"{len(grid)} configurations x {args.folds} folds on {len(X_train)} {args.dataset} messages in "
+          f"{time.perf_counter() - start:.1f} s\n")
+
+    header = f"{'vectorizer':<16}{'ngram':<7}{'classifier':<13}{'alpha':<7}{'accuracy':>16}{'us/msg':>9}{'features':>10}"
+    print("Pareto front (accuracy vs. inference cost):")
+    print(header)
+    for result in front:
+        print(describe(result))
+    print(f"\nTop {args.top} by accuracy:")
+    print(header)
+    for result in sorted(results, key=lambda r: -r["accuracy"])[:args.top]:
+        print(describe(result))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"dataset": args.dataset, "folds": args.folds, "seed": args.seed, "results": results,
+                       "pareto_front": front}, f, indent=2)
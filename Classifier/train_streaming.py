@@ -0,0 +1,42 @@
+"""
+Trains the crypto scam classifier out-of-core, with the hashing vectorizer and partial_fit (see
+train_model_streaming in naive_bayes_classifier.py). Memory use does not grow with the size of the corpus.
+
+    python train_streaming.py --chunk-size 1000 --save models/streaming
+"""
+import argparse
+import itertools
+import os
+import pickle
+import numpy as np
+from naive_bayes_classifier import (stream_our_discord_dataset, stream_crypto_tweet_dataset, iter_chunks,
+                                    train_model_streaming)
+
+
+def streaming_accuracy(documents, model, vectorizer, chunk_size):
+    correct, total = 0, 0
+    for X_chunk, Y_chunk in iter_chunks(documents, chunk_size):
+        correct += (model.predict(vectorizer.transform(X_chunk)) == np.array(Y_chunk)).sum()
+        total += len(Y_chunk)
+    return correct / total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Out-of-core Naive Bayes training")
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--n-features', type=int, default=2**20)
+    parser.add_argument('--save', help="directory to pickle the vectorizer and model to")
+    args = parser.parse_args()
+
+    train_documents = itertools.chain(stream_our_discord_dataset("train"), stream_crypto_tweet_dataset("train"))
+    vectorizer, model = train_model_streaming(train_documents, chunk_size=args.chunk_size, n_features=args.n_features)
+
+    print("Accuracy of streaming model on Discord test set:",
+          streaming_accuracy(stream_our_discord_dataset("test"), model, vectorizer, args.chunk_size))
+    print("Accuracy of streaming model on CT test set:",
+          streaming_accuracy(stream_crypto_tweet_dataset("test"), model, vectorizer, args.chunk_size))
+
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+        pickle.dump(vectorizer, open(os.path.join(args.save, "vectorizer_streaming.pickle"), "wb"))
+        pickle.dump(model, open(os.path.join(args.save, "model_streaming.pickle"), "wb"))
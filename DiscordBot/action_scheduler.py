@@ -0,0 +1,245 @@
+# action_scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import aiohttp
+import discord
+
+log = logging.getLogger('modbot')
+
+# Priority lanes: a route always runs its most urgent queued action next
+URGENT = 0 # immediate danger
+NORMAL = 1 # moderator decisions
+BULK = 2 # auto-flag reactions and notices
+
+# Discord's documented per-route limits, as (requests per second, burst)
+DEFAULT_LIMITS = {
+    "reaction": (4, 1), # reactions: one per 250 ms per channel
+    "message": (1, 5), # messages: 5 per 5 s per channel
+    "dm": (1, 5), # direct messages: 5 per 5 s per user
+}
+GLOBAL_LIMIT = (50, 50) # requests per second across all routes
+RATE_MARGIN = 0.9 # stay a little under the limits, requests don't reach Discord exactly as spaced as they were sent
+MAX_MESSAGE_LENGTH = 2000
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0 # set from Discord's retry_after when we get rate limited anyway
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        '''
+        Returns how long to wait before a token is available (0 if one is available now)
+        '''
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def block(self, seconds):
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def full_in(self):
+        return max(0.0, self.blocked_until - time.monotonic()) + (self.capacity - self.tokens) / self.rate
+
+
+def retry_after(e):
+    '''
+    Returns how long Discord asked us to wait for a rate limited request, or None if e is not a rate limit
+    '''
+    if isinstance(e, discord.RateLimited):
+        return e.retry_after
+    if isinstance(e, discord.HTTPException) and e.status == 429:
+        headers = getattr(e.response, "headers", None) or {}
+        return float(headers.get("Retry-After", 1))
+    return None
+
+
+class ActionScheduler(object):
+    '''
+    Sends the bot's outbound Discord actions (reactions, mod channel posts, DMs) without tripping rate limits.
+
+    - Actions are queued per route, e.g. ("reaction", channel id), and each route is drained by its own worker
+      that waits on the route's token bucket and a global bucket, so a raid in one channel is paced instead of
+      hitting 429s, and never delays actions in other channels.
+    - Each route runs its most urgent lane first (URGENT > NORMAL > BULK), FIFO within a lane.
+    - Failed actions are retried up to max_retries times: after Discord's retry_after for rate limits, and with
+      exponential backoff for server and connection errors. Other errors (e.g. Forbidden, NotFound) fail at once.
+    - post_coalesced() buffers lines for a channel for coalesce_window seconds and posts them as one message.
+    submit() and the helpers return a future with the action's result; callers that don't need it can ignore it.
+    '''
+
+    def __init__(self, limits=None, global_limit=GLOBAL_LIMIT, max_retries=3, backoff=0.5, coalesce_window=2.0):
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.global_bucket = TokenBucket(global_limit[0] * RATE_MARGIN, global_limit[1])
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.coalesce_window = coalesce_window
+        self._counter = itertools.count()
+        self._routes = {} # route -> [token bucket, heap of (lane, sequence number, action, future), worker task]
+        self._coalesced = {} # (channel id, header) -> (channel, lane, list of lines)
+        self._running = 0 # actions being executed
+        self.stats = {"actions": 0, "retries": 0, "rate_limited": 0, "failed": 0, "coalesced": 0}
+
+    def submit(self, route, action, lane=NORMAL):
+        '''
+        Queues action, a function returning an awaitable (e.g. `lambda: message.add_reaction(emoji)`), on route.
+        route is a (kind, id) tuple whose kind is a key of the limits.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        state = self._routes.get(route)
+        if state is None:
+            rate, capacity = self.limits[route[0]]
+            state = self._routes[route] = [TokenBucket(rate * RATE_MARGIN, capacity), [], None]
+        heapq.heappush(state[1], (lane, next(self._counter), action, future))
+        if state[2] is None:
+            state[2] = asyncio.ensure_future(self._run_route(route, state))
+        self.stats["actions"] += 1
+        return future
+
+    def react(self, message, emoji, lane=BULK):
+        return self.submit(("reaction", message.channel.id), lambda: message.add_reaction(emoji), lane)
+
+    def remove_reaction(self, message, emoji, member, lane=NORMAL):
+        '''
+        Removes member's emoji reaction from message. A reaction that isn't there (e.g. it is still queued, or the
+        message is a stale snapshot) is not an error.
+        '''
+        async def remove():
+            try:
+                return await message.remove_reaction(emoji, member)
+            except discord.NotFound:
+                return None
+        return self.submit(("reaction", message.channel.id), remove, lane)
+
+    def send(self, channel, content, lane=NORMAL):
+        return self.submit(("message", channel.id), lambda: channel.send(content), lane)
+
+    def send_dm(self, client, user_id, content, lane=NORMAL):
+        async def dm():
+            user = client.get_user(user_id) or await client.fetch_user(user_id)
+            return await user.send(content)
+        return self.submit(("dm", user_id), dm, lane)
+
+    def post_coalesced(self, channel, header, line, lane=BULK):
+        '''
+        Adds line to the next "header" post in channel. All lines added within coalesce_window seconds of the first
+        one are posted together (split into several messages if they don't fit in one).
+        '''
+        key = (channel.id, header)
+        if key in self._coalesced:
+            self._coalesced[key][2].append(line)
+            self.stats["coalesced"] += 1
+            return
+        self._coalesced[key] = (channel, lane, [line])
+        asyncio.get_running_loop().call_later(self.coalesce_window, self._flush_coalesced, key)
+
+    def _flush_coalesced(self, key):
+        if key not in self._coalesced:
+            return # already flushed by drain()
+        channel, lane, lines = self._coalesced.pop(key)
+        header = key[1].format(count=len(lines))
+        content = header
+        for line in lines:
+            if len(content) + 1 + len(line) > MAX_MESSAGE_LENGTH:
+                self.send(channel, content, lane)
+                content = header
+            content += "\n" + line
+        self.send(channel, content, lane)
+
+    async def _run_route(self, route, state):
+        bucket, heap, _ = state
+        while True:
+            while heap:
+                delay = max(bucket.delay(), self.global_bucket.delay())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                bucket.take()
+                self.global_bucket.take()
+                # pop after waiting, so an urgent action queued meanwhile goes first
+                _, _, action, future = heapq.heappop(heap)
+                if future.cancelled():
+                    continue
+                self._running += 1
+                try:
+                    await self._execute(bucket, action, future)
+                finally:
+                    self._running -= 1
+            # Linger until the bucket has refilled; a new route would start with a full bucket anyway
+            await asyncio.sleep(bucket.full_in())
+            if not heap:
+                del self._routes[route]
+                return
+
+    async def _execute(self, bucket, action, future):
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await action()
+            except (discord.HTTPException, discord.RateLimited, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                wait = retry_after(e)
+                if wait is not None:
+                    self.stats["rate_limited"] += 1
+                    bucket.block(wait)
+                elif not isinstance(e, discord.HTTPException) or e.status >= 500:
+                    wait = self.backoff * 2 ** attempt
+                # else our fault (missing permissions, deleted message...): retrying won't help
+                if wait is None or attempt == self.max_retries:
+                    self.stats["failed"] += 1
+                    log.warning("Discord action failed: %r", e)
+                    if not future.done():
+                        future.set_exception(e)
+                        future.exception() # mark it retrieved, most callers don't wait for the result
+                    return
+                self.stats["retries"] += 1
+                await asyncio.sleep(wait)
+                continue
+            if not future.done():
+                future.set_result(result)
+            return
+
+    def pending(self):
+        return sum(len(state[1]) for state in self._routes.values())
+
+    async def drain(self):
+        '''
+        Waits until every queued and coalesced action has been sent (or has failed)
+        '''
+        while self._coalesced:
+            for key in list(self._coalesced):
+                self._flush_coalesced(key)
+        while self.pending() or self._running:
+            await asyncio.sleep(0.01)
+
+    async def close(self, timeout=None):
+        '''
+        Sends the queued actions, then stops the workers. Actions still queued after timeout seconds (e.g. the
+        bulk reactions of a raid, paced at a few per second) are dropped and their futures cancelled.
+        '''
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            if self.pending():
+                log.warning("Dropping %d queued Discord actions", self.pending())
+        for state in list(self._routes.values()):
+            state[2].cancel()
+            for _, _, _, future in state[1]:
+                future.cancel()
+        self._routes.clear()
@@ -0,0 +1,141 @@
+# async_logging.py
+'''
+Logging that never blocks the event loop. Handlers attached to loggers only put records on a bounded in-memory
+queue; a background thread formats them as JSON lines and writes them to a file rotated by size and age.
+
+    listener, queue_handler = setup_logging('discord.log')
+    ...
+    listener.stop() # writes out what is still queued
+
+- Records are JSON objects with time, level, logger and message, plus the dict passed as
+  `extra={"fields": {...}}`.
+- DEBUG records are sampled: only every debug_sample_every-th record of each message template is kept, and it
+  carries "sampled": N so counts can be scaled back up.
+- When the queue is full (the disk can't keep up), new records are dropped and counted instead of waiting.
+'''
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        sampled = getattr(record, "sampled", None)
+        if sampled:
+            entry["sampled"] = sampled
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    '''
+    Rotates the file once it reaches max_bytes or is older than interval seconds, keeping backup_count old files
+    (path.1 being the most recent)
+    '''
+
+    def __init__(self, path, max_bytes, interval, backup_count):
+        super().__init__(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.interval = interval
+        self.opened = time.time()
+
+    def shouldRollover(self, record):
+        if self.interval and time.time() - self.opened >= self.interval:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.opened = time.time()
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Keeps every record above DEBUG, and the 1st, (every+1)th, (2*every+1)th... DEBUG record of each message template
+    '''
+
+    def __init__(self, every, max_templates=10000):
+        super().__init__()
+        self.every = every
+        self.max_templates = max_templates
+        self.counts = {} # (logger name, message template) -> DEBUG records seen
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every <= 1:
+            return True
+        key = (record.name, record.msg)
+        count = self.counts.get(key, 0)
+        if count == 0 and len(self.counts) >= self.max_templates:
+            self.counts.clear() # messages built with f-strings instead of templates
+        self.counts[key] = count + 1
+        if count % self.every:
+            self.sampled_out += 1
+            return False
+        record.sampled = self.every
+        return True
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    '''
+    QueueHandler that samples DEBUG records (see SamplingFilter) and drops records instead of blocking when the
+    queue is full. Records are queued as they are: formatting (and merging the message arguments) happens in the
+    listener thread, so log immutable values.
+    '''
+
+    def __init__(self, record_queue, debug_sample_every=1):
+        super().__init__(record_queue)
+        self.sampling = SamplingFilter(debug_sample_every)
+        self.addFilter(self.sampling)
+        self.queued = 0
+        self.dropped = 0
+
+    @property
+    def stats(self):
+        return {"queued": self.queued, "dropped": self.dropped, "sampled_out": self.sampling.sampled_out,
+                "backlog": self.queue.qsize()}
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(path, level=logging.DEBUG, loggers=('discord', 'modbot'), max_bytes=10 * 1024 * 1024,
+                  interval=24 * 3600, backup_count=5, queue_size=10000, debug_sample_every=100):
+    '''
+    Sends the records of `loggers` at `level` and above to path through a bounded queue and a writer thread.
+    Returns the started QueueListener and the BoundedQueueHandler (whose stats count queued, dropped and sampled
+    out records).
+    '''
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    file_handler = SizeAndTimeRotatingFileHandler(path, max_bytes, interval, backup_count)
+    file_handler.setFormatter(JsonFormatter())
+    queue_handler = BoundedQueueHandler(queue.Queue(queue_size), debug_sample_every)
+    for name in loggers:
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler)
+    listener.start()
+    return listener, queue_handler
@@ -0,0 +1,88 @@
+# bench_action_scheduler.py
+'''
+Simulates a raid against fake_discord.py and compares firing moderation actions directly from the handlers (as the
+bot used to) with queueing them on the ActionScheduler.
+
+Each raid message gets a reaction, and every auto-flagged one also gets a mod channel notice. Halfway through the
+raid, a moderator flags an immediate danger report, which needs a reaction and a mod channel post.
+
+    python bench_action_scheduler.py --messages 200 --latency 0.02
+'''
+import argparse
+import asyncio
+import time
+import discord
+from action_scheduler import ActionScheduler, retry_after, URGENT, BULK
+from fake_discord import FakeDiscord, FakeGuild, FakeUser
+
+AUTO_FLAG_HEADER = "Auto-flagged {count} messages for review:"
+
+
+async def direct(action):
+    # What discord.py does on a 429: wait Retry-After and try again
+    while True:
+        try:
+            return await action()
+        except discord.HTTPException as e:
+            wait = retry_after(e)
+            if wait is None:
+                raise
+            await asyncio.sleep(wait)
+
+
+async def raid(n, latency, use_scheduler):
+    api = FakeDiscord(latency=latency)
+    guild = FakeGuild(api, 1, "guild")
+    channel = guild.add_channel("group-16")
+    mod_channel = guild.add_channel("group-16-mod")
+    raider = FakeUser(api, 2, "raider")
+    scheduler = ActionScheduler() if use_scheduler else None
+
+    start = time.monotonic()
+    tasks = []
+    urgent = {}
+
+    async def urgent_action():
+        message = channel.post(raider, "someone is in danger")
+        urgent["queued"] = time.monotonic()
+        if scheduler:
+            await asyncio.gather(scheduler.react(message, "🆘", URGENT),
+                                 scheduler.send(mod_channel, "Immediate danger report!", URGENT))
+        else:
+            await asyncio.gather(direct(lambda: message.add_reaction("🆘")),
+                                 direct(lambda: mod_channel.send("Immediate danger report!")))
+        urgent["done"] = time.monotonic()
+
+    for i in range(n):
+        message = channel.post(raider, f"free btc giveaway {i}")
+        flagged = i % 3 == 0
+        if scheduler:
+            scheduler.react(message, "❓" if flagged else "🤬", BULK)
+            if flagged:
+                scheduler.post_coalesced(mod_channel, AUTO_FLAG_HEADER, message.jump_url)
+        else:
+            tasks.append(asyncio.ensure_future(direct(lambda m=message, e="❓" if flagged else "🤬": m.add_reaction(e))))
+            if flagged:
+                tasks.append(asyncio.ensure_future(direct(lambda u=message.jump_url: mod_channel.send(
+                    f"Auto-flagged message for review: {u}"))))
+        if i == n // 2:
+            tasks.append(asyncio.ensure_future(urgent_action()))
+        await asyncio.sleep(0.005) # messages arrive over time
+
+    await asyncio.gather(*tasks)
+    if scheduler:
+        await scheduler.drain()
+        await scheduler.close()
+    return time.monotonic() - start, urgent["done"] - urgent["queued"], api.stats, len(mod_channel.messages)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Outbound action scheduler benchmark against a fake Discord")
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02, help="simulated Discord request latency, in seconds")
+    args = parser.parse_args()
+
+    for name, use_scheduler in (("direct", False), ("scheduler", True)):
+        total, urgent_latency, stats, mod_posts = asyncio.run(raid(args.messages, args.latency, use_scheduler))
+        print(f"{name:9}: all actions done in {total:6.2f} s, immediate danger handled in {urgent_latency:6.2f} s, "
+              f"{stats['requests']} requests ({stats['rate_limited']} rate limited), {mod_posts} mod channel posts")
@@ -0,0 +1,79 @@
+# bench_blacklist.py
+'''
+Microbenchmark of the old check_message_against_blacklist logic against blacklist.Blacklist.
+
+    python bench_blacklist.py --entries 300000 --messages 20000
+'''
+import argparse
+import random
+import re
+import string
+import time
+from blacklist import Blacklist
+
+
+def legacy_find_matches(scamaddr, text):
+    # The matching logic ModBot.check_message_against_blacklist used before blacklist.py
+    bitcoin_regex = re.compile(r'\b([13][a-km-zA-HJ-NP-Z1-9]{25,34}|bc1[ac-hj-np-zAC-HJ-NP-Z02-9]{11,71})\b')
+    bitcoin_addresses = bitcoin_regex.findall(text)
+    url_regex = re.compile(r"((https?:\/\/)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*))")
+    urls = url_regex.findall(text)
+
+    matches = []
+    for addr in bitcoin_addresses:
+        if addr in scamaddr:
+            matches.append(addr)
+    for url in urls:
+        url = url[0]
+        url_trimmed = re.sub(r"^(https?:\/\/)?(www\.)?", "", url).rstrip("/")
+        if url_trimmed in scamaddr:
+            matches.append(url_trimmed)
+    return matches
+
+
+def random_domain(rng):
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(6, 14))) + rng.choice([".com", ".net", ".io", ".xyz"])
+
+
+def make_messages(rng, domains, n):
+    filler = "hey everyone check out this amazing giveaway, send 0.1 btc and receive double back".split()
+    messages = []
+    for _ in range(n):
+        words = rng.sample(filler, 8)
+        if rng.random() < 0.5:
+            domain = rng.choice(domains) if rng.random() < 0.5 else random_domain(rng)
+            words.insert(rng.randrange(len(words)), f"https://www.{domain}/")
+        if rng.random() < 0.2:
+            words.append("15a8R7dAVBnXxYkAkL4Rp7HeY3jacb2N3B")
+        messages.append(" ".join(words))
+    return messages
+
+
+def timeit(fn, messages):
+    start = time.perf_counter()
+    hits = sum(1 for text in messages if fn(text))
+    return time.perf_counter() - start, hits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Blacklist matching microbenchmark")
+    parser.add_argument('--entries', type=int, default=300000)
+    parser.add_argument('--messages', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    domains = [random_domain(rng) for _ in range(args.entries)]
+    entries = domains + ['15a8R7dAVBnXxYkAkL4Rp7HeY3jacb2N3B']
+    messages = make_messages(rng, domains, args.messages)
+
+    start = time.perf_counter()
+    blacklist = Blacklist(entries)
+    build_time = time.perf_counter() - start
+    scamaddr = set(entries)
+
+    legacy_time, legacy_hits = timeit(lambda text: legacy_find_matches(scamaddr, text), messages)
+    new_time, new_hits = timeit(blacklist.find_matches, messages)
+
+    print(f"{len(blacklist)} entries, index built in {build_time:.2f} s")
+    print(f"legacy:    {legacy_time / args.messages * 1e6:7.2f} us/message ({legacy_hits} hits)")
+    print(f"Blacklist: {new_time / args.messages * 1e6:7.2f} us/message ({new_hits} hits)")
@@ -0,0 +1,79 @@
+# bench_moderation_store.py
+'''
+Measures the moderation store: write throughput while reports are queued and resolved from the event loop, and the
+restart-to-ready time of rebuilding the review queue from disk.
+
+    python bench_moderation_store.py --reports 100000
+'''
+import argparse
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+from moderation_store import ModerationStore, ABUSIVE_REPORTED_ACCOUNT
+from review_queue import ReviewQueue
+
+
+class BenchReport(object):
+    # Same fields as bot.ForwardedReport; bot.py cannot be imported without starting the bot
+    report_id = None
+
+    def __init__(self, i, d=None):
+        self.d = d if d is not None else {"reported_content": f"send 0.1 btc to win {i}", "reported_account": i % 5000,
+                  "report_time": str(datetime.datetime.now()), "reporter_account": i, "auto_flagged": False,
+                  "scores": None, "mod_report": {"message": {"author": "scammer", "content": f"send 0.1 btc {i}",
+                                                             "url": f"https://discord.com/channels/1/2/{i}"},
+                                                 "immediate_danger": i % 10 == 0}}
+
+    def todict(self):
+        return self.d
+
+
+async def write_load(store, queue, n):
+    '''
+    Queues n reports, resolves half of them and records a strike for each resolved one, like moderators working
+    through a raid. Returns the time spent in the event loop and the time until everything is on disk.
+    '''
+    start = time.perf_counter()
+    for i in range(n):
+        queue.push(BenchReport(i), (i % 10 != 0, i), f"https://discord.com/channels/1/2/{i}", i % 5000, reporter=i)
+        if i % 2:
+            queue.pop()
+            # give the flush timer a chance to run, as it would between Discord events
+            if i % 1000 == 1:
+                await asyncio.sleep(0)
+    for report_id in list(queue.in_review):
+        queue.resolve(report_id)
+        store.put_strike(ABUSIVE_REPORTED_ACCOUNT, report_id % 5000, report_id)
+    loop_time = time.perf_counter() - start
+    await store.flush_async()
+    return loop_time, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Moderation store benchmark")
+    parser.add_argument('--reports', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "moderation.db")
+        store = ModerationStore(path)
+        queue = ReviewQueue(store=store)
+        loop_time, total_time = asyncio.run(write_load(store, queue, args.reports))
+        print(f"{store.stats['changes']} changes in {total_time:.2f} s ({store.stats['changes'] / total_time:,.0f} changes/s), "
+              f"{loop_time:.2f} s of it on the event loop")
+        print(f"{store.stats['rows_written']} rows written in {store.stats['transactions']} transactions")
+        asyncio.run(store.close())
+
+        start = time.perf_counter()
+        store = ModerationStore(path)
+        state = store.load()
+        queue = ReviewQueue()
+        for report_id, d, message_url, reported_account, reporter in state["reports"]:
+            queue.push(BenchReport(report_id, d), (not d["mod_report"]["immediate_danger"], datetime.datetime.fromisoformat(d["report_time"])),
+                       message_url, reported_account, reporter=reporter, report_id=report_id)
+        queue.store = store
+        print(f"restart to ready: {len(queue)} queued reports and {len(state['strikes'][ABUSIVE_REPORTED_ACCOUNT])} "
+              f"strike records restored in {(time.perf_counter() - start) * 1000:.0f} ms")
+        asyncio.run(store.close())
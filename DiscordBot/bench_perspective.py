@@ -0,0 +1,61 @@
+# bench_perspective.py
+'''
+Compares the old blocking requests.post scoring path against PerspectiveClient, using the local stub server.
+
+    python bench_perspective.py --messages 200 --latency 100 --concurrency 8
+'''
+import argparse
+import asyncio
+import json
+import time
+import requests
+from perspective_client import PerspectiveClient
+from perspective_stub import start_stub
+
+
+def blocking_score(url, text):
+    # This is what ModBot.eval_text used to do for every message
+    data_dict = PerspectiveClient(None).build_request(text)
+    response = requests.post(url + '?key=stub', data=json.dumps(data_dict))
+    return response.json()
+
+
+async def run(args):
+    runner, url = await start_stub(port=args.port, latency=args.latency / 1000)
+    texts = [f"message number {i}" for i in range(args.messages)]
+    loop = asyncio.get_running_loop()
+    try:
+        # Blocking client: run in a thread only so the stub (in this same loop) can answer; the calls are still serial
+        start = time.perf_counter()
+        for text in texts:
+            await loop.run_in_executor(None, blocking_score, url, text)
+        blocking_time = time.perf_counter() - start
+
+        client = PerspectiveClient('stub', url=url, max_concurrency=args.concurrency)
+        latencies = []
+
+        async def timed_score(text):
+            t = time.perf_counter()
+            await client.score(text)
+            latencies.append(time.perf_counter() - t)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[timed_score(text) for text in texts])
+        async_time = time.perf_counter() - start
+        await client.close()
+    finally:
+        await runner.cleanup()
+
+    latencies.sort()
+    print(f"blocking requests.post:  {args.messages / blocking_time:8.1f} msg/s")
+    print(f"PerspectiveClient:       {args.messages / async_time:8.1f} msg/s "
+          f"(p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perspective client throughput benchmark")
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=100, help="simulated stub latency, in ms")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--port', type=int, default=8765)
+    asyncio.run(run(parser.parse_args()))
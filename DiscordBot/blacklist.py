@@ -0,0 +1,196 @@
+# blacklist.py
+import re
+
+# Compiled once at import instead of on every message
+BITCOIN_REGEX = re.compile(r'\b([13][a-km-zA-HJ-NP-Z1-9]{25,34}|bc1[ac-hj-np-zAC-HJ-NP-Z02-9]{11,71})\b')
+URL_REGEX = re.compile(r"((https?:\/\/)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*))")
+# Splits a URL into host and the rest in one pass, dropping the scheme, "www.", user info and port
+URL_PARTS_REGEX = re.compile(r"^(?:[a-z][a-z0-9+.\-]*:\/\/)?(?:[^@\/?#]*@)?(?:www\.)?([^\/?#:]*)(?::\d*)?([^#]*)")
+TRAILING_PUNCTUATION = "/.,;:!?)]}'\""
+MIN_ADDRESS_LENGTH = 14 # shortest string BITCOIN_REGEX can match ("bc1" + 11 characters)
+
+
+def is_bitcoin_address(entry):
+    return BITCOIN_REGEX.fullmatch(entry) is not None
+
+
+def normalize_url(url):
+    '''
+    Normalizes a URL for blacklist lookups and returns (host, normalized_url), e.g.
+    "HTTPS://www.Scam.com/Claim/)." -> ("scam.com", "scam.com/claim")
+    '''
+    match = URL_PARTS_REGEX.match(url.strip().lower())
+    host = match.group(1).rstrip(".")
+    path = match.group(2).rstrip(TRAILING_PUNCTUATION)
+    return host, host + path
+
+
+def blacklist_key(entry):
+    '''
+    Canonical form of a blacklist entry: the address itself for Bitcoin addresses, the normalized URL otherwise.
+    '''
+    entry = entry.strip()
+    if is_bitcoin_address(entry):
+        return entry
+    return normalize_url(entry)[1]
+
+
+def host_suffixes(host):
+    '''
+    "a.scam.co.uk" -> "a.scam.co.uk", "scam.co.uk", "co.uk"
+    '''
+    labels = host.split(".")
+    for i in range(max(len(labels) - 1, 1)):
+        yield ".".join(labels[i:])
+
+
+class DomainTrie(object):
+    '''
+    Suffix trie over domain labels: "scam.co.uk" is stored as uk -> co -> scam. Looking up a host walks its labels
+    from the right, so it costs O(number of labels) no matter how many domains are stored, and any subdomain of a
+    stored domain (e.g. "claim.scam.co.uk") is found too.
+    '''
+    _END = ""  # marks a stored domain; never collides with a label since labels are non-empty
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def add(self, domain):
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, {})
+        if self._END in node:
+            return False
+        node[self._END] = domain
+        self.size += 1
+        return True
+
+    def match(self, host):
+        '''
+        Returns the stored domain that host equals or is a subdomain of, or None.
+        '''
+        node = self.root
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                return None
+            if self._END in node:
+                return node[self._END]
+        return None
+
+    def __contains__(self, domain):
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+        return self._END in node
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            for label, child in node.items():
+                if label == self._END:
+                    yield child
+                else:
+                    stack.append(child)
+
+
+class Blacklist(object):
+    '''
+    The platform's internal blacklist of scam URLs and crypto addresses.
+    - Bitcoin addresses are matched exactly (they are case-sensitive).
+    - Bare domains ("scam.com") match that host and all of its subdomains, whatever the path.
+    - URLs with a path ("bit.ly/abc") match that normalized URL exactly.
+
+    Entries passed in are kept in memory. If a store (see blacklist_store.py) is given, it is also searched, and
+    entries added later are persisted to it instead of being kept in memory.
+    '''
+
+    def __init__(self, entries=(), store=None):
+        self.addresses = set()
+        self.urls = set()
+        self.domains = DomainTrie()
+        self.store = None
+        for entry in entries:
+            self.add(entry)
+        self.store = store
+
+    def add(self, entry):
+        '''
+        Adds an address or URL to the blacklist. Returns False if it was already blacklisted.
+        '''
+        entry = entry.strip()
+        if entry in self:
+            return False
+        if self.store is not None:
+            return self.store.add(entry)
+        if is_bitcoin_address(entry):
+            self.addresses.add(entry)
+            return True
+        host, url = normalize_url(entry)
+        if url == host:
+            return self.domains.add(host)
+        self.urls.add(url)
+        return True
+
+    def _has_address(self, address):
+        return address in self.addresses or (self.store is not None and address in self.store)
+
+    def _has_url(self, url):
+        return url in self.urls or (self.store is not None and url in self.store)
+
+    def _match_domain(self, host):
+        domain = self.domains.match(host)
+        if domain is None and self.store is not None:
+            # The store only answers exact lookups, so try every parent domain of host
+            for suffix in host_suffixes(host):
+                if suffix in self.store:
+                    return suffix
+        return domain
+
+    def __contains__(self, entry):
+        entry = entry.strip()
+        if is_bitcoin_address(entry):
+            return self._has_address(entry)
+        host, url = normalize_url(entry)
+        return self._has_url(url) or self._match_domain(host) is not None
+
+    def __len__(self):
+        size = len(self.addresses) + len(self.urls) + len(self.domains)
+        if self.store is not None:
+            size += len(self.store)
+        return size
+
+    def __iter__(self):
+        yield from self.addresses
+        yield from self.urls
+        yield from self.domains
+
+    def find_matches(self, text):
+        '''
+        Returns the list of blacklist entries hit by the addresses and URLs found in text.
+        '''
+        matches = []
+        # Neither pattern can span whitespace, so only tokens that could possibly match are handed to the regexes
+        for token in text.split():
+            if len(token) >= MIN_ADDRESS_LENGTH:
+                for address in BITCOIN_REGEX.findall(token):
+                    if self._has_address(address):
+                        matches.append(address)
+            if "." not in token:
+                continue
+            for url_match in URL_REGEX.finditer(token):
+                host, url = normalize_url(url_match.group(1))
+                if self._has_url(url):
+                    matches.append(url)
+                    continue
+                domain = self._match_domain(host)
+                if domain is not None:
+                    matches.append(domain)
+        return matches
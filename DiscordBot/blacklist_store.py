@@ -0,0 +1,195 @@
+# blacklist_store.py
+'''
+Persistent on-disk scam address/URL blacklist.
+
+The blacklist lives in two files:
+- <path>: the base file. A 16 byte header (magic + entry count) followed by the sorted 64-bit hashes of every
+  entry's canonical key (blacklist.blacklist_key). It is memory-mapped, so opening it takes the same few
+  milliseconds whatever its size, lookups are a binary search over the mapped pages, and every bot process
+  on the machine shares the same page cache copy instead of holding its own set.
+- <path>.journal: an append-only text file with one entry per line, used for moderator additions. Other
+  processes pick up the new lines on their next reload_if_changed().
+
+External feeds should rebuild the base file with build_blacklist_file (which replaces it atomically);
+running bots pick up the new file on their next reload_if_changed().
+
+    python blacklist_store.py build scamaddr.blacklist feed.txt   # one entry per line
+    python blacklist_store.py compact scamaddr.blacklist          # fold the journal into the base file
+'''
+import argparse
+import array
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+from blacklist import blacklist_key
+
+MAGIC = b"SCAMBL01"
+HEADER = struct.Struct("=8sQ") # hashes and header are stored in native byte order
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def write_hashes(path, hashes):
+    '''
+    Writes the sorted, deduplicated hashes to path. The file is written to a temporary name and then renamed over
+    path, so readers only ever see a complete file.
+    '''
+    hashes = sorted(set(hashes))
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(hashes)))
+        array.array("Q", hashes).tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def build_blacklist_file(path, entries):
+    write_hashes(path, (key_hash(blacklist_key(entry)) for entry in entries if entry.strip()))
+
+
+class BlacklistStore(object):
+    '''
+    Read side of the memory-mapped base file plus the journal. Supports `key in store` for canonical keys.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + ".journal"
+        if not os.path.isfile(path):
+            write_hashes(path, [])
+        self._file = None
+        self._mmap = None
+        self._hashes = [] # memoryview over the mapped hashes
+        self._base_stat = None
+        self._journal = set() # hashes of journal entries
+        self._journal_stat = None
+        self._journal_offset = 0
+        self._load_base()
+        self._load_journal()
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _load_base(self):
+        self._unmap()
+        self._base_stat = self._stat(self.path)
+        self._file = open(self.path, "rb")
+        magic, count = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC:
+            raise Exception(f"{self.path} is not a blacklist file")
+        if count:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._hashes = memoryview(self._mmap)[HEADER.size:HEADER.size + 8 * count].cast("Q")
+
+    def _unmap(self):
+        # The memoryview has to be released before the mmap it points into can be closed
+        if isinstance(self._hashes, memoryview):
+            self._hashes.release()
+        self._hashes = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _load_journal(self):
+        stat = self._stat(self.journal_path)
+        if stat is None or self._journal_stat is None or stat[0] != self._journal_stat[0] or stat[1] < self._journal_offset:
+            # New, replaced or truncated journal: read it from the start
+            self._journal = set()
+            self._journal_offset = 0
+        self._journal_stat = stat
+        if stat is None:
+            return
+        with open(self.journal_path, "rb") as f:
+            f.seek(self._journal_offset)
+            data = f.read()
+        # Only consume complete lines; a concurrent writer may be halfway through one
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8").splitlines():
+            if line.strip():
+                self._journal.add(key_hash(blacklist_key(line)))
+        self._journal_offset += end
+
+    def reload_if_changed(self):
+        '''
+        Picks up a replaced base file and new journal lines. Returns True if anything changed.
+        '''
+        changed = False
+        if self._stat(self.path) != self._base_stat:
+            self._load_base()
+            changed = True
+        if self._stat(self.journal_path) != self._journal_stat:
+            self._load_journal()
+            changed = True
+        return changed
+
+    def __contains__(self, key):
+        h = key_hash(key)
+        if h in self._journal:
+            return True
+        i = bisect.bisect_left(self._hashes, h)
+        return i < len(self._hashes) and self._hashes[i] == h
+
+    def __len__(self):
+        return len(self._hashes) + len(self._journal)
+
+    def add(self, entry):
+        '''
+        Appends entry to the journal. Returns False if it was already in the store.
+        '''
+        if blacklist_key(entry) in self:
+            return False
+        line = entry.strip().replace("\n", " ") + "\n"
+        with open(self.journal_path, "ab") as f:
+            f.write(line.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        self._load_journal()
+        return True
+
+    def compact(self):
+        '''
+        Folds the journal into the base file. The journal is renamed out of the way first, so additions made by
+        other processes meanwhile land in a fresh journal instead of being lost.
+        '''
+        compacting_path = f"{self.journal_path}.compacting.{os.getpid()}"
+        try:
+            os.replace(self.journal_path, compacting_path)
+        except FileNotFoundError:
+            return
+        with open(compacting_path, "r", encoding="utf-8") as f:
+            journal = [key_hash(blacklist_key(line)) for line in f if line.strip()]
+        write_hashes(self.path, list(self._hashes) + journal)
+        os.remove(compacting_path)
+        self._load_base()
+        self._load_journal()
+
+    def close(self):
+        self._unmap()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or compact an on-disk scam blacklist")
+    parser.add_argument("command", choices=["build", "compact"])
+    parser.add_argument("path", help="blacklist base file, e.g. scamaddr.blacklist")
+    parser.add_argument("feed", nargs="?", help="for build: text file with one address/URL per line")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with open(args.feed, encoding="utf-8") as f:
+            build_blacklist_file(args.path, f)
+    else:
+        store = BlacklistStore(args.path)
+        store.compact()
+        store.close()
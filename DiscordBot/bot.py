@@ -5,17 +5,32 @@ import os
 import json
 import logging
 import re
-import requests
-from collections import defaultdict
+import asyncio
 from report import Report
 from unidecode import unidecode
-from queue import PriorityQueue
-from dataclasses import dataclass, field
 import datetime
 from enum import Enum, auto
-import pickle
 import copy
-from crypto_scam_classifier import naive_bayes_classifier
+from online_learning import OnlineLearner
+from perspective_client import PerspectiveClient, PERSPECTIVE_URL
+from scoring_queue import ScoringQueue
+from scoring_pool import ScoringPool
+from score_cache import ScoreCache
+from cascade import ScoringCascade
+from review_queue import ReviewQueue, ReportIds
+from review_session import ReviewSession, ReviewTimeout
+from message_resolver import MessageResolver, parse_message_url
+from action_scheduler import ActionScheduler, URGENT, NORMAL, BULK
+from triage import GROUPINGS, cluster_reports, describe_cluster
+from flood_detector import FloodDetector
+from routing import RoutingTable, MONITORED
+from sharding import DM_PROCESS
+from blacklist import Blacklist
+from blacklist_store import BlacklistStore
+from moderation_store import ModerationStore, ABUSIVE_REPORTED_ACCOUNT, MALICIOUS_REPORTER
+from metrics import Metrics
+from async_logging import setup_logging
+import time
 
 # Thresholds
 PROFANITY_THRESHOLD = 0.65 #the threshold of being suspicious
@@ -23,32 +38,60 @@ PROFANITY_THRESHOLD_Moderation = 0.9 #manual review if PROFANITY_THRESHOLD< scor
 MALICIOUS_REPORTER_SUSPEND_TIME = 1 #in mins
 SCAMMER_DEACT_TIME_SHORT = 1 #in days
 SCAMMER_DEACT_TIME_LONG = 7 #in days
-
-# Set up logging to the console
-logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
+PERSPECTIVE_TIMEOUT = 10 #in seconds
+PERSPECTIVE_MAX_CONCURRENCY = 8 #max Perspective requests in flight at once
+SCORING_MAX_BATCH_SIZE = 32 #max messages per classifier batch
+SCORING_MAX_WAIT_MS = 10 #max time a message waits for its classifier batch to fill, in ms
+SCORING_POOL_PROCESSES = 0 #worker processes normalizing and classifying messages, 0 to do it on the event loop
+SCORING_POOL_MAX_IN_FLIGHT = None #max batches handed to the worker processes at once (default: 2 per process)
+SCORE_CACHE_SIZE = 10000 #max number of cached message scores
+SCORE_CACHE_TTL = 600 #how long cached scores are reused, in seconds
+SCORE_CACHE_NEAR_DUPLICATES = True #also reuse scores of messages that differ from a cached one in a word or two
+# Scoring cascade: blacklist hits and confident classifier scores are decided locally, and only messages with a
+# crypto scam probability in [CASCADE_REMOTE_MIN_SCORE, CASCADE_REMOTE_MAX_SCORE] are also sent to Perspective.
+# Set CASCADE_REMOTE_MIN_SCORE = 0 to keep checking every non-scam message for toxicity with Perspective.
+CASCADE_REMOTE_MIN_SCORE = PROFANITY_THRESHOLD
+CASCADE_REMOTE_MAX_SCORE = PROFANITY_THRESHOLD_Moderation
+CASCADE_SHORT_CIRCUIT_BLACKLIST = True #don't score messages that contain a blacklisted URL/crypto address
+BLACKLIST_PATH = 'scamaddr.blacklist' #on-disk blacklist shared by all bot processes, see blacklist_store.py
+BLACKLIST_RELOAD_INTERVAL = 30 #how often to pick up blacklist changes made by feeds/other processes, in seconds
+CLASSIFIER_BASE_MODEL = 'crypto_scam_classifier/model_disc' #pickle-free export, see crypto_scam_classifier/compiled_model.py
+CLASSIFIER_SNAPSHOT_DIR = 'crypto_scam_classifier/online' #versions of the classifier updated with moderator verdicts
+CLASSIFIER_UPDATE_INTERVAL = 60 #how often moderator verdicts are folded into the classifier, in seconds
+CLASSIFIER_MAX_SNAPSHOTS = 10
+MODERATION_STORE_PATH = 'moderation.db' #review queue, strikes, suspensions and open user reports, see moderation_store.py
+MODERATION_STORE_FLUSH_MS = 50 #max time a moderation state change waits to be written to disk, in ms
+REVIEW_LEASE_TIME = 300 #how long a moderator can leave a report prompt unanswered before it is requeued, in seconds
+REVIEW_PREFETCH_COUNT = 3 #how many of the next queued reports' messages to fetch while a report is being reviewed
+MESSAGE_CACHE_SIZE = 1000 #max number of fetched messages kept for the moderation flow
+MESSAGE_CACHE_TTL = 300 #how long a fetched message is reused, in seconds
+TRIAGE_MAX_CLUSTERS = 10 #how many clusters "triage" lists
+AUTO_FLAG_NOTICE_WINDOW = 5 #auto-flags within this many seconds are announced in one mod channel post
+FLOOD_AUTHOR_LIMIT = (8, 5) #an author posting 8 messages within 5 seconds is flooding
+FLOOD_CHANNEL_LIMIT = (40, 5) #a channel receiving 40 messages within 5 seconds is being raided
+FLOOD_COOLDOWN = 60 #an author/channel stays flagged until it has been quiet for this many seconds
+FLOOD_MAX_TRACKED = 10000 #max number of authors (and channels) whose message rate is tracked
+FLOOD_REPORT_SAMPLES = 5 #how many of a flood's messages are shown in its report
+ACTION_DRAIN_TIMEOUT = 10 #max time spent sending queued reactions/posts/DMs on shutdown, in seconds
+METRICS_HOST = '127.0.0.1' #the metrics endpoint is only reachable from this machine
+METRICS_PORT = 9108 #Prometheus text metrics are served at http://METRICS_HOST:METRICS_PORT/metrics, None to disable
+METRICS_LOOP_LAG_INTERVAL = 0.1 #how often the event loop lag is sampled, in seconds
+LOG_PATH = 'discord.log' #JSON lines log of discord.py and the bot, see async_logging.py
+LOG_LEVEL = logging.DEBUG
+LOG_MAX_BYTES = 10 * 1024 * 1024 #the log is rotated when it reaches this size...
+LOG_ROTATE_INTERVAL = 24 * 3600 #...or this age, in seconds
+LOG_BACKUP_COUNT = 5 #rotated logs kept
+LOG_QUEUE_SIZE = 10000 #records waiting to be written; beyond this, new records are dropped
+LOG_DEBUG_SAMPLE_EVERY = 100 #only 1 in this many DEBUG records of each kind (e.g. gateway events, scored messages) is written
+
+# Logging is set up when the bot is started, see the bottom of this file
+log = logging.getLogger('modbot')
 
 # There should be a file called 'token.json' inside the same folder as this file
 token_path = 'tokens.json'
-if not os.path.isfile(token_path):
-    raise Exception(f"{token_path} not found!")
-with open(token_path) as f:
-    # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
-    tokens = json.load(f)
-    discord_token = tokens['discord']
-    perspective_key = tokens['perspective']
-
-# Load classifier and vectorizer that were trained on our Discord dataset
-vectorizer = pickle.load(open("crypto_scam_classifier/vectorizer_disc.pickle", "rb"))
-classifier = pickle.load(open("crypto_scam_classifier/model_disc.pickle", "rb"))
-
-@dataclass(order=True)
-class PrioritizedReport:
-    priority: (int, datetime)
-    item: object = field()
+
+RAID_NOTICE = "Possible raid, message rate above the flood threshold in: {count} channel(s)"
+AUTO_FLAG_NOTICE = "Auto-flagged {count} message(s) for review, type \"next report\" to review them:"
 
 class ForwardedReport(object):
     reported_content = None #reported message content
@@ -58,6 +101,7 @@ class ForwardedReport(object):
     scores = None  # heuristics for auto report
     timestamp = None
     auto_flagged = False
+    report_id = None #assigned by the review queue
 
     def __init__(self, reported_content, reported_account, timestamp, reporter_account=None,
                  mod_report = None, scores = None, auto_flagged = False):
@@ -69,7 +113,7 @@ class ForwardedReport(object):
         self.auto_flagged = auto_flagged
         self.report_time = timestamp
 
-    def fmtodict(self, abusive_reported_acc_strike, malicious_reporter_strike):
+    def todict(self):
         fmdict = {}
         fmdict["reported_content"] = self.reported_content
         fmdict["reported_account"] = self.reported_account
@@ -79,6 +123,10 @@ class ForwardedReport(object):
         fmdict["mod_report"] = self.mod_report
         fmdict["scores"] = self.scores
         fmdict["auto_flagged"] = self.auto_flagged
+        return fmdict
+
+    def fmtodict(self, abusive_reported_acc_strike, malicious_reporter_strike):
+        fmdict = self.todict()
 
         reported_strike = 0
         if self.reported_account in abusive_reported_acc_strike:
@@ -99,55 +147,156 @@ def dicttofm(fmdict):
                            fmdict["reporter_account"], fmdict["mod_report"], fmdict["scores"], fmdict["auto_flagged"])
 
 
+def report_priority(fm):
+    immediate_danger = 1   #1:not immediate_danger
+    if not fm.auto_flagged and fm.mod_report["immediate_danger"]:
+        immediate_danger = 0
+    return (immediate_danger, datetime.datetime.fromisoformat(fm.report_time))
 
 
-class ActiveReport(object):
-    author = None
-    report = None
-    timestamp = None
-    message_url = None
 
-    def __init__(self, author, report, timestamp, message_url):
-        self.author = author
-        self.report = report
-        self.timestamp = timestamp
-        self.message_url = message_url
 
-class ModBot(discord.Client):
-    def __init__(self, key):
+class ModBot(discord.AutoShardedClient):
+    def __init__(self, key, perspective_url=PERSPECTIVE_URL, shard_link=None):
         intents = discord.Intents.default()
-        super().__init__(command_prefix='.', intents=intents)
+        # Without a shard_link, this process connects to every shard (a single one for small bots)
+        self.shard_link = shard_link # see sharding.py
+        super().__init__(command_prefix='.', intents=intents,
+                         shard_ids=shard_link.shard_ids if shard_link else None,
+                         shard_count=shard_link.shard_count if shard_link else None)
         self.group_num = 16
-        self.mod_channel = {} # Map from guild to the mod channel id for that guild
-        self.reports = {} # Map from user IDs to the state of their report
-
-
-        # Map from user IDs to their active report(s) that has not been moderated
-        def user_reports_stats():
-            return {
-                "timestamps": [],
-                "message_urls": []
-            } 
-        self.user_active_reports = defaultdict(user_reports_stats)
-        self.all_active_reports = []
+        self.routes = RoutingTable(self.group_num) # channel roles and each guild's mod channel, see routing.py
+        self.reports = {} # Map from user IDs to the state of their report, see report.py
+        self.metrics = Metrics() # see metrics.py and instrument()
+        self.metrics_runner = None
+
         self.perspective_key = key
-        self.review_queue = PriorityQueue()
+        self.perspective = PerspectiveClient(key, url=perspective_url, timeout=PERSPECTIVE_TIMEOUT,
+                                             max_concurrency=PERSPECTIVE_MAX_CONCURRENCY)
+        # Crypto scam classifier trained on our Discord dataset, updated online with moderator verdicts. It is the
+        # pickle-free export of vectorizer_disc.pickle/model_disc.pickle, so the bot only needs NumPy to score messages.
+        self.online_learner = OnlineLearner(CLASSIFIER_BASE_MODEL, CLASSIFIER_SNAPSHOT_DIR,
+                                            max_snapshots=CLASSIFIER_MAX_SNAPSHOTS)
+        # Optionally, normalization (unidecode) and classification run in worker processes, see scoring_pool.py
+        self.scoring_pool = None
+        if SCORING_POOL_PROCESSES:
+            self.scoring_pool = ScoringPool(SCORING_POOL_PROCESSES, self.online_learner.model_path(),
+                                            max_in_flight=SCORING_POOL_MAX_IN_FLIGHT)
+        self.scoring_queue = ScoringQueue(self.perspective, self.classify_batch, max_batch_size=SCORING_MAX_BATCH_SIZE,
+                                          max_wait_ms=SCORING_MAX_WAIT_MS,
+                                          normalize_batch=self.scoring_pool.normalize_batch if self.scoring_pool else None)
+        self.score_cache = ScoreCache(max_size=SCORE_CACHE_SIZE, ttl=SCORE_CACHE_TTL,
+                                      near_duplicates=SCORE_CACHE_NEAR_DUPLICATES)
+        # Reports waiting for review in each guild, indexed by message URL, reported account and reporter. A user's
+        # report stays in it (blocking duplicate reports of the same message) until a moderator has finished reviewing it.
+        self.review_queues = {} # Map from guild IDs to their ReviewQueue, see review_queue_for()
+        self.report_ids = ReportIds() # shared by the guilds' queues, which persist to the same store
+        # Reactions, mod channel posts and DMs are paced per Discord rate limit route, see action_scheduler.py
+        self.actions = ActionScheduler(coalesce_window=AUTO_FLAG_NOTICE_WINDOW)
+        # Reported messages fetched for the moderation flow, see message_resolver.py
+        self.message_resolver = MessageResolver(self, ttl=MESSAGE_CACHE_TTL, max_size=MESSAGE_CACHE_SIZE)
+        self.moderation_store = ModerationStore(MODERATION_STORE_PATH, flush_interval_ms=MODERATION_STORE_FLUSH_MS)
         self.malicious_reporter_ids = {} #map malicious user id to the time their report feature is suspeneded
-        self.scamaddr = set(['15a8R7dAVBnXxYkAkL4Rp7HeY3jacb2N3B', #platform's internal blacklist of scam URLs/crypto addresses. Initializing with a few examples
-                             'bc1qxch7fme8karau7rl3s7pt2mfj2y6n8nzpj2d6u',
-                             '37QgMqfZpzCqA9mMfokWGy5pNh7g1xFfPi',
-                             'thisisacryptoscam.com',
-                             'giveawayscams.com'])
-
-
-        self.moderator_state = "Free" #"Free" if the moderator is done with a report, #"Busy" if dealing with a report, check before send msg to mod_channel
+        self.scamaddr = Blacklist(['15a8R7dAVBnXxYkAkL4Rp7HeY3jacb2N3B', #platform's internal blacklist of scam URLs/crypto addresses. Initializing with a few examples
+                                   'bc1qxch7fme8karau7rl3s7pt2mfj2y6n8nzpj2d6u',
+                                   '37QgMqfZpzCqA9mMfokWGy5pNh7g1xFfPi',
+                                   'thisisacryptoscam.com',
+                                   'giveawayscams.com'],
+                                  store=BlacklistStore(BLACKLIST_PATH)) #entries added by moderators are persisted here
+        self.cascade = ScoringCascade(self.scamaddr, self.scoring_queue, self.score_cache,
+                                      CASCADE_REMOTE_MIN_SCORE, CASCADE_REMOTE_MAX_SCORE,
+                                      short_circuit_blacklist=CASCADE_SHORT_CIRCUIT_BLACKLIST)
+
+
+        self.review_sessions = {} # Map from moderator IDs to the report they are reviewing, see review_session.py
+        self.flood_detector = FloodDetector(author_limit=FLOOD_AUTHOR_LIMIT, channel_limit=FLOOD_CHANNEL_LIMIT,
+                                            cooldown=FLOOD_COOLDOWN, max_keys=FLOOD_MAX_TRACKED)
+        self.flood_reports = {} # Map from flooding author IDs to the report ID collecting their messages
+        self.triage_clusters = {} # Map from moderator IDs to the report IDs of each cluster "triage" last listed for them
         self.abusive_reported_acc_strike = {}
         self.malicious_reporter_strike = {}
+        self.restore_moderation_state()
+        self.instrument()
 
-    async def check_review_queue(self):
+    def instrument(self):
+        '''
+        Hooks the metrics into the hot path: timers around blacklist matching, review queue operations and every
+        Discord API request (eval_text and the classifier time themselves), plus gauges and the components' stats.
+        '''
+        m = self.metrics
+        m.describe("eval_text_seconds", "Time to score a message with the cascade")
+        m.describe("classifier_batch_seconds", "Time to classify one micro-batch")
+        m.describe("flags_total", "Messages flagged or reacted to, by kind")
+        m.describe("event_loop_lag_seconds", "How late the event loop runs a task that is due")
+        m.time_methods(self.scamaddr, ("find_matches",), "blacklist_seconds")
+
+        request = self.http.request
+        async def timed_request(route, **kwargs):
+            labels = (("method", route.method), ("path", route.path))
+            with m.timer("discord_request_seconds", labels):
+                try:
+                    return await request(route, **kwargs)
+                except discord.HTTPException as e:
+                    m.inc("discord_errors_total", labels=labels + (("status", e.status),))
+                    raise
+        self.http.request = timed_request
+
+        m.gauge("review_queue_depth", lambda: sum(map(len, self.review_queues.values())), "Reports waiting for review")
+        m.gauge("guilds_routed", lambda: len(self.routes), "Guilds with a mod channel")
+        m.gauge("open_user_reports", lambda: len(self.reports), "Reporting flows in progress over DMs")
+        m.gauge("review_sessions", lambda: len(self.review_sessions), "Moderators reviewing a report")
+        m.gauge("actions_pending", self.actions.pending, "Discord actions waiting for their rate limit")
+        m.gauge("classifier_version", lambda: self.online_learner.version)
+        m.collect("cascade", lambda: self.cascade.stats, "Messages decided by each scoring cascade stage")
+        m.collect("score_cache", lambda: self.score_cache.stats)
+        m.collect("scoring_queue", lambda: self.scoring_queue.stats)
+        if self.scoring_pool is not None:
+            m.gauge("scoring_pool_in_flight", lambda: self.scoring_pool.in_flight, "Batches being scored by the workers")
+            m.collect("scoring_pool", lambda: self.scoring_pool.stats)
+        m.collect("message_cache", lambda: self.message_resolver.stats)
+        m.collect("actions", lambda: self.actions.stats)
+        m.collect("flood", lambda: self.flood_detector.stats)
+
+    def restore_moderation_state(self):
+        '''
+        Rebuilds the review queue, strikes, suspensions and open user reports from the moderation store, then
+        attaches the store to the review queue so that later changes are persisted.
+        '''
+        start = time.perf_counter()
+        state = self.moderation_store.load()
+        for report_id, fmdict, message_url, reported_account, reporter in state["reports"]:
+            fm = dicttofm(fmdict)
+            # reports that were under review when the bot stopped go back in the queue
+            self.review_queue_for(parse_message_url(message_url).guild_id, persist=False).push(
+                fm, report_priority(fm), message_url, reported_account, reporter=reporter, report_id=report_id)
+        for queue in self.review_queues.values():
+            queue.store = self.moderation_store
+        self.abusive_reported_acc_strike = state["strikes"][ABUSIVE_REPORTED_ACCOUNT]
+        self.malicious_reporter_strike = state["strikes"][MALICIOUS_REPORTER]
+        self.malicious_reporter_ids = {account: datetime.datetime.fromisoformat(since)
+                                       for account, since in state["suspensions"].items()}
+        self.reports = {reporter: Report.fromdict(self, d) for reporter, d in state["open_reports"].items()}
+        log.info("Restored %d queued reports, %d open user reports and %d strike records in %.1f ms",
+                 sum(map(len, self.review_queues.values())), len(self.reports),
+                 len(self.abusive_reported_acc_strike) + len(self.malicious_reporter_strike),
+                 (time.perf_counter() - start) * 1000)
+
+    def review_queue_for(self, guild_id, persist=True):
+        '''
+        Returns the review queue of a guild, creating it on first use
+        '''
+        queue = self.review_queues.get(guild_id)
+        if queue is None:
+            queue = self.review_queues[guild_id] = ReviewQueue(self.moderation_store if persist else None,
+                                                               ids=self.report_ids)
+            self.metrics.time_methods(queue, ("push", "pop", "claim", "update", "resolve", "requeue"),
+                                      "review_queue_seconds")
+        return queue
+
+    async def check_review_queue(self, queue, channel):
         nextmsg = None
-        if not self.review_queue.empty():
-            nextmsg = self.review_queue.get().item
+        if not queue.empty():
+            nextmsg = queue.pop()
             d = copy.deepcopy(nextmsg.fmtodict(self.abusive_reported_acc_strike, self.malicious_reporter_strike))
 
             # get rid of duplicated and/or unnecessary fields
@@ -158,7 +307,7 @@ class ModBot(discord.Client):
             d['mod_report'].pop('timestamp',None)
             d['mod_report']['message'].pop('author_id',None)
             d['mod_report']['message'].pop('url',None)
-            d['mod_report']['message']['content'] = unidecode(d['mod_report']['message']['content'])
+            d['mod_report']['message']['content'] = await self.transliterate(d['mod_report']['message']['content'])
             if d['scores'] != None:
                 d['scores'] = {k:round(v,3) for k,v in d['scores'].items()}
             # get rid of null values
@@ -170,10 +319,27 @@ class ModBot(discord.Client):
             # get rid of blank lines
             report_str = "\n".join([line for line in report_str.split('\n') if line.strip() != ""])
 
-            await self.mod_channel.send(self.code_format(report_str))
+            await self.actions.send(channel, self.code_format(report_str))
         return nextmsg
 
 
+    async def setup_hook(self):
+        if self.scoring_pool is not None:
+            await self.scoring_pool.start()
+        asyncio.create_task(self.reload_blacklist_periodically())
+        if self.shard_link is not None:
+            asyncio.create_task(self.receive_from_shards())
+        asyncio.create_task(self.online_learner.run(CLASSIFIER_UPDATE_INTERVAL))
+        asyncio.create_task(self.metrics.monitor_loop_lag(METRICS_LOOP_LAG_INTERVAL))
+        if METRICS_PORT is not None:
+            self.metrics_runner = await self.metrics.serve(METRICS_HOST, METRICS_PORT)
+
+    async def reload_blacklist_periodically(self):
+        while not self.is_closed():
+            await asyncio.sleep(BLACKLIST_RELOAD_INTERVAL)
+            if self.scamaddr.store.reload_if_changed():
+                log.info("Reloaded blacklist: %d entries", len(self.scamaddr))
+
     async def on_ready(self):
         print(f'{self.user.name} has connected to Discord! It is these guilds:')
         for guild in self.guilds:
@@ -187,11 +353,56 @@ class ModBot(discord.Client):
         else:
             raise Exception("Group number not found in bot's name. Name format should be \"Group # Bot\".")
 
-        # Find the mod channel in each guild that this bot should report to
+        # Find the channels to monitor and the mod channel to report to in each guild
+        self.routes = RoutingTable(self.group_num)
         for guild in self.guilds:
-            for channel in guild.text_channels:
-                if channel.name == f'group-{self.group_num}-mod':
-                    self.mod_channel = channel
+            self.routes.add_guild(guild)
+
+    async def on_guild_join(self, guild):
+        self.routes.add_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        self.routes.remove_guild(guild.id)
+
+    async def on_guild_channel_create(self, channel):
+        self.routes.add_guild(channel.guild)
+
+    async def on_guild_channel_delete(self, channel):
+        self.routes.add_guild(channel.guild)
+
+    async def on_guild_channel_update(self, before, after):
+        if before.name != after.name:
+            self.routes.add_guild(after.guild)
+
+    async def receive_from_shards(self):
+        '''
+        Handles what the other bot processes send this one (see sharding.py): reports on messages of this process's
+        guilds, made over DMs to process 0, and reporting suspensions, which process 0 enforces.
+        '''
+        async for kind, data in self.shard_link.receive():
+            if kind == "report":
+                fm = dicttofm(data["report"])
+                self.review_queue_for(data["guild_id"]).push(fm, report_priority(fm), data["message_url"],
+                                                             fm.reported_account, reporter=fm.reporter_account)
+            elif kind == "suspension":
+                self.malicious_reporter_ids[data["account"]] = datetime.datetime.fromisoformat(data["since"])
+                self.moderation_store.put_suspension(data["account"], self.malicious_reporter_ids[data["account"]])
+
+    def is_remote_guild(self, guild_id):
+        '''
+        Returns True if the guild is served by another bot process of a sharded deployment
+        '''
+        return self.shard_link is not None and not self.shard_link.is_local(guild_id)
+
+    async def fetch_remote_channel(self, guild_id, channel_id):
+        '''
+        Looks up a channel of a guild served by another bot process over the API. Returns None if it doesn't exist.
+        '''
+        try:
+            channel = await self.fetch_channel(channel_id)
+        except (discord.NotFound, discord.Forbidden):
+            return None
+        return channel if getattr(channel, "guild", None) and channel.guild.id == guild_id else None
 
     async def on_message(self, message):
         '''
@@ -239,58 +450,74 @@ class ModBot(discord.Client):
         # If we don't currently have an active report for this user, add one
         if author_id not in self.reports:
             self.reports[author_id] = Report(self)
+        report = self.reports[author_id]
 
-        # Let the report class handle this message; forward all the messages it returns to uss
-        responses = await self.reports[author_id].handle_message(message)
+        # Let the report class handle this message; forward all the messages it returns to uss.
+        # Each report is a state machine advanced by its reporter's DMs, so no coroutine waits between messages.
+        responses = await report.handle_message(message)
+        # If the report is complete or cancelled, remove it from our map
+        if report.report_complete():
+            if self.reports.get(author_id) is report:
+                self.reports.pop(author_id)
+                self.moderation_store.delete_open_report(author_id)
+        else:
+            self.moderation_store.put_open_report(author_id, report.todict())
         for r in responses:
             await message.channel.send(r)
 
-        # If the report is complete or cancelled, remove it from our map
-        if self.reports[author_id].report_complete():
-            self.reports.pop(author_id)
-
     def check_message_url_against_active_reports(self, author_id, message_url):
         # block the report from being submitted if the user already submitted a report on the same message
-        if message_url in self.user_active_reports[author_id]["message_urls"]:
-            return True
-        return False
+        guild_id = parse_message_url(message_url).guild_id
+        if self.is_remote_guild(guild_id):
+            return False # checked by the guild's process, which drops duplicates
+        return self.review_queue_for(guild_id).has_report(message_url, reporter=author_id)
 
     def handle_user_report_submission(self, author_id, mod_report):
-        # note down report stats
-        timestamp = self.reports[author_id].get_timestamp()
         message_url = self.reports[author_id].get_message_url()
-        self.user_active_reports[author_id]["timestamps"].append(timestamp)
-        self.user_active_reports[author_id]["message_urls"].append(message_url)
-
-        # add report to all active reports
-        self.all_active_reports.append(ActiveReport(author_id, self.reports[author_id], timestamp, message_url))
-
-        # help report submit to mod channel
-        # TODO: can modify so a report from all_active_reports is sent to the moderators when the mod channel 
-        # send a specific message instead of sending it immediately here.
 
         fm = ForwardedReport(mod_report["message"]["content"], mod_report["message"]["author_id"], mod_report["timestamp"],
                              reporter_account=author_id, mod_report = mod_report, scores = None, auto_flagged = False)
 
-        immediate_danger = 1   #1:not immediate_danger
-        if mod_report["immediate_danger"]:
-            immediate_danger = 0
-        self.review_queue.put(
-            PrioritizedReport((immediate_danger, datetime.datetime.strptime(fm.report_time, "%Y-%m-%d %H:%M:%S.%f")), fm))
+        guild_id = parse_message_url(message_url).guild_id
+        if self.is_remote_guild(guild_id):
+            self.shard_link.send(self.shard_link.process_of(guild_id), "report",
+                                 {"guild_id": guild_id, "message_url": message_url, "report": fm.todict()})
+            self.metrics.inc("flags_total", labels=(("kind", "user_report"),))
+            return True, ""
 
+        report_id = self.review_queue_for(guild_id).push(fm, report_priority(fm), message_url, fm.reported_account,
+                                                         reporter=author_id)
+        if report_id is None:
+            return False, "You have already submitted a report on this message."
+
+        self.metrics.inc("flags_total", labels=(("kind", "user_report"),))
         return True, ""
 
     async def handle_channel_message(self, message):
-        # Only handle messages sent in the "group-#" channel
-        if not message.channel.name == f'group-{self.group_num}' and not message.channel.name == f'group-{self.group_num}-mod':
+        # Only handle messages sent in the "group-#" and "group-#-mod" channels, see routing.py
+        role = self.routes.role(message.channel.id)
+        if role is None:
             return
-        elif message.channel.name == f'group-{self.group_num}':
-            scores = self.eval_text(message)
-            print(message.content)
-            print(scores)
-            print()
+        elif role == MONITORED:
+            mod_channel = self.routes.mod_channel(message.guild.id)
+            flood = self.flood_detector.observe(message.author.id, message.channel.id)
+            if flood.raid_started:
+                self.actions.post_coalesced(mod_channel, RAID_NOTICE, f"#{message.channel.name}")
+            if flood.author_flooding:
+                # Don't score every message of a flood, they all go in one report
+                self.add_to_flood_report(message)
+                return
+            result = await self.eval_text(message)
+            scores = result.scores
+            log.debug("Scored message", extra={"fields": {"message_id": message.id, "author_id": message.author.id,
+                                                          "content": message.content, "stage": result.stage,
+                                                          "scores": scores}})
             report_to_moderator = await self.eval_perspective_score(message, scores)
-            await self.check_message_against_blacklist(message)
+            await self.check_message_against_blacklist(message, result.blacklist_matches)
+            if result.stage == "blacklist":
+                # Not scored, so sent to the moderators on the blacklist match alone ("triage by blacklist" groups these)
+                self.actions.react(message, "❓", BULK)
+                report_to_moderator = True
             if report_to_moderator:
                 # Forward the message to the mod channel
                 # await self.mod_channel.send(f'Suspicious Scam Message Forwarded to Moderator:\n{message.author.name}: "{message.content}"')
@@ -302,123 +529,298 @@ class ModBot(discord.Client):
                     "content": message.content,
                     "url": message.jump_url
                 }
+                if result.blacklist_matches:
+                    mod_report["blacklist"] = result.blacklist_matches
                 fm = ForwardedReport(message.content, message.author.id,
                                      str(datetime.datetime.now()),
                                      reporter_account=None, mod_report=mod_report, scores=scores, auto_flagged=True)
-                immediate_danger = 1
-                self.review_queue.put(
-                    PrioritizedReport((immediate_danger,datetime.datetime.strptime(fm.report_time, "%Y-%m-%d %H:%M:%S.%f")),fm))
+                # An edited message that is flagged again is not queued twice
+                if self.review_queue_for(message.guild.id).push(fm, report_priority(fm), message.jump_url,
+                                                                message.author.id) is not None:
+                    self.metrics.inc("flags_total", labels=(("kind", "auto"),))
+                    self.actions.post_coalesced(mod_channel, AUTO_FLAG_NOTICE, message.jump_url)
 
 
 
         else:
             #moderator should input "next report"
             if message.content.lower() == "next report":
-                if self.moderator_state == "Busy":
-                    reply = "Please finish processing the current report before starting a new one.\n"
-                    await message.channel.send(reply)
+                await self.start_review_session(message)
+            elif message.content.lower().split()[:1] == ["triage"]:
+                await self.triage(message)
+            elif message.content.lower() == "scoring stats":
+                stats = dict(self.cascade.stats, remote_calls_avoided=self.cascade.remote_calls_avoided())
+                await message.channel.send(self.code_format(
+                    "cascade: " + json.dumps(stats) + "\ncache: " + json.dumps(self.score_cache.stats) +
+                    "\nflood: " + json.dumps(self.flood_detector.stats)))
+            elif message.content.lower() == "model version":
+                await message.channel.send(f"Crypto scam classifier version {self.online_learner.version} "
+                                           f"(available: {self.online_learner.versions()}).")
+            elif message.content.lower().startswith("rollback model"):
+                # "rollback model" goes back one version, "rollback model N" goes back to version N
+                version = message.content.split()[2:]
+                try:
+                    version = await self.online_learner.rollback(int(version[0]) if version else None)
+                except ValueError as e:
+                    await message.channel.send(f"Could not roll back the classifier: {e}")
                     return
-                self.moderator_state = "Busy"
-                forwarded_message = await self.check_review_queue()
-                if forwarded_message is None:
-                    reply = "No more reports to be reviewed.\n"
-                    await message.channel.send(reply)
-                    self.moderator_state = "Free"
-                else:
-                    malicious = False
-                    immediate_danger = False
-                    escalate = False
-                    if not forwarded_message.auto_flagged:
-                        malicious = await self.check_malicious_user_report(forwarded_message, message.channel)
-                    if malicious:
-                        scam_message_url = forwarded_message.mod_report["message"]["url"]
-                        scam_message_url = re.search('/(\d+)/(\d+)/(\d+)', scam_message_url)
-                        guild = self.get_guild(int(scam_message_url.group(1)))
-                        scam_message_channel = guild.get_channel(int(scam_message_url.group(2)))
-                        scam_message = await scam_message_channel.fetch_message(int(scam_message_url.group(3)))
-                        await scam_message.reactions[0].remove(self.user)
-                        await self.mod_channel.send("Finished processing a malicious/frivolous user report")
-                        self.moderator_state = "Free"
-                        return
-                    else:
-                        immediate_danger = await self.check_immediate_danger(message.channel)
-                    if immediate_danger:
-                        scam_message_url = forwarded_message.mod_report["message"]["url"]
-                        scam_message_url = re.search('/(\d+)/(\d+)/(\d+)', scam_message_url)
-                        guild = self.get_guild(int(scam_message_url.group(1)))
-                        scam_message_channel = guild.get_channel(int(scam_message_url.group(2)))
-                        scam_message = await scam_message_channel.fetch_message(int(scam_message_url.group(3)))
-                        await scam_message.reactions[0].remove(self.user)
-                        await scam_message.add_reaction("🆘")  # the dm has been flagged with immediate danger
-                        await self.mod_channel.send("Finished processing a report")
-                        self.moderator_state = "Free"
-                        return
-                    else:
-                        escalate = await self.check_escalate(message.channel)
-                    if escalate:
-                        scam_message_url = forwarded_message.mod_report["message"]["url"]
-                        scam_message_url = re.search('/(\d+)/(\d+)/(\d+)', scam_message_url)
-                        guild = self.get_guild(int(scam_message_url.group(1)))
-                        scam_message_channel = guild.get_channel(int(scam_message_url.group(2)))
-                        scam_message = await scam_message_channel.fetch_message(int(scam_message_url.group(3)))
-                        await scam_message.reactions[0].remove(self.user)
-                        await scam_message.add_reaction("👨‍💼")  # the dm has been escalated
-
-                        await self.mod_channel.send("Finished processing a report")
-                        self.moderator_state = "Free"
-                        return
-                    else:
-                        #todo
-                        newscamaddr =  await self.checkscamaddr(message.channel)
-                        if newscamaddr is not None:
-                            newscamaddr_trimmed = re.sub(r"^(https?:\/\/)?(www\.)?", "", newscamaddr).rstrip("/") # trims prefix for URLs
-                            if newscamaddr_trimmed not in self.scamaddr:
-                                self.scamaddr.add(newscamaddr_trimmed)
-                                await self.mod_channel.send(
-                                    "Added the reported scam URL/crypto address to the internal blacklist.")
-                            else:
-                                await self.mod_channel.send(
-                                    "The reported scam URL/crypto address is already in the internal blacklist.")
-
-                        await self.handleMessage(forwarded_message, message.channel)
-                        await self.handleReportedAccount(forwarded_message, message.channel)
-                        await self.mod_channel.send("Finished processing a report")
-                        self.moderator_state = "Free"
-                        return
-
-
-    def eval_text(self, message):
-        '''
-        Evaluates a message using Perspective and our classifier and returns a dictionary of scores.
-        '''
-        PERSPECTIVE_URL = 'https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze'
-
-        url = PERSPECTIVE_URL + '?key=' + self.perspective_key
-        unidecoded_message_content = unidecode(message.content).lower()
-        data_dict = {
-            'comment': {'text': unidecoded_message_content},
-            'languages': ['en'],
-            'requestedAttributes': {
-                                    'SEVERE_TOXICITY': {}, 'PROFANITY': {},
-                                    'IDENTITY_ATTACK': {}, 'THREAT': {},
-                                    'TOXICITY': {},
-                                    #'FLIRTATION': {}
-                                },
-            'doNotStore': True
+                await message.channel.send(f"Rolled the crypto scam classifier back to version {version}.")
+
+
+    def add_to_flood_report(self, message):
+        '''
+        Adds a message of a flooding author to the report collecting their flood, or queues a new one (with the
+        message as the reported message) if there is none waiting for review.
+        '''
+        author_id = message.author.id
+        queue = self.review_queue_for(message.guild.id)
+        report_id = self.flood_reports.get((message.guild.id, author_id))
+        if report_id is not None and queue.is_queued(report_id):
+            flood = queue.reports[report_id].mod_report["flood"]
+            flood["messages"] += 1
+            if len(flood["samples"]) < FLOOD_REPORT_SAMPLES:
+                flood["samples"].append(message.content)
+            queue.update(report_id)
+            return
+
+        mod_report = {}
+        mod_report["message"] = {
+            "author_id": author_id,
+            "author": message.author.name,
+            "content": message.content,
+            "url": message.jump_url
         }
-        response = requests.post(url, data=json.dumps(data_dict))
-        response_dict = response.json()
+        mod_report["flood"] = {"messages": 1, "samples": [message.content]}
+        fm = ForwardedReport(message.content, author_id, str(datetime.datetime.now()),
+                             reporter_account=None, mod_report=mod_report, scores=None, auto_flagged=True)
+        report_id = queue.push(fm, report_priority(fm), message.jump_url, author_id)
+        if report_id is None:
+            return
+        if len(self.flood_reports) >= FLOOD_MAX_TRACKED:
+            self.flood_reports = {key: report for key, report in self.flood_reports.items()
+                                  if self.review_queue_for(key[0]).is_queued(report)}
+        self.flood_reports[(message.guild.id, author_id)] = report_id
+        self.metrics.inc("flags_total", labels=(("kind", "flood"),))
+        self.actions.react(message, "❓", BULK)
+        self.actions.post_coalesced(self.routes.mod_channel(message.guild.id), AUTO_FLAG_NOTICE, message.jump_url)
+
+    async def start_review_session(self, message):
+        '''
+        Pops the next report and walks the moderator who asked for it through it. Each moderator reviews one report
+        at a time, but several moderators can review different reports concurrently: a session only listens to its
+        own moderator in its own channel. If the moderator does not answer within REVIEW_LEASE_TIME, the report goes
+        back to the review queue for someone else.
+        '''
+        if message.author.id in self.review_sessions:
+            reply = "Please finish processing the current report before starting a new one.\n"
+            await message.channel.send(reply)
+            return
+        queue = self.review_queue_for(message.guild.id)
+        forwarded_message = await self.check_review_queue(queue, message.channel)
+        if forwarded_message is None:
+            reply = "No more reports to be reviewed.\n"
+            await message.channel.send(reply)
+            return
 
-        scores = {}
-        for attr in response_dict["attributeScores"]:
-            scores[attr] = response_dict["attributeScores"][attr]["summaryScore"]["value"]
+        # Fetch the reported message while the moderator reads the first prompt, and the messages of the next
+        # reports while they answer the rest
+        message_url = forwarded_message.mod_report["message"]["url"]
+        self.message_resolver.prefetch([message_url] + [report.mod_report["message"]["url"]
+                                                        for report in queue.peek(REVIEW_PREFETCH_COUNT)])
+        await self.run_review_session(message, queue, [forwarded_message], self.review_report)
 
-        # now eval using crypto scam classifier
-        crypto_scam_proba = naive_bayes_classifier.get_predictions([unidecoded_message_content], 
-                                                        classifier, vectorizer, predict_proba=True)[0][1]
-        scores['CRYPTO_SCAM'] = crypto_scam_proba
-        
-        return scores
+    async def run_review_session(self, message, queue, reports, review):
+        '''
+        Runs `await review(session)` for reports taken from queue by the moderator who sent message, then
+        resolves them. If the moderator stops answering (or the bot shuts down), the reports go back to the queue.
+        Any other failure is permanent (e.g. the reported message was deleted), so the reports are closed instead of
+        being served again.
+        '''
+        moderator_id = message.author.id
+        session = ReviewSession(moderator_id, message.channel, reports, REVIEW_LEASE_TIME)
+        self.review_sessions[moderator_id] = session
+        try:
+            await review(session)
+            for report in reports:
+                queue.resolve(report.report_id)
+        except ReviewTimeout:
+            for report in reports:
+                queue.requeue(report.report_id)
+            await session.channel.send(f"{message.author.mention} did not answer for {REVIEW_LEASE_TIME} seconds, "
+                                       "the report(s) were returned to the review queue.")
+        except asyncio.CancelledError:
+            for report in reports:
+                queue.requeue(report.report_id)
+            raise
+        except discord.NotFound:
+            for report in reports:
+                queue.resolve(report.report_id)
+            log.info("Closed report(s) %s: the reported message was deleted", [report.report_id for report in reports])
+            await self.actions.send(session.channel, "The reported message was deleted, the report was closed.")
+        except Exception:
+            for report in reports:
+                queue.resolve(report.report_id)
+            log.exception("Reviewing report(s) %s failed", [report.report_id for report in reports])
+            await self.actions.send(session.channel, "Processing the report(s) failed and they were closed, see the logs.")
+        finally:
+            del self.review_sessions[moderator_id]
+            # their reactions changed, so the cached copies are stale
+            for report in reports:
+                self.message_resolver.invalidate(report.mod_report["message"]["url"])
+
+    async def triage(self, message):
+        '''
+        Bulk triage of auto-flagged reports. "triage" lists the queued auto-flagged reports grouped by (nearly)
+        identical content, "triage by account" / "triage by blacklist" group them by reported account / matched
+        blacklist entry, and "triage N" then applies one outcome to every report of cluster N of that list.
+        '''
+        args = message.content.lower().split()[1:]
+        if len(args) == 1 and args[0].isnumeric():
+            await self.triage_cluster(message, int(args[0]) - 1)
+            return
+        by = "content" if not args else args[1] if len(args) == 2 and args[0] == "by" else None
+        if by not in GROUPINGS:
+            await message.channel.send("Usage: `triage`, `triage by account`, `triage by blacklist` or `triage N`.")
+            return
+
+        reports = [report for report in self.review_queue_for(message.guild.id).queued() if report.auto_flagged]
+        clusters = cluster_reports(reports, by, self.scamaddr)[:TRIAGE_MAX_CLUSTERS]
+        self.triage_clusters[message.author.id] = [[report.report_id for report in cluster] for cluster in clusters]
+        if not clusters:
+            await message.channel.send("No auto-flagged reports to triage.")
+            return
+        reply = f"Queued auto-flagged reports grouped by {by}:\n"
+        for i, cluster in enumerate(clusters):
+            reply += f"{i+1}) {describe_cluster(cluster)}\n"
+        await message.channel.send(self.code_format(reply) +
+                                   "Type \"triage N\" to apply one outcome to every report of cluster N.")
+
+    async def triage_cluster(self, message, index):
+        if message.author.id in self.review_sessions:
+            reply = "Please finish processing the current report before starting a new one.\n"
+            await message.channel.send(reply)
+            return
+        clusters = self.triage_clusters.get(message.author.id)
+        if not clusters or not 0 <= index < len(clusters):
+            await message.channel.send("Type \"triage\" first to list the clusters of reports.")
+            return
+        # Reports reviewed by someone else since the list was made are skipped
+        queue = self.review_queue_for(message.guild.id)
+        reports = [report for report in map(queue.claim, clusters[index]) if report is not None]
+        del self.triage_clusters[message.author.id] # the numbering is stale now
+        if not reports:
+            await message.channel.send("These reports have already been reviewed.")
+            return
+        self.message_resolver.prefetch([report.mod_report["message"]["url"] for report in reports])
+        await self.run_review_session(message, queue, reports, self.triage_reports)
+
+    async def triage_reports(self, session):
+        reports = session.reports
+        accounts = list(dict.fromkeys(report.reported_account for report in reports))
+        await session.channel.send(f"Reviewing {len(reports)} auto-flagged report(s) from {len(accounts)} account(s) "
+                                   "at once. Use \"next report\" instead for immediate danger or escalation.")
+        await self.handle_scamaddr(session)
+
+        await session.channel.send("Choose outcome for all of the reported content.")
+        choices = [e.value for e in DMOutcomes]
+        dmoutcome = DMOutcomes(choices[await self.prompt_for_choice(choices, session)])
+        await session.channel.send("Choose outcome for all of the reported accounts.")
+        choices = [e.value for e in ReportedAccOutcomes]
+        account_outcome = ReportedAccOutcomes(choices[await self.prompt_for_choice(choices, session)])
+
+        # All the Discord actions are queued at once and paced by the action scheduler.
+        # Each account gets one strike (and one DM) per triaged cluster, not one per message.
+        results = await asyncio.gather(*[self.apply_message_outcome(report, dmoutcome, learn=False)
+                                         for report in reports],
+                                       *[self.apply_account_outcome(account, account_outcome) for account in accounts],
+                                       return_exceptions=True)
+        # The classifier learns one sample per distinct content, so a raid of one template doesn't outweigh the rest
+        # of its training data
+        label = "Spam" if dmoutcome == DMOutcomes.FLAG else "Ham"
+        for cluster in cluster_reports(reports, "content"):
+            self.online_learner.record((await self.transliterate(cluster[0].reported_content)).lower(), label)
+        failed = sum(isinstance(result, Exception) for result in results)
+        reply = f"Finished processing {len(reports)} report(s)"
+        if failed:
+            reply += f" ({failed} action(s) failed, see the logs)"
+        await self.actions.send(session.channel, reply)
+
+    def review_reaction(self, report):
+        '''
+        The reaction marking a message as waiting for review: ❓ for auto-flags, 🇶 for user reports
+        '''
+        return "❓" if report.auto_flagged else "🇶"
+
+    async def review_report(self, session):
+        forwarded_message = session.report
+        malicious = False
+        immediate_danger = False
+        escalate = False
+        if not forwarded_message.auto_flagged:
+            malicious = await self.check_malicious_user_report(forwarded_message, session)
+        if malicious:
+            scam_message = await self.message_resolver.resolve(forwarded_message.mod_report["message"]["url"])
+            await self.actions.remove_reaction(scam_message, self.review_reaction(forwarded_message), self.user)
+            await self.actions.send(session.channel, "Finished processing a malicious/frivolous user report")
+            return
+        else:
+            immediate_danger = await self.check_immediate_danger(session)
+        if immediate_danger:
+            scam_message = await self.message_resolver.resolve(forwarded_message.mod_report["message"]["url"])
+            await self.actions.remove_reaction(scam_message, self.review_reaction(forwarded_message), self.user, URGENT)
+            await self.actions.react(scam_message, "🆘", URGENT)  # the dm has been flagged with immediate danger
+            await self.actions.send(session.channel, "Finished processing a report", URGENT)
+            return
+        else:
+            escalate = await self.check_escalate(session)
+        if escalate:
+            scam_message = await self.message_resolver.resolve(forwarded_message.mod_report["message"]["url"])
+            await self.actions.remove_reaction(scam_message, self.review_reaction(forwarded_message), self.user)
+            await self.actions.react(scam_message, "👨‍💼", NORMAL)  # the dm has been escalated
+
+            await self.actions.send(session.channel, "Finished processing a report")
+            return
+        else:
+            #todo
+            await self.handle_scamaddr(session)
+
+            await self.handleMessage(forwarded_message, session)
+            await self.handleReportedAccount(forwarded_message, session)
+            await self.actions.send(session.channel, "Finished processing a report")
+            return
+
+    def classify_batch(self, texts):
+        '''
+        Returns the crypto scam probability of each text, using the current version of the classifier. With a scoring
+        pool, returns an awaitable for them instead, which the worker processes compute.
+        '''
+        if self.scoring_pool is not None:
+            return self.classify_batch_in_pool(texts)
+        model = self.online_learner.model
+        with self.metrics.timer("classifier_batch_seconds"):
+            return model.predict_proba(texts)[:, model.classes.index("Spam")]
+
+    async def classify_batch_in_pool(self, texts):
+        with self.metrics.timer("classifier_batch_seconds"):
+            return await self.scoring_pool.classify_batch(self.online_learner.model_path(), texts)
+
+    async def transliterate(self, text):
+        '''
+        unidecode(text), in a worker process if there is a scoring pool (long messages take a while)
+        '''
+        if self.scoring_pool is None:
+            return unidecode(text)
+        return await self.scoring_pool.run(unidecode, text)
+
+    async def eval_text(self, message):
+        '''
+        Evaluates a message with the scoring cascade (blacklist, then our classifier, then Perspective only if the
+        classifier is unsure) and returns a CascadeResult with the dictionary of scores and any blacklist matches.
+        Concurrent messages are classified together in micro-batches by self.scoring_queue, and repeated
+        (or nearly repeated) messages reuse cached scores from self.score_cache.
+        '''
+        with self.metrics.timer("eval_text_seconds"):
+            return await self.cascade.evaluate(message.content)
 
     async def eval_perspective_score(self, message, scores):
         '''
@@ -432,38 +834,42 @@ class ModBot(discord.Client):
             if score > PROFANITY_THRESHOLD:
                 safe = False
             if score > PROFANITY_THRESHOLD_Moderation:
-                await message.add_reaction("🤬")
                 report_to_moderator = False
 
+        # Reactions are queued in the bulk lane and not waited for, so a raid cannot stall the handlers
+        if not report_to_moderator:
+            self.metrics.inc("flags_total", labels=(("kind", "profanity"),))
+            self.actions.react(message, "🤬", BULK)
         if not safe and report_to_moderator:
-            await message.add_reaction("❓") #means send to moderator
+            self.actions.react(message, "❓", BULK) #means send to moderator
             return True
         else:
             return False
 
-    async def check_message_against_blacklist(self, message):
+    async def check_message_against_blacklist(self, message, blacklist_matches):
         '''
         Add web emoji to text if URL/address is in blacklist
         '''
-        # Check for bitcoin addresses in blacklist. 
-        bitcoin_regex = re.compile(r'\b([13][a-km-zA-HJ-NP-Z1-9]{25,34}|bc1[ac-hj-np-zAC-HJ-NP-Z02-9]{11,71})\b')
-        bitcoin_addresses = bitcoin_regex.findall(message.content)
-        url_regex = re.compile(r"((https?:\/\/)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*))")
-        urls = url_regex.findall(message.content)
-
-        message_contains_blacklist_item = False
-        for addr in bitcoin_addresses:
-            if addr in self.scamaddr:
-                message_contains_blacklist_item = True
-        for url in urls:
-            url = url[0]
-            url_trimmed = re.sub(r"^(https?:\/\/)?(www\.)?", "", url).rstrip("/")
-            if url_trimmed in self.scamaddr:
-                message_contains_blacklist_item = True
-        if message_contains_blacklist_item:
-            await message.add_reaction("🕸️")
+        # Matching is done by the scoring cascade; subdomains of blacklisted domains also match
+        if blacklist_matches:
+            self.metrics.inc("flags_total", labels=(("kind", "blacklist"),))
+            self.actions.react(message, "🕸️", BULK)
 
 
+    async def on_raw_message_delete(self, payload):
+        '''
+        Cancels the queued reports on a deleted message: there is nothing left to review. Reports already being
+        reviewed are closed by run_review_session when resolving the message fails.
+        '''
+        queue = self.review_queues.get(payload.guild_id)
+        if queue is None:
+            return
+        message_url = f"https://discord.com/channels/{payload.guild_id}/{payload.channel_id}/{payload.message_id}"
+        self.message_resolver.invalidate(message_url)
+        cancelled = queue.cancel_message(message_url)
+        if cancelled:
+            log.info("Cancelled %d report(s) on deleted message %s", cancelled, message_url)
+
     async def on_message_edit(self, before, after):
         '''
         Prevent editing message into abusive content
@@ -476,144 +882,213 @@ class ModBot(discord.Client):
                 reply += "Use the `cancel` command to cancel the report process and start over.\n"
                 await after.channel.send(reply)
 
+    async def close(self):
+        await self.actions.close(ACTION_DRAIN_TIMEOUT)
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await self.perspective.close()
+        if self.scoring_pool is not None:
+            self.scoring_pool.close()
+        if self.shard_link is not None:
+            self.shard_link.close()
+        await super().close()
+        self.scamaddr.store.close()
+        await self.moderation_store.close()
+
     def code_format(self, text):
         return "```" + text + "```"
 
-    async def prompt_for_choice(self, choices, channel):
+    async def wait_for_reply(self, session, check=None):
+        '''
+        Waits for the next message from the session's moderator in the session's channel that passes check, and
+        renews the session's lease. Raises ReviewTimeout if the lease runs out first.
+        '''
+        def session_check(msg):
+            return session.owns(msg) and (check is None or check(msg))
+
+        try:
+            msg = await self.wait_for("message", check=session_check, timeout=session.time_left())
+        except asyncio.TimeoutError:
+            raise ReviewTimeout()
+        session.renew()
+        return msg
+
+    async def prompt_for_choice(self, choices, session):
         reply = f"\n\nPlease enter a number between 1 and {len(choices)}:\n"
         for i, choice in enumerate(choices):
             reply += f"{i+1}) {choice}\n"
-        await channel.send(reply)
+        await session.channel.send(reply)
 
         def check(msg):
             return msg.content.isnumeric() and 0 < int(msg.content) and int(msg.content) <= len(choices)
 
-        msg = await self.wait_for("message", check=check)
+        msg = await self.wait_for_reply(session, check=check)
         return int(msg.content)-1
 
-    async def check_malicious_user_report(self, forwarded_message, channel):
+    async def check_malicious_user_report(self, forwarded_message, session):
 
-        await channel.send("Is this a malicious/frivolous user report? Enter 'y' or 'n'.")
+        await session.channel.send("Is this a malicious/frivolous user report? Enter 'y' or 'n'.")
 
         def check(msg):
             return msg.content.lower() in {'y', 'n'}
 
-        msg = await self.wait_for("message", check=check)
+        msg = await self.wait_for_reply(session, check=check)
         if msg.content.lower() == 'y':
-            await self.handle_malicious_user_report(forwarded_message, channel)
+            await self.handle_malicious_user_report(forwarded_message, session)
             return True
         else:
             #genuine report
             return False
 
-    async def handle_malicious_user_report(self, forwarded_message, channel):
+    async def handle_malicious_user_report(self, forwarded_message, session):
         malicious_user_id = forwarded_message.reporter_account
-        malicious_report_channel_id = forwarded_message.mod_report["report_dm_channel_id"]
-        await channel.send("Choose outcome for the malicious/frivolous reporter.")
+        await session.channel.send("Choose outcome for the malicious/frivolous reporter.")
         choices = [e.value for e in ReporterOutcomes]
-        user_choice = await self.prompt_for_choice(choices, channel)
+        user_choice = await self.prompt_for_choice(choices, session)
         reporteroutcome = ReporterOutcomes(choices[user_choice])
 
         if malicious_user_id not in self.malicious_reporter_strike:
             self.malicious_reporter_strike[malicious_user_id] = 0
         self.malicious_reporter_strike[malicious_user_id] += 1
+        self.moderation_store.put_strike(MALICIOUS_REPORTER, malicious_user_id,
+                                         self.malicious_reporter_strike[malicious_user_id])
 
 
         if reporteroutcome == ReporterOutcomes.WARN:
-            await self.get_channel(malicious_report_channel_id).send("WARNING: please do not send malicious/frivolous reports!")
+            # a DM to the reporter goes to the channel they reported from, and works from any bot process
+            await self.actions.send_dm(self, malicious_user_id,
+                                       "WARNING: please do not send malicious/frivolous reports!")
         else:
             assert reporteroutcome == ReporterOutcomes.SUSPEND
             self.malicious_reporter_ids[malicious_user_id] = datetime.datetime.now()
-            await self.get_channel(malicious_report_channel_id).send("Your report feature will be suspended for "+
-                                                                     str(MALICIOUS_REPORTER_SUSPEND_TIME)+ " minutes for "+
-                                                                     "sending a malicious/frivolous report!", )
-
-    async def check_immediate_danger(self, channel):
-
-        await channel.send("Is there an immediate danger? Enter 'y' or 'n'.")
+            self.moderation_store.put_suspension(malicious_user_id, self.malicious_reporter_ids[malicious_user_id])
+            if self.shard_link is not None and self.shard_link.process != DM_PROCESS:
+                # reporting flows run in the process receiving DMs
+                self.shard_link.send(DM_PROCESS, "suspension", {
+                    "account": malicious_user_id, "since": self.malicious_reporter_ids[malicious_user_id].isoformat()})
+            await self.actions.send_dm(self, malicious_user_id,
+                                       "Your report feature will be suspended for "+
+                                       str(MALICIOUS_REPORTER_SUSPEND_TIME)+ " minutes for "+
+                                       "sending a malicious/frivolous report!")
+            await self.cancel_reporter_reports(malicious_user_id)
+
+    async def cancel_reporter_reports(self, reporter_id):
+        '''
+        Drops the other queued reports of a suspended reporter from this process's review queues, and takes the 🇶
+        off the messages nobody else reported
+        '''
+        for queue in self.review_queues.values():
+            for report in queue.reports_for(queue.by_reporter, reporter_id):
+                message_url = report.mod_report["message"]["url"]
+                if not queue.cancel(report.report_id):
+                    continue # under review
+                if any(not other.auto_flagged for other in queue.reports_for(queue.by_message_url, message_url)):
+                    continue
+                try:
+                    message = await self.message_resolver.resolve(message_url)
+                except discord.NotFound:
+                    continue
+                await self.actions.remove_reaction(message, self.review_reaction(report), self.user, BULK)
+
+    async def check_immediate_danger(self, session):
+
+        await session.channel.send("Is there an immediate danger? Enter 'y' or 'n'.")
 
         def check(msg):
             return msg.content.lower() in {'y', 'n'}
 
-        msg = await self.wait_for("message", check=check)
+        msg = await self.wait_for_reply(session, check=check)
         if msg.content.lower() == 'y':
-            await channel.send("MOCKED: Incident is reported to law enforcement! This report will be handled elsewhere. Thank you for reviewing.")
+            await session.channel.send("MOCKED: Incident is reported to law enforcement! This report will be handled elsewhere. Thank you for reviewing.")
             return True
         else:
             return False
 
-    async def check_escalate(self, channel):
+    async def check_escalate(self, session):
 
-        await channel.send("Would you like to escalate to higher-level reviewers? Enter 'y' or 'n'.")
+        await session.channel.send("Would you like to escalate to higher-level reviewers? Enter 'y' or 'n'.")
 
         def check(msg):
             return msg.content.lower() in {'y', 'n'}
 
-        msg = await self.wait_for("message", check=check)
+        msg = await self.wait_for_reply(session, check=check)
         if msg.content.lower() == 'y':
-            await channel.send("MOCKED: Incident is escalated to higher-level reviewers!")
+            await session.channel.send("MOCKED: Incident is escalated to higher-level reviewers!")
             return True
         else:
             return False
 
-    async def checkscamaddr(self, channel):
+    async def checkscamaddr(self, session):
         url = None
-        await channel.send("Does the message include a scam URL/crypto address? Enter 'y' or 'n'.")
+        await session.channel.send("Does the message include a scam URL/crypto address? Enter 'y' or 'n'.")
 
         def check(msg):
             return msg.content.lower() in {'y', 'n'}
 
-        msg = await self.wait_for("message", check=check)
+        msg = await self.wait_for_reply(session, check=check)
 
         if msg.content.lower() == 'y':
-            await channel.send("Please enter the reported scam URL/Bitcoin address to be added to the internal blacklist. Please only enter valid Bitcoin addresses and URLs, or else they will not be recognized during auto-flagging!")
-            msg = await self.wait_for("message")
+            await session.channel.send("Please enter the reported scam URL/Bitcoin address to be added to the internal blacklist. Please only enter valid Bitcoin addresses and URLs, or else they will not be recognized during auto-flagging!")
+            msg = await self.wait_for_reply(session)
             url = msg.content
         return url
 
-    async def handleMessage(self, forwarded_message, channel):
-        await channel.send("Choose outcome for the reported content.")
+    async def handle_scamaddr(self, session):
+        newscamaddr =  await self.checkscamaddr(session)
+        if newscamaddr is not None:
+            if self.scamaddr.add(newscamaddr):
+                await self.actions.send(session.channel,
+                    "Added the reported scam URL/crypto address to the internal blacklist.")
+            else:
+                await self.actions.send(session.channel,
+                    "The reported scam URL/crypto address is already in the internal blacklist.")
+
+    async def handleMessage(self, forwarded_message, session):
+        await session.channel.send("Choose outcome for the reported content.")
         choices = [e.value for e in DMOutcomes]
-        user_choice = await self.prompt_for_choice(choices, channel)
+        user_choice = await self.prompt_for_choice(choices, session)
         dmoutcome = DMOutcomes(choices[user_choice])
+        await self.apply_message_outcome(forwarded_message, dmoutcome)
 
-        scam_message_url = forwarded_message.mod_report["message"]["url"]
-        scam_message_url = re.search('/(\d+)/(\d+)/(\d+)', scam_message_url)
-        guild = self.get_guild(int(scam_message_url.group(1)))
-        scam_message_channel = guild.get_channel(int(scam_message_url.group(2)))
-        scam_message = await scam_message_channel.fetch_message(int(scam_message_url.group(3)))
+    async def apply_message_outcome(self, forwarded_message, dmoutcome, learn=True):
+        scam_message = await self.message_resolver.resolve(forwarded_message.mod_report["message"]["url"])
 
-        await scam_message.reactions[0].remove(self.user)
+        await self.actions.remove_reaction(scam_message, self.review_reaction(forwarded_message), self.user)
 
         if dmoutcome == DMOutcomes.FLAG:
-            await scam_message.add_reaction("‼️")  # the dm has been flagged
+            await self.actions.react(scam_message, "‼️", NORMAL)  # the dm has been flagged
+
+        # Learn from the moderator's verdict (triage records one sample per cluster instead)
+        if learn:
+            self.online_learner.record((await self.transliterate(forwarded_message.reported_content)).lower(),
+                                       "Spam" if dmoutcome == DMOutcomes.FLAG else "Ham")
 
 
 
-    async def handleReportedAccount(self, forwarded_message, channel):
-        await channel.send("Choose outcome for the reported account.")
+    async def handleReportedAccount(self, forwarded_message, session):
+        await session.channel.send("Choose outcome for the reported account.")
         choices = [e.value for e in ReportedAccOutcomes]
-        user_choice = await self.prompt_for_choice(choices, channel)
+        user_choice = await self.prompt_for_choice(choices, session)
         ReportedAccountOut  = ReportedAccOutcomes(choices[user_choice])
-        scammer_id = forwarded_message.reported_account
+        await self.apply_account_outcome(forwarded_message.reported_account, ReportedAccountOut)
 
+    async def apply_account_outcome(self, scammer_id, ReportedAccountOut):
         if ReportedAccountOut != ReportedAccOutcomes.NOACTION:
             if scammer_id not in self.abusive_reported_acc_strike:
                 self.abusive_reported_acc_strike[scammer_id] = 0
             self.abusive_reported_acc_strike[scammer_id] += 1
+            self.moderation_store.put_strike(ABUSIVE_REPORTED_ACCOUNT, scammer_id,
+                                             self.abusive_reported_acc_strike[scammer_id])
 
 
         if ReportedAccountOut == ReportedAccOutcomes.TEMPDEACTSHORT:
-            scammer = await self.fetch_user(scammer_id)
-            await scammer.send("WARNING: please do not send scam messages. " +
+            await self.actions.send_dm(self, scammer_id, "WARNING: please do not send scam messages. " +
                           "Your account will be temporarily deactivated for " + str(SCAMMER_DEACT_TIME_SHORT) + " days.")
         elif ReportedAccountOut == ReportedAccOutcomes.TEMPDEACTLONG:
-            scammer = await self.fetch_user(scammer_id)
-            await scammer.send("WARNING: please do not send scam messages. " +
+            await self.actions.send_dm(self, scammer_id, "WARNING: please do not send scam messages. " +
                           "Your account will be temporarily deactivated for " + str(SCAMMER_DEACT_TIME_LONG) + " days.")
         elif ReportedAccountOut == ReportedAccOutcomes.PERMANENTLYDEACT:
-            scammer = await self.fetch_user(scammer_id)
-            await scammer.send("WARNING: please do not send scam messages. " +
+            await self.actions.send_dm(self, scammer_id, "WARNING: please do not send scam messages. " +
                           "Your account will be permanently deactivated.")
 
 
@@ -635,5 +1110,42 @@ class ReportedAccOutcomes(Enum):
 
 
 
-client = ModBot(perspective_key)
-client.run(discord_token)
+def main(shard_link=None):
+    '''
+    Starts the bot. sharding.py runs it in several processes, each with the shard_link of its shards.
+    '''
+    global MODERATION_STORE_PATH, CLASSIFIER_SNAPSHOT_DIR, LOG_PATH, METRICS_PORT
+    if not os.path.isfile(token_path):
+        raise Exception(f"{token_path} not found!")
+    with open(token_path) as f:
+        # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
+        tokens = json.load(f)
+        discord_token = tokens['discord']
+        perspective_key = tokens['perspective']
+        # Optional: point the bot at a local perspective_stub.py server for offline testing
+        perspective_url = tokens.get('perspective_url', PERSPECTIVE_URL)
+
+    if shard_link is not None:
+        # Each process keeps its own state, log and metrics endpoint
+        MODERATION_STORE_PATH = shard_link.path(MODERATION_STORE_PATH)
+        CLASSIFIER_SNAPSHOT_DIR = shard_link.path(CLASSIFIER_SNAPSHOT_DIR)
+        LOG_PATH = shard_link.path(LOG_PATH)
+        if METRICS_PORT is not None:
+            METRICS_PORT += shard_link.process
+
+    # Records are written by a background thread, so logging never blocks the event loop
+    log_listener, log_handler = setup_logging(LOG_PATH, LOG_LEVEL, max_bytes=LOG_MAX_BYTES,
+                                              interval=LOG_ROTATE_INTERVAL, backup_count=LOG_BACKUP_COUNT,
+                                              queue_size=LOG_QUEUE_SIZE, debug_sample_every=LOG_DEBUG_SAMPLE_EVERY)
+    client = ModBot(perspective_key, perspective_url, shard_link=shard_link)
+    client.metrics.collect("logging", lambda: log_handler.stats, "Log records queued, dropped and sampled out")
+    try:
+        # log_handler=None: don't let discord.py add its own (blocking) console handler
+        client.run(discord_token, log_handler=None)
+    finally:
+        log_listener.stop()
+
+
+# The bot only starts when run as a script, so replay.py can import it
+if __name__ == "__main__":
+    main()
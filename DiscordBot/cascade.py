@@ -0,0 +1,68 @@
+# cascade.py
+class CascadeResult(object):
+    stage = None # "blacklist", "classifier" or "remote": the stage that decided
+    scores = None
+    blacklist_matches = None
+
+    def __init__(self, stage, scores, blacklist_matches):
+        self.stage = stage
+        self.scores = scores
+        self.blacklist_matches = blacklist_matches
+
+
+class ScoringCascade(object):
+    '''
+    Scores a message with the cheapest checks first and only pays for Perspective when they are not conclusive:
+    1. blacklist: a message containing a blacklisted URL/crypto address is decided right away, without scoring
+       (if short_circuit_blacklist is set).
+    2. classifier: the local crypto scam classifier (batched by the scoring queue). If its probability is below
+       remote_min_score or above remote_max_score, the message is decided on that score alone.
+    3. remote: everything in between is also scored by Perspective.
+    Classifier and Perspective scores are cached by score_cache, so repeated messages skip stages 2 and 3.
+    self.stats counts the messages decided by each stage and the Perspective calls actually made.
+    '''
+
+    def __init__(self, blacklist, scoring_queue, score_cache, remote_min_score, remote_max_score,
+                 short_circuit_blacklist=True):
+        self.blacklist = blacklist
+        self.scoring_queue = scoring_queue
+        self.score_cache = score_cache
+        self.remote_min_score = remote_min_score
+        self.remote_max_score = remote_max_score
+        self.short_circuit_blacklist = short_circuit_blacklist
+        self.stats = {"messages": 0, "blacklist": 0, "classifier": 0, "remote": 0, "remote_calls": 0}
+
+    def needs_remote(self, crypto_scam_proba):
+        return self.remote_min_score <= crypto_scam_proba <= self.remote_max_score
+
+    def _complete(self, scores):
+        # Don't cache the scores of a message that should have been, but could not be, scored by Perspective
+        return not self.needs_remote(scores['CRYPTO_SCAM']) or len(scores) > 1
+
+    async def _score(self, text):
+        crypto_scam_proba = await self.scoring_queue.classify(text)
+        scores = {}
+        if self.needs_remote(crypto_scam_proba):
+            self.stats["remote_calls"] += 1
+            scores = await self.scoring_queue.perspective_score(text)
+        scores['CRYPTO_SCAM'] = crypto_scam_proba
+        return scores
+
+    async def evaluate(self, content):
+        '''
+        Runs the raw message content through the cascade and returns a CascadeResult.
+        '''
+        self.stats["messages"] += 1
+        blacklist_matches = self.blacklist.find_matches(content)
+        if blacklist_matches and self.short_circuit_blacklist:
+            self.stats["blacklist"] += 1
+            return CascadeResult("blacklist", {}, blacklist_matches)
+
+        text = await self.scoring_queue.normalize(content)
+        scores = await self.score_cache.get_or_score(text, self._score, should_cache=self._complete)
+        stage = "remote" if self.needs_remote(scores['CRYPTO_SCAM']) else "classifier"
+        self.stats[stage] += 1
+        return CascadeResult(stage, scores, blacklist_matches)
+
+    def remote_calls_avoided(self):
+        return self.stats["messages"] - self.stats["remote_calls"]
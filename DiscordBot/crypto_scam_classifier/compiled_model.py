@@ -0,0 +1,200 @@
+import json
+import os
+import re
+from collections import Counter
+import numpy as np
+
+
+class CompiledModel:
+    """
+    Pure-NumPy scorer for a TF-IDF + MultinomialNB model exported by naive_bayes_classifier.export_compiled_model.
+    It reproduces TfidfVectorizer.transform followed by MultinomialNB.predict_proba, without loading pandas,
+    scikit-learn or scipy, and without unpickling anything. The weight arrays are memory-mapped, so several bot
+    processes loading the same model share one copy.
+    """
+
+    def __init__(self, vocabulary, idf, feature_log_prob, class_log_prior, classes, token_pattern=r"(?u)\b\w\w+\b",
+                 lowercase=True, stop_words=(), ngram_range=(1, 1), norm="l2", sublinear_tf=False,
+                 feature_count=None, class_count=None, alpha=1.0, fit_prior=True):
+        self.vocabulary = vocabulary # term -> feature index
+        self.idf = idf # (n_features,)
+        self.feature_log_prob = feature_log_prob # (n_features, n_classes), i.e. MultinomialNB.feature_log_prob_.T
+        self.class_log_prior = class_log_prior # (n_classes,)
+        self.classes = list(classes)
+        self.token_pattern = token_pattern
+        self.token_regex = re.compile(token_pattern)
+        self.lowercase = lowercase
+        self.stop_words = frozenset(stop_words)
+        self.ngram_range = tuple(ngram_range)
+        self.norm = norm
+        self.sublinear_tf = sublinear_tf
+        # Naive Bayes sufficient statistics, only needed for partial_fit
+        self.feature_count = feature_count # (n_features, n_classes)
+        self.class_count = class_count # (n_classes,)
+        self.alpha = alpha
+        self.fit_prior = fit_prior
+
+    def analyze(self, text):
+        """
+        Splits text into the same terms TfidfVectorizer's word analyzer would produce
+        """
+        if self.lowercase:
+            text = text.lower()
+        tokens = [t for t in self.token_regex.findall(text) if t not in self.stop_words]
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+        terms = tokens if min_n == 1 else []
+        for n in range(max(min_n, 2), max_n + 1):
+            terms.extend(" ".join(tokens[i:i+n]) for i in range(len(tokens) - n + 1))
+        return terms
+
+    def vectorize(self, text):
+        """
+        Returns the TF-IDF vector of text in sparse form, as (feature indices, values), or None if no term of text
+        is in the vocabulary
+        """
+        counts = Counter(self.vocabulary[t] for t in self.analyze(text) if t in self.vocabulary)
+        if not counts:
+            return None
+        ids = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        if self.sublinear_tf:
+            tf = np.log(tf) + 1
+        x = tf * self.idf[ids]
+        if self.norm == "l2":
+            x /= np.sqrt(x @ x)
+        elif self.norm == "l1":
+            x /= np.abs(x).sum()
+        return ids, x
+
+    def joint_log_likelihood(self, X):
+        """
+        Returns the (n_texts, n_classes) array of unnormalized class log-probabilities for the texts in X
+        """
+        jll = np.tile(self.class_log_prior, (len(X), 1))
+        for row, text in enumerate(X):
+            vector = self.vectorize(text)
+            if vector is not None:
+                ids, x = vector
+                jll[row] += x @ self.feature_log_prob[ids]
+        return jll
+
+    def predict_proba(self, X):
+        jll = self.joint_log_likelihood(X)
+        jll -= jll.max(axis=1, keepdims=True)
+        proba = np.exp(jll)
+        return proba / proba.sum(axis=1, keepdims=True)
+
+    def predict(self, X):
+        return np.array(self.classes)[self.joint_log_likelihood(X).argmax(axis=1)]
+
+    def partial_fit(self, X, Y):
+        """
+        Returns a new model with the labelled texts X, Y added to the Naive Bayes counts, like
+        MultinomialNB.partial_fit. The vocabulary and idf weights stay fixed, so terms outside the vocabulary are
+        ignored. This model is left untouched, so it can keep scoring while the update is computed.
+        """
+        if self.feature_count is None:
+            raise Exception("This model was exported without Naive Bayes counts and cannot be updated")
+        feature_count = np.array(self.feature_count, dtype=np.float64)
+        class_count = np.array(self.class_count, dtype=np.float64)
+        for text, label in zip(X, Y):
+            c = self.classes.index(label)
+            class_count[c] += 1
+            vector = self.vectorize(text)
+            if vector is not None:
+                ids, x = vector
+                feature_count[ids, c] += x
+
+        smoothed = feature_count + self.alpha
+        feature_log_prob = np.log(smoothed) - np.log(smoothed.sum(axis=0, keepdims=True))
+        if self.fit_prior:
+            class_log_prior = np.log(class_count) - np.log(class_count.sum())
+        else:
+            class_log_prior = np.array(self.class_log_prior, dtype=np.float64)
+        return CompiledModel(self.vocabulary, self.idf, feature_log_prob, class_log_prior, self.classes,
+                             token_pattern=self.token_pattern, lowercase=self.lowercase, stop_words=self.stop_words,
+                             ngram_range=self.ngram_range, norm=self.norm, sublinear_tf=self.sublinear_tf,
+                             feature_count=feature_count, class_count=class_count, alpha=self.alpha,
+                             fit_prior=self.fit_prior)
+
+    def save(self, path):
+        """
+        Writes this model to path in the format load_compiled_model reads
+        """
+        terms = [None] * len(self.vocabulary)
+        for term, i in self.vocabulary.items():
+            terms[i] = term
+        write_compiled_model(path, terms, self.idf, self.feature_log_prob, self.class_log_prior, self.classes, {
+            "token_pattern": self.token_pattern,
+            "lowercase": self.lowercase,
+            "stop_words": sorted(self.stop_words),
+            "ngram_range": list(self.ngram_range),
+            "norm": self.norm,
+            "sublinear_tf": self.sublinear_tf,
+            "alpha": self.alpha,
+            "fit_prior": self.fit_prior
+        }, feature_count=self.feature_count, class_count=self.class_count)
+
+
+def write_compiled_model(path, terms, idf, feature_log_prob, class_log_prior, classes, settings,
+                         feature_count=None, class_count=None):
+    """
+    Writes a model directory:
+    - vocabulary.txt: one term per line, line i is feature i
+    - idf.npy, feature_log_prob.npy (n_features x n_classes), class_log_prior.npy
+    - feature_count.npy, class_count.npy: optional Naive Bayes counts, needed for partial_fit
+    - meta.json: classes and the tokenizer/TF-IDF/Naive Bayes settings
+    """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "vocabulary.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(terms))
+    np.save(os.path.join(path, "idf.npy"), np.asarray(idf, dtype=np.float64))
+    np.save(os.path.join(path, "feature_log_prob.npy"), np.ascontiguousarray(feature_log_prob, dtype=np.float64))
+    np.save(os.path.join(path, "class_log_prior.npy"), np.asarray(class_log_prior, dtype=np.float64))
+    if feature_count is not None:
+        np.save(os.path.join(path, "feature_count.npy"), np.ascontiguousarray(feature_count, dtype=np.float64))
+        np.save(os.path.join(path, "class_count.npy"), np.asarray(class_count, dtype=np.float64))
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(dict(settings, n_features=len(terms), classes=[str(c) for c in classes]), f, indent=4)
+
+
+def load_compiled_model(path, mmap=True):
+    """
+    Loads a model directory written by naive_bayes_classifier.export_compiled_model or CompiledModel.save
+    """
+    mmap_mode = "r" if mmap else None
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    with open(os.path.join(path, "vocabulary.txt"), encoding="utf-8") as f:
+        vocabulary = {term: i for i, term in enumerate(f.read().split("\n")[:meta["n_features"]])}
+    feature_count, class_count = None, None
+    if os.path.isfile(os.path.join(path, "feature_count.npy")):
+        feature_count = np.load(os.path.join(path, "feature_count.npy"), mmap_mode=mmap_mode)
+        class_count = np.load(os.path.join(path, "class_count.npy"))
+    return CompiledModel(vocabulary,
+                         np.load(os.path.join(path, "idf.npy"), mmap_mode=mmap_mode),
+                         np.load(os.path.join(path, "feature_log_prob.npy"), mmap_mode=mmap_mode),
+                         np.load(os.path.join(path, "class_log_prior.npy")),
+                         meta["classes"],
+                         token_pattern=meta["token_pattern"],
+                         lowercase=meta["lowercase"],
+                         stop_words=meta["stop_words"],
+                         ngram_range=meta["ngram_range"],
+                         norm=meta["norm"],
+                         sublinear_tf=meta["sublinear_tf"],
+                         feature_count=feature_count,
+                         class_count=class_count,
+                         alpha=meta.get("alpha", 1.0),
+                         fit_prior=meta.get("fit_prior", True))
+
+
+if __name__ == "__main__":
+    # Export the pickled vectorizer/model next to this file into the compiled format the bot loads
+    import pickle
+    from naive_bayes_classifier import export_compiled_model
+    here = os.path.dirname(os.path.abspath(__file__))
+    vectorizer = pickle.load(open(os.path.join(here, "vectorizer_disc.pickle"), "rb"))
+    model = pickle.load(open(os.path.join(here, "model_disc.pickle"), "rb"))
+    export_compiled_model(vectorizer, model, os.path.join(here, "model_disc"))
@@ -4,6 +4,7 @@ from sklearn.model_selection import train_test_split
 from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 import numpy as np
 import os
+from compiled_model import write_compiled_model
 np.random.seed(5)
 
 
@@ -111,6 +112,36 @@ def get_predictions(X_test, model, vectorizer, predict_proba=False):
     return predictions
 
 
+def export_compiled_model(vectorizer, model, path):
+    """
+    Exports a fitted TfidfVectorizer + MultinomialNB pair to a pickle-free directory that
+    compiled_model.load_compiled_model can load with NumPy alone (see compiled_model.write_compiled_model for the
+    format), including the Naive Bayes counts so the model can be updated online
+    """
+    terms = [None] * len(vectorizer.vocabulary_)
+    for term, i in vectorizer.vocabulary_.items():
+        terms[i] = term
+
+    tfidf = vectorizer._tfidf
+    if not tfidf.use_idf:
+        idf = np.ones(len(terms))
+    elif hasattr(tfidf, "_idf_diag"):
+        idf = np.asarray(tfidf._idf_diag.diagonal()) # models pickled with older scikit-learn versions
+    else:
+        idf = np.asarray(tfidf.idf_)
+
+    write_compiled_model(path, terms, idf, model.feature_log_prob_.T, model.class_log_prior_, model.classes_, {
+        "token_pattern": vectorizer.token_pattern,
+        "lowercase": vectorizer.lowercase,
+        "stop_words": sorted(vectorizer.get_stop_words() or []),
+        "ngram_range": list(vectorizer.ngram_range),
+        "norm": tfidf.norm,
+        "sublinear_tf": tfidf.sublinear_tf,
+        "alpha": float(model.alpha),
+        "fit_prior": model.fit_prior
+    }, feature_count=model.feature_count_.T, class_count=model.class_count_)
+
+
 if __name__ == "__main__":
     # Load both datasets
     X_train_ct, X_test_ct, Y_train_ct, Y_test_ct = load_crypto_tweet_dataset()
@@ -169,3 +200,4 @@ if __name__ == "__main__":
     # import pickle
     # pickle.dump(vectorizer_disc, open("models/trained_on_discord/vectorizer_disc.pickle", "wb"))
     # pickle.dump(model_disc, open("models/trained_on_discord/model_disc.pickle", "wb"))
+    # export_compiled_model(vectorizer_disc, model_disc, "models/trained_on_discord/model_disc")
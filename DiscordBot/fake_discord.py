@@ -0,0 +1,169 @@
+# fake_discord.py
+'''
+In-process stand-in for the parts of Discord the bot's moderation actions use, so the action scheduler (and
+anything else that sends reactions, messages and DMs) can be exercised offline.
+
+FakeDiscord plays the server: every request takes `latency` seconds and is checked against Discord's per-route
+rate limits; requests over the limit fail with the same discord.HTTPException (status 429, Retry-After header)
+discord.py raises, or with wait_on_rate_limit wait Retry-After and try again, as discord.py does for the calls the bot
+makes directly. FakeGuild/FakeChannel/FakeMessage/FakeUser mimic the discord.py objects the bot calls.
+'''
+import asyncio
+import itertools
+import random
+import time
+import discord
+from action_scheduler import DEFAULT_LIMITS, TokenBucket
+
+
+class FakeResponse(object):
+
+    def __init__(self, status, reason, headers=None):
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+
+class FakeDiscord(object):
+
+    def __init__(self, limits=None, latency=0.02, error_rate=0.0, seed=0, wait_on_rate_limit=False):
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.latency = latency
+        self.error_rate = error_rate # fraction of requests failing with a 503
+        self.wait_on_rate_limit = wait_on_rate_limit
+        self.rng = random.Random(seed)
+        self.buckets = {} # route -> TokenBucket
+        self.ids = itertools.count(1000)
+        self.log = [] # (time, route, description) of every successful request
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0}
+
+    async def request(self, route, description):
+        self.stats["requests"] += 1
+        await asyncio.sleep(self.latency)
+        bucket = self.buckets.get(route)
+        if bucket is None:
+            bucket = self.buckets[route] = TokenBucket(*self.limits[route[0]])
+        delay = bucket.delay()
+        while delay > 0 and self.wait_on_rate_limit:
+            self.stats["rate_limited"] += 1
+            await asyncio.sleep(delay + self.latency)
+            delay = bucket.delay()
+        if delay > 0:
+            self.stats["rate_limited"] += 1
+            raise discord.HTTPException(FakeResponse(429, "Too Many Requests", {"Retry-After": f"{delay:.3f}"}),
+                                        {"message": "You are being rate limited.", "code": 0})
+        bucket.take()
+        if self.rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            raise discord.HTTPException(FakeResponse(503, "Service Unavailable"), "upstream connect error")
+        self.log.append((time.monotonic(), route, description))
+
+
+class FakeUser(object):
+
+    def __init__(self, api, user_id, name):
+        self.api = api
+        self.id = user_id
+        self.name = name
+        self.mention = f"<@{user_id}>"
+        self.dms = []
+        self.dm_channel = FakeChannel(api, next(api.ids), f"dm-{name}") # where the user DMs the bot
+
+    async def send(self, content):
+        await self.api.request(("dm", self.id), f"DM {self.name}: {content}")
+        self.dms.append(content)
+
+
+class FakeReaction(object):
+
+    def __init__(self, message, emoji):
+        self.message = message
+        self.emoji = emoji
+        self.users = set()
+
+    async def remove(self, user):
+        await self.message.channel.api.request(("reaction", self.message.channel.id), f"remove {self.emoji}")
+        self.users.discard(user.id)
+        if not self.users:
+            self.message.reactions.remove(self)
+
+
+class FakeMessage(object):
+
+    def __init__(self, channel, author, content, message_id=None):
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.id = message_id if message_id is not None else next(channel.api.ids)
+        self.reactions = []
+        self.jump_url = f"https://discord.com/channels/{self.guild.id if self.guild else '@me'}/{channel.id}/{self.id}"
+
+    async def add_reaction(self, emoji, user_id=0):
+        await self.channel.api.request(("reaction", self.channel.id), f"add {emoji}")
+        for reaction in self.reactions:
+            if reaction.emoji == emoji:
+                reaction.users.add(user_id)
+                return
+        reaction = FakeReaction(self, emoji)
+        reaction.users.add(user_id)
+        self.reactions.append(reaction)
+
+    async def remove_reaction(self, emoji, member):
+        for reaction in self.reactions:
+            if reaction.emoji == emoji:
+                await reaction.remove(member)
+                return
+        await self.channel.api.request(("reaction", self.channel.id), f"remove {emoji}") # Discord answers 204 too
+
+
+class FakeChannel(object):
+
+    def __init__(self, api, channel_id, name, guild=None):
+        self.api = api
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.messages = {} # message id -> FakeMessage
+        self.on_send = None # called with every message sent through send(), e.g. to answer the bot's prompts
+
+    async def send(self, content, author=None):
+        await self.api.request(("message", self.id), f"#{self.name}: {content}")
+        message = FakeMessage(self, author, content)
+        self.messages[message.id] = message
+        if self.on_send is not None:
+            self.on_send(message)
+        return message
+
+    def post(self, author, content):
+        '''
+        A user posting a message (does not go through the bot's rate limits)
+        '''
+        message = FakeMessage(self, author, content)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        if message_id not in self.messages:
+            raise discord.NotFound(FakeResponse(404, "Not Found"), {"message": "Unknown Message", "code": 10008})
+        return self.messages[message_id]
+
+
+class FakeGuild(object):
+
+    def __init__(self, api, guild_id, name):
+        self.api = api
+        self.id = guild_id
+        self.name = name
+        self.text_channels = []
+
+    def add_channel(self, name):
+        channel = FakeChannel(self.api, next(self.api.ids), name, guild=self)
+        self.text_channels.append(channel)
+        return channel
+
+    def get_channel(self, channel_id):
+        for channel in self.text_channels:
+            if channel.id == channel_id:
+                return channel
+        return None
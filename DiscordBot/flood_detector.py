@@ -0,0 +1,83 @@
+# flood_detector.py
+import time
+from collections import OrderedDict
+
+
+class RateWindow(object):
+    '''
+    Ring buffer of the times of the last `limit` events. The window is exceeded when `limit` events happened
+    within `seconds`, i.e. when the oldest of the last `limit` events is less than `seconds` old. O(1) per event.
+    '''
+    __slots__ = ("times", "next")
+
+    def __init__(self, limit):
+        self.times = [float("-inf")] * limit
+        self.next = 0
+
+    def add(self, now, seconds):
+        '''
+        Records an event at time now and returns True if the window is exceeded
+        '''
+        self.times[self.next] = now
+        self.next = (self.next + 1) % len(self.times)
+        # times[next] is now the oldest of the last `limit` events
+        return now - self.times[self.next] < seconds
+
+
+class FloodVerdict(object):
+    __slots__ = ("author_flooding", "flood_started", "channel_raid", "raid_started")
+
+    def __init__(self, author_flooding, flood_started, channel_raid, raid_started):
+        self.author_flooding = author_flooding # the author is flooding: skip scoring, add to their flood report
+        self.flood_started = flood_started # this message made the author cross the threshold
+        self.channel_raid = channel_raid
+        self.raid_started = raid_started
+
+
+class FloodDetector(object):
+    '''
+    Streaming flood/raid detector. observe() is called once per message and costs O(1).
+
+    - An author is flooding once they post author_limit[0] messages within author_limit[1] seconds. They stay
+      flagged until they have been quiet for cooldown seconds.
+    - A channel is raided once it receives channel_limit[0] messages within channel_limit[1] seconds, with the same
+      cooldown.
+    Windows of authors and channels are kept in LRU order, and the least recently active ones are forgotten beyond
+    max_keys, so memory stays bounded however many accounts a raid uses.
+    '''
+
+    def __init__(self, author_limit=(8, 5.0), channel_limit=(40, 5.0), cooldown=60.0, max_keys=10000):
+        self.author_limit = author_limit
+        self.channel_limit = channel_limit
+        self.cooldown = cooldown
+        self.max_keys = max_keys
+        self.authors = OrderedDict() # author id -> [RateWindow, flooding until]
+        self.channels = OrderedDict() # channel id -> [RateWindow, raided until]
+        self.stats = {"messages": 0, "flood_messages": 0, "floods": 0, "raids": 0}
+
+    def _update(self, states, key, limit, now):
+        '''
+        Returns (flagged, just started) for an event on key
+        '''
+        state = states.get(key)
+        if state is None:
+            state = states[key] = [RateWindow(limit[0]), 0.0]
+            if len(states) > self.max_keys:
+                states.popitem(last=False)
+        else:
+            states.move_to_end(key)
+        was_flagged = now < state[1]
+        if state[0].add(now, limit[1]) or was_flagged:
+            state[1] = now + self.cooldown
+            return True, not was_flagged
+        return False, False
+
+    def observe(self, author_id, channel_id, now=None):
+        now = time.monotonic() if now is None else now
+        self.stats["messages"] += 1
+        author_flooding, flood_started = self._update(self.authors, author_id, self.author_limit, now)
+        channel_raid, raid_started = self._update(self.channels, channel_id, self.channel_limit, now)
+        self.stats["flood_messages"] += author_flooding
+        self.stats["floods"] += flood_started
+        self.stats["raids"] += raid_started
+        return FloodVerdict(author_flooding, flood_started, channel_raid, raid_started)
@@ -0,0 +1,112 @@
+# message_resolver.py
+import asyncio
+import re
+import time
+from collections import OrderedDict, namedtuple
+
+MESSAGE_URL_REGEX = re.compile(r'/(\d+)/(\d+)/(\d+)')
+
+MessageKey = namedtuple("MessageKey", ["guild_id", "channel_id", "message_id"])
+
+
+def parse_message_url(url):
+    '''
+    Returns the MessageKey of a Discord message link (https://discord.com/channels/<guild>/<channel>/<message>),
+    or None if url is not one
+    '''
+    m = MESSAGE_URL_REGEX.search(url)
+    if not m:
+        return None
+    return MessageKey(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+
+
+class MessageResolver(object):
+    '''
+    Resolves message links to discord.Message objects for the moderation flow.
+
+    Fetched messages are cached for ttl seconds (at most max_size of them, least recently used evicted first), so
+    the several steps of reviewing a report share one fetch_message round trip, and concurrent requests for the
+    same message share one fetch. prefetch() starts fetching messages in the background, e.g. those of the next
+    queued reports while a moderator is still answering prompts about the current one.
+    Fetched messages are snapshots: call invalidate() after changing a message (e.g. its reactions) if it may be
+    resolved again.
+    '''
+
+    def __init__(self, client, ttl=300, max_size=1000):
+        self.client = client
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict() # MessageKey -> (expiry time, message)
+        self._in_flight = {} # MessageKey -> task fetching the message
+        self.stats = {"hits": 0, "misses": 0, "prefetches": 0}
+
+    def _key(self, url_or_key):
+        if isinstance(url_or_key, MessageKey):
+            return url_or_key
+        key = parse_message_url(url_or_key)
+        if key is None:
+            raise ValueError(f"Not a Discord message link: {url_or_key}")
+        return key
+
+    def _cached(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, message, key=None):
+        key = key if key is not None else MessageKey(message.guild.id, message.channel.id, message.id)
+        self.entries.pop(key, None)
+        self.entries[key] = (time.monotonic() + self.ttl, message)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, url_or_key):
+        self.entries.pop(self._key(url_or_key), None)
+
+    async def _fetch(self, key):
+        channel = self.client.get_channel(key.channel_id)
+        if channel is None:
+            # not in this process's cache, e.g. a channel of another shard: ask the API (raises NotFound)
+            channel = await self.client.fetch_channel(key.channel_id)
+        message = await channel.fetch_message(key.message_id)
+        self.put(message, key)
+        return message
+
+    def _start_fetch(self, key):
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return task
+
+    async def resolve(self, url_or_key):
+        '''
+        Returns the message for a message link or MessageKey. Raises discord.NotFound if the message was deleted.
+        '''
+        key = self._key(url_or_key)
+        message = self._cached(key)
+        if message is not None:
+            self.stats["hits"] += 1
+            return message
+        self.stats["misses"] += 1
+        # shield: a cancelled caller should not cancel the fetch for everyone else waiting on it
+        return await asyncio.shield(self._start_fetch(key))
+
+    def prefetch(self, urls):
+        '''
+        Starts fetching the messages of urls that are not cached yet, without waiting for them.
+        Failures are ignored here; resolve() fetches again and raises.
+        '''
+        for url in urls:
+            key = parse_message_url(url)
+            if key is None or key in self._in_flight or self._cached(key) is not None:
+                continue
+            self.stats["prefetches"] += 1
+            task = self._start_fetch(key)
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
@@ -0,0 +1,176 @@
+# metrics.py
+import asyncio
+import bisect
+import functools
+import inspect
+import time
+from aiohttp import web
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_PATH = '/metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Timer(object):
+    '''
+    `with metrics.timer(name):` records the time spent in the block, also when it raises
+    '''
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+
+def format_labels(labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+
+class Metrics(object):
+    '''
+    In-process counters, gauges and latency histograms, exposed in the Prometheus text format.
+
+    Recording is a dict lookup plus an addition (histograms: a bisect over 16 bounds), so the instrumentation stays
+    on in production. Components that already count things in a `stats` dict are not changed: collect() reads the
+    dict when the metrics are scraped. Labels are tuples of (name, value) pairs, e.g. (("route", "reaction"),).
+    '''
+
+    def __init__(self, prefix="modbot"):
+        self.prefix = prefix
+        self.counters = {} # (name, labels) -> value
+        self.histograms = {} # (name, labels) -> Histogram
+        self.gauges = {} # name -> function returning the current value
+        self.collectors = {} # name -> function returning a dict of stats
+        self.help = {} # name -> description
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, amount=1, labels=()):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram()
+        histogram.observe(value)
+
+    def timer(self, name, labels=()):
+        return Timer(self, name, labels)
+
+    def gauge(self, name, function, help=None):
+        self.gauges[name] = function
+        if help:
+            self.help[name] = help
+
+    def collect(self, name, function, help=None):
+        '''
+        Exposes the numbers of the dict returned by function as name{stat="<key>"}
+        '''
+        self.collectors[name] = function
+        if help:
+            self.help[name] = help
+
+    def time_methods(self, obj, names, metric):
+        '''
+        Replaces the methods `names` of obj (this instance only) with versions that record their latency in the
+        `metric` histogram, labelled with the method name. Works for plain and coroutine methods.
+        '''
+        for name in names:
+            method = getattr(obj, name)
+            labels = (("op", name),)
+            if inspect.iscoroutinefunction(method):
+                async def timed(*args, _method=method, _labels=labels, **kwargs):
+                    with Timer(self, metric, _labels):
+                        return await _method(*args, **kwargs)
+            else:
+                def timed(*args, _method=method, _labels=labels, **kwargs):
+                    with Timer(self, metric, _labels):
+                        return _method(*args, **kwargs)
+            setattr(obj, name, functools.wraps(method)(timed))
+
+    async def monitor_loop_lag(self, interval=0.1):
+        '''
+        Samples how late the event loop wakes up a task that sleeps for interval seconds, until cancelled
+        '''
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.observe("event_loop_lag_seconds", max(0.0, time.perf_counter() - start - interval))
+
+    def _header(self, lines, name, kind):
+        full_name = f"{self.prefix}_{name}"
+        if name in self.help:
+            lines.append(f"# HELP {full_name} {self.help[name]}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        return full_name
+
+    def render(self):
+        '''
+        Returns every metric in the Prometheus text exposition format
+        '''
+        lines = []
+        for names, kind in ((self.counters, "counter"), (self.histograms, "histogram")):
+            for name in sorted({name for name, _ in names}):
+                full_name = self._header(lines, name, kind)
+                for (metric, labels), value in sorted(names.items(), key=lambda item: item[0][1]):
+                    if metric != name:
+                        continue
+                    if kind == "counter":
+                        lines.append(f"{full_name}{format_labels(labels)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.bounds + ("+Inf",), value.counts):
+                        cumulative += count
+                        lines.append(f"{full_name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{full_name}_sum{format_labels(labels)} {value.sum}")
+                    lines.append(f"{full_name}_count{format_labels(labels)} {value.count}")
+        for name, function in sorted(self.gauges.items()):
+            full_name = self._header(lines, name, "gauge")
+            lines.append(f"{full_name} {function()}")
+        for name, function in sorted(self.collectors.items()):
+            full_name = self._header(lines, name, "untyped")
+            for stat, value in function().items():
+                lines.append(f"{full_name}{format_labels((('stat', stat),))} {value}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host='127.0.0.1', port=9108):
+        '''
+        Serves render() at http://host:port/metrics from the running event loop and returns the aiohttp runner.
+        Call `await runner.cleanup()` to stop it.
+        '''
+        async def handle(request):
+            return web.Response(body=self.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+        app = web.Application()
+        app.router.add_get(METRICS_PATH, handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
@@ -0,0 +1,188 @@
+# moderation_store.py
+'''
+Crash-safe storage for the moderation state that used to live only in memory: the review queue, reporter/reported
+account strikes, reporting suspensions and reports users are still filling in over DMs.
+
+The state is kept in a SQLite database in WAL mode. Writes never block the event loop: every change is recorded in
+a pending batch keyed by the row it touches (so a report that is queued and resolved before the batch is written
+costs a single delete), and the batch is committed in one transaction by a worker thread at most flush_interval_ms
+after its first change. A crash loses at most that window. A batch that fails to commit is retried on its own,
+with exponential backoff up to max_retry_interval_ms. On startup, load() reads every table in one pass and the
+bot rebuilds its in-memory indexes from it.
+'''
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+
+log = logging.getLogger('modbot')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS reports (
+    report_id INTEGER PRIMARY KEY,
+    message_url TEXT NOT NULL,
+    reported_account INTEGER,
+    reporter INTEGER,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS strikes (
+    kind TEXT NOT NULL,
+    account INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (kind, account)
+);
+CREATE TABLE IF NOT EXISTS suspensions (
+    account INTEGER PRIMARY KEY,
+    since TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS open_reports (
+    reporter INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+'''
+
+ABUSIVE_REPORTED_ACCOUNT = "abusive_reported_account" # strike kinds
+MALICIOUS_REPORTER = "malicious_reporter"
+
+
+class ModerationStore(object):
+    '''
+    The put_*/delete_* methods only record the change and return immediately; flush_async() (scheduled
+    automatically inside the event loop) or flush() writes it.
+    '''
+
+    def __init__(self, path, flush_interval_ms=50, max_retry_interval_ms=30000):
+        self.path = path
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_retry_interval = max_retry_interval_ms / 1000
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL") # in WAL mode, commits survive a crash of the bot process
+        self._conn.executescript(SCHEMA)
+        self._conn_lock = threading.Lock() # the connection is used by one worker thread at a time
+        self._pending = {} # (table, key) -> (sql, params), the latest change to each row
+        self._timer = None
+        self._retry_interval = None # while writes fail: the delay before the next attempt, doubled after each failure
+        self._flushing = None
+        self._flush_lock = None # created in the event loop; keeps batches from being written out of order
+        self.stats = {"changes": 0, "rows_written": 0, "transactions": 0}
+
+    def load(self):
+        '''
+        Returns everything stored, as a dictionary:
+        - "reports": list of (report id, report dictionary, message url, reported account, reporter), by report id
+        - "strikes": {kind: {account: count}}
+        - "suspensions": {account: suspension start as a string}
+        - "open_reports": {reporter: report dictionary}
+        '''
+        with self._conn_lock:
+            cursor = self._conn.cursor()
+            reports = [(report_id, json.loads(data), message_url, reported_account, reporter)
+                       for report_id, message_url, reported_account, reporter, data in cursor.execute(
+                           "SELECT report_id, message_url, reported_account, reporter, data FROM reports ORDER BY report_id")]
+            strikes = {ABUSIVE_REPORTED_ACCOUNT: {}, MALICIOUS_REPORTER: {}}
+            for kind, account, count in cursor.execute("SELECT kind, account, count FROM strikes"):
+                strikes.setdefault(kind, {})[account] = count
+            suspensions = dict(cursor.execute("SELECT account, since FROM suspensions"))
+            open_reports = {reporter: json.loads(data)
+                            for reporter, data in cursor.execute("SELECT reporter, data FROM open_reports")}
+        return {"reports": reports, "strikes": strikes, "suspensions": suspensions, "open_reports": open_reports}
+
+    def _change(self, row, sql, params):
+        self._pending[row] = (sql, params)
+        self.stats["changes"] += 1
+        if self._timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return # no event loop (scripts): written by the next flush() or close()
+            self._timer = loop.call_later(self.flush_interval, self._start_flush)
+
+    def put_report(self, report_id, report, message_url, reported_account, reporter=None):
+        self._change(("reports", report_id),
+                     "INSERT OR REPLACE INTO reports (report_id, message_url, reported_account, reporter, data) VALUES (?, ?, ?, ?, ?)",
+                     (report_id, message_url, reported_account, reporter, json.dumps(report)))
+
+    def delete_report(self, report_id):
+        self._change(("reports", report_id), "DELETE FROM reports WHERE report_id = ?", (report_id,))
+
+    def put_strike(self, kind, account, count):
+        self._change(("strikes", kind, account),
+                     "INSERT OR REPLACE INTO strikes (kind, account, count) VALUES (?, ?, ?)", (kind, account, count))
+
+    def put_suspension(self, account, since):
+        self._change(("suspensions", account),
+                     "INSERT OR REPLACE INTO suspensions (account, since) VALUES (?, ?)", (account, str(since)))
+
+    def put_open_report(self, reporter, report):
+        self._change(("open_reports", reporter),
+                     "INSERT OR REPLACE INTO open_reports (reporter, data) VALUES (?, ?)", (reporter, json.dumps(report)))
+
+    def delete_open_report(self, reporter):
+        self._change(("open_reports", reporter), "DELETE FROM open_reports WHERE reporter = ?", (reporter,))
+
+    def _write(self, batch):
+        with self._conn_lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                for sql, params in batch:
+                    cursor.execute(sql, params)
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+        self.stats["rows_written"] += len(batch)
+        self.stats["transactions"] += 1
+
+    def _start_flush(self):
+        self._timer = None
+        self._flushing = asyncio.ensure_future(self.flush_async())
+
+    async def flush_async(self):
+        '''
+        Writes the pending changes in a worker thread
+        '''
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(self._write, batch.values())
+            except sqlite3.Error as e:
+                # Keep the failed changes for the next flush, unless the row changed again meanwhile
+                for row, change in batch.items():
+                    self._pending.setdefault(row, change)
+                # and retry them even if nothing else changes, backing off (changes made meanwhile wait for it too)
+                self._retry_interval = min(2 * (self._retry_interval or self.flush_interval), self.max_retry_interval)
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = asyncio.get_running_loop().call_later(self._retry_interval, self._start_flush)
+                log.warning("Writing %d moderation state changes failed, retrying in %.1f s: %r",
+                            len(batch), self._retry_interval, e)
+            else:
+                self._retry_interval = None
+
+    def flush(self):
+        '''
+        Writes the pending changes from the calling thread
+        '''
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            self._write(batch.values())
+
+    async def close(self):
+        if self._flushing is not None:
+            await self._flushing
+        self.flush()
+        with self._conn_lock:
+            self._conn.close()
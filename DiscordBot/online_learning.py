@@ -0,0 +1,131 @@
+# online_learning.py
+import asyncio
+import logging
+import os
+import shutil
+from crypto_scam_classifier.compiled_model import load_compiled_model
+
+log = logging.getLogger('modbot')
+
+
+class OnlineLearner(object):
+    '''
+    Folds moderator verdicts into the crypto scam classifier without an offline retrain.
+
+    Verdicts are buffered by record() and applied in one Naive Bayes count update by apply_pending(), which the bot
+    runs periodically in a background task. The update is computed in a worker thread on a copy of the counts while
+    the current model keeps scoring, and then swapped in with a single attribute assignment, so scoring never waits.
+    Every update is saved as a numbered snapshot in snapshot_dir (the newest max_snapshots are kept), and the active
+    version is recorded in snapshot_dir/CURRENT so a restart resumes from it. rollback() goes back to an earlier
+    snapshot; version 0 is the base model.
+    '''
+
+    def __init__(self, base_model_path, snapshot_dir, max_snapshots=10):
+        self.base_model_path = base_model_path
+        self.snapshot_dir = snapshot_dir
+        self.max_snapshots = max_snapshots
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.version = self._current_version()
+        self.model = self._load(self.version)
+        self._pending = [] # list of (text, label) not yet applied
+        self._lock = asyncio.Lock()
+
+    def versions(self):
+        '''
+        Returns the sorted list of available model versions, including the base model (version 0)
+        '''
+        versions = [0]
+        for name in os.listdir(self.snapshot_dir):
+            if name.startswith("v") and name[1:].isdigit():
+                versions.append(int(name[1:]))
+        return sorted(versions)
+
+    def _current_version(self):
+        try:
+            with open(os.path.join(self.snapshot_dir, "CURRENT")) as f:
+                version = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return self.versions()[-1]
+        return version if version in self.versions() else self.versions()[-1]
+
+    def _set_current(self, model, version):
+        self.model, self.version = model, version
+        tmp_path = os.path.join(self.snapshot_dir, "CURRENT.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(version))
+        os.replace(tmp_path, os.path.join(self.snapshot_dir, "CURRENT"))
+
+    def _snapshot_path(self, version):
+        return os.path.join(self.snapshot_dir, f"v{version:04d}")
+
+    def model_path(self, version=None):
+        '''
+        Returns the directory of the given model version (default: the current one), e.g. for processes loading it
+        '''
+        version = self.version if version is None else version
+        return self.base_model_path if version == 0 else self._snapshot_path(version)
+
+    def _load(self, version):
+        return load_compiled_model(self.model_path(version))
+
+    def record(self, text, label):
+        '''
+        Buffers a moderator verdict; label is "Spam" or "Ham"
+        '''
+        self._pending.append((text, label))
+
+    def _update(self, model, batch, version):
+        X, Y = zip(*batch)
+        updated = model.partial_fit(X, Y)
+        # Write to a temporary directory first, so a crash never leaves a half-written snapshot behind
+        tmp_path = self._snapshot_path(version) + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        updated.save(tmp_path)
+        os.replace(tmp_path, self._snapshot_path(version))
+        return updated
+
+    async def apply_pending(self):
+        '''
+        Applies all buffered verdicts to the current model. Returns the number of verdicts applied.
+        '''
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, []
+            version = self.versions()[-1] + 1
+            updated = await asyncio.to_thread(self._update, self.model, batch, version)
+            self._set_current(updated, version)
+            self._prune_snapshots()
+            return len(batch)
+
+    def _prune_snapshots(self):
+        snapshots = [v for v in self.versions() if v not in (0, self.version)]
+        for version in snapshots[:-self.max_snapshots]:
+            shutil.rmtree(self._snapshot_path(version), ignore_errors=True)
+
+    async def rollback(self, version=None):
+        '''
+        Switches back to the given model version (default: the one before the current version) and returns it.
+        Verdicts recorded after a rolled back update are not re-applied.
+        '''
+        async with self._lock:
+            versions = self.versions()
+            if version is None:
+                older = [v for v in versions if v < self.version]
+                version = older[-1] if older else 0
+            if version not in versions:
+                raise ValueError(f"Model version {version} does not exist")
+            model = await asyncio.to_thread(self._load, version)
+            self._set_current(model, version)
+            return version
+
+    async def run(self, interval):
+        '''
+        Applies buffered verdicts every interval seconds, forever
+        '''
+        while True:
+            await asyncio.sleep(interval)
+            applied = await self.apply_pending()
+            if applied:
+                log.info("Applied %d moderator verdicts to the crypto scam classifier (model version %d)", applied,
+                         self.version)
@@ -0,0 +1,65 @@
+# perspective_client.py
+import asyncio
+import json
+import aiohttp
+
+PERSPECTIVE_URL = 'https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze'
+REQUESTED_ATTRIBUTES = ['SEVERE_TOXICITY', 'PROFANITY', 'IDENTITY_ATTACK', 'THREAT', 'TOXICITY'] #'FLIRTATION'
+
+
+class PerspectiveClient(object):
+    '''
+    Asynchronous Perspective API client. All requests share one pooled keep-alive aiohttp session, so scoring a
+    message never blocks the discord.py event loop and does not pay for a fresh TLS handshake every time.
+    At most max_concurrency requests are in flight at once; the rest wait their turn on a semaphore.
+    '''
+
+    def __init__(self, key, url=PERSPECTIVE_URL, timeout=10, max_concurrency=8, pool_size=None):
+        self.key = key
+        self.url = url
+        self.timeout = timeout #in seconds, default for every request
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size if pool_size is not None else max_concurrency
+        self._session = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _get_session(self):
+        # The session has to be created from inside a running event loop, so we open it lazily on first use
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                  json_serialize=json.dumps)
+        return self._session
+
+    def build_request(self, text):
+        return {
+            'comment': {'text': text},
+            'languages': ['en'],
+            'requestedAttributes': {attr: {} for attr in REQUESTED_ATTRIBUTES},
+            'doNotStore': True
+        }
+
+    async def score(self, text, timeout=None):
+        '''
+        Scores text with Perspective and returns a dictionary of attribute -> summary score.
+        Raises asyncio.TimeoutError if the request takes longer than timeout (or self.timeout) seconds,
+        and aiohttp.ClientError if the request fails.
+        '''
+        session = self._get_session()
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout is not None else None
+        async with self._semaphore:
+            async with session.post(self.url, params={'key': self.key}, json=self.build_request(text),
+                                    timeout=request_timeout) as response:
+                response.raise_for_status()
+                response_dict = await response.json(content_type=None)
+
+        scores = {}
+        for attr in response_dict["attributeScores"]:
+            scores[attr] = response_dict["attributeScores"][attr]["summaryScore"]["value"]
+        return scores
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
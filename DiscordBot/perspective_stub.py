@@ -0,0 +1,61 @@
+# perspective_stub.py
+'''
+Local stand-in for the Perspective API, so the bot and the scoring client can be exercised offline.
+
+Run it with `python perspective_stub.py --port 8765 --latency 150` and point the bot at it by adding
+"perspective_url": "http://127.0.0.1:8765/v1alpha1/comments:analyze" to tokens.json.
+Scores are derived from a hash of the comment text, so the same text always gets the same scores.
+'''
+import argparse
+import asyncio
+import hashlib
+from aiohttp import web
+from perspective_client import REQUESTED_ATTRIBUTES
+
+STUB_PATH = '/v1alpha1/comments:analyze'
+
+
+def fake_scores(text, attributes):
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return {attr: digest[i % len(digest)] / 255 for i, attr in enumerate(attributes)}
+
+
+def make_app(latency=0.0):
+    '''
+    Builds the stub aiohttp application. latency is the simulated server-side delay per request, in seconds.
+    '''
+    async def analyze(request):
+        if latency:
+            await asyncio.sleep(latency)
+        data = await request.json()
+        attributes = list(data.get('requestedAttributes', {}).keys()) or REQUESTED_ATTRIBUTES
+        scores = fake_scores(data['comment']['text'], attributes)
+        return web.json_response({
+            'attributeScores': {attr: {'summaryScore': {'value': value, 'type': 'PROBABILITY'}}
+                                for attr, value in scores.items()},
+            'languages': ['en']
+        })
+
+    app = web.Application()
+    app.router.add_post(STUB_PATH, analyze)
+    return app
+
+
+async def start_stub(host='127.0.0.1', port=8765, latency=0.0):
+    '''
+    Starts the stub server in the running event loop and returns (runner, url). Call `await runner.cleanup()` to stop it.
+    '''
+    runner = web.AppRunner(make_app(latency))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, f'http://{host}:{port}{STUB_PATH}'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Perspective API stub")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=150, help="simulated latency per request, in ms")
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency / 1000), host=args.host, port=args.port)
@@ -0,0 +1,415 @@
+# replay.py
+'''
+Offline replay harness for the moderation pipeline. Feeds a message stream through ModBot's handlers with
+fake_discord.py standing in for Discord and perspective_stub.py for the Perspective API, and reports throughput,
+per-stage latency histograms and event-loop lag, so regressions in the hot path show up as numbers.
+
+- The channel stream is dispatched as Discord would ("message" events in #group-16). It is synthesized from the
+  crypto_tweet CSV and the custom_discord_dataset (with a raid by one account in the middle), or read from a
+  recorded stream: a JSON lines file of {"author": name, "content": text} objects, optionally with "delay", the
+  seconds since the previous message.
+- Reporters walk through the DM reporting flow (handle_dm) for random messages of the stream.
+- A moderator reviews reports ("next report") in #group-16-mod, answering every prompt as soon as it is posted.
+
+    python replay.py --messages 2000 --rate 200 --reporters 20 --reviews 3
+    python replay.py --stream recorded.jsonl --json results.json
+
+Run it from this folder (like bot.py). The bot's state files go to a temporary folder.
+'''
+import argparse
+import asyncio
+import contextlib
+import csv
+import glob
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import bot
+from bot import ModBot
+from fake_discord import FakeDiscord, FakeGuild, FakeUser
+from perspective_stub import start_stub
+from async_logging import setup_logging
+
+CRYPTO_TWEET_PATH = '../Classifier/data/crypto_tweet/crypto_tweet_aggregateddata.csv'
+DISCORD_DATASET_PATH = '../Classifier/data/custom_discord_dataset'
+HISTOGRAM_BUCKETS_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+LOOP_LAG_INTERVAL = 0.01 #how often the event loop lag is sampled, in seconds
+
+
+class LatencyHistogram(object):
+    '''
+    Latencies of one stage, in milliseconds. Replays are bounded, so every sample is kept.
+    '''
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, ms):
+        self.samples.append(ms)
+
+    def percentile(self, p):
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))] if samples else 0.0
+
+    def summary(self):
+        return {"count": len(self.samples), "mean": sum(self.samples) / len(self.samples) if self.samples else 0.0,
+                "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99),
+                "max": max(self.samples, default=0.0)}
+
+    def buckets(self):
+        '''
+        Returns (upper bound in ms, count) for each bucket, the last one being unbounded
+        '''
+        counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        for ms in self.samples:
+            i = 0
+            while i < len(HISTOGRAM_BUCKETS_MS) and ms > HISTOGRAM_BUCKETS_MS[i]:
+                i += 1
+            counts[i] += 1
+        return list(zip(HISTOGRAM_BUCKETS_MS + (float("inf"),), counts))
+
+    def render(self, width=40):
+        lines = []
+        top = max((count for _, count in self.buckets()), default=0)
+        for bound, count in self.buckets():
+            if count:
+                bar = "#" * max(1, round(count / top * width))
+                lines.append(f"    <= {bound:>7} ms {count:7} {bar}")
+        return "\n".join(lines)
+
+
+def load_corpus(crypto_tweet_path=CRYPTO_TWEET_PATH, discord_dataset_path=DISCORD_DATASET_PATH):
+    '''
+    Returns the (label, text) pairs of the crypto_tweet CSV (Ham/Listing/Spam) and of the custom Discord
+    dataset (all scams, labelled Spam)
+    '''
+    corpus = []
+    with open(crypto_tweet_path, encoding='utf-8', errors='replace') as f:
+        for row in csv.DictReader(f):
+            corpus.append((row["Category"], row["Tweet"]))
+    for path in sorted(glob.glob(os.path.join(discord_dataset_path, '*', '*.txt'))):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            corpus.append(("Spam", f.read().strip()[:2000])) # Discord's message length limit
+    return corpus
+
+
+def synthetic_stream(corpus, n, rate, authors, raid_size, seed=0):
+    '''
+    Returns n stream entries drawn from corpus, posted by `authors` accounts at `rate` messages per second (0: as
+    fast as possible). Halfway through, one account posts raid_size copies of a scam with varying amounts.
+    '''
+    rng = random.Random(seed)
+    spam = [text for label, text in corpus if label == "Spam"]
+    delay = 1 / rate if rate else 0
+    stream = [{"author": f"user{rng.randrange(authors)}", "content": rng.choice(corpus)[1], "delay": delay}
+              for _ in range(n - raid_size)]
+    scam = rng.choice(spam)
+    raid = [{"author": "raider", "content": f"{scam} {rng.randrange(1000)} BTC", "delay": delay}
+            for _ in range(raid_size)]
+    return stream[:len(stream) // 2] + raid + stream[len(stream) // 2:]
+
+
+def load_stream(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayBot(ModBot):
+    '''
+    ModBot living in the fake Discord: users, channels and guilds are looked up in the replay's world instead of
+    the gateway cache.
+    '''
+
+    def __init__(self, world, perspective_url):
+        self.world = world
+        super().__init__("replay", perspective_url)
+        self.routes.add_guild(world.guild)
+
+    @property
+    def user(self):
+        return self.world.bot_user
+
+    def get_guild(self, guild_id):
+        return self.world.guild if guild_id == self.world.guild.id else None
+
+    def get_channel(self, channel_id):
+        return self.world.channels.get(channel_id)
+
+    def get_user(self, user_id):
+        return self.world.users.get(user_id)
+
+    async def fetch_user(self, user_id):
+        return self.world.users[user_id]
+
+
+class World(object):
+
+    def __init__(self, api, group_num):
+        self.api = api
+        self.guild = FakeGuild(api, next(api.ids), "replay")
+        self.channel = self.guild.add_channel(f"group-{group_num}")
+        self.mod_channel = self.guild.add_channel(f"group-{group_num}-mod")
+        self.channels = {channel.id: channel for channel in self.guild.text_channels}
+        self.users = {} # user id -> FakeUser
+        self.names = {} # user name -> FakeUser
+        self.bot_user = self.user(f"Group {group_num} Bot")
+
+    def user(self, name):
+        user = self.names.get(name)
+        if user is None:
+            user = FakeUser(self.api, next(self.api.ids), name)
+            self.users[user.id] = self.names[name] = user
+            self.channels[user.dm_channel.id] = user.dm_channel
+        return user
+
+
+class Replay(object):
+
+    def __init__(self, client, world):
+        self.client = client
+        self.world = world
+        self.stages = {} # stage name -> LatencyHistogram
+        self.errors = 0
+        self.channel_messages = 0 # channel stream messages fully handled
+        self.stream_done = asyncio.Event()
+        self.stream_size = 0
+        self.finished = False
+        self.metrics = None # the bot's own metrics (metrics.py) at the end of the replay
+
+    def histogram(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = LatencyHistogram()
+        return self.stages[stage]
+
+    def time_stage(self, obj, name, stage):
+        '''
+        Wraps the coroutine method obj.name (on this instance only) to record its latency under stage.
+        stage can be a function of the call's first argument.
+        '''
+        method = getattr(obj, name)
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                label = stage(*args) if callable(stage) else stage
+                self.histogram(label).add((time.perf_counter() - start) * 1000)
+                if label == "channel_message":
+                    self.channel_messages += 1
+                    if self.channel_messages == self.stream_size:
+                        self.stream_done.set()
+        setattr(obj, name, timed)
+
+    def instrument(self):
+        client = self.client
+        self.time_stage(client, "handle_channel_message",
+                        lambda message: "mod_command" if message.channel is self.world.mod_channel else "channel_message")
+        self.time_stage(client, "eval_text", "scoring")
+        self.time_stage(client.scoring_queue, "classify", "classifier")
+        self.time_stage(client.scoring_queue, "perspective_score", "perspective")
+        self.time_stage(client, "handle_dm", "dm")
+
+    async def monitor_loop_lag(self):
+        lag = self.histogram("loop_lag")
+        while not self.finished:
+            start = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag.add(max(0.0, (time.perf_counter() - start - LOOP_LAG_INTERVAL) * 1000))
+
+    async def play_stream(self, stream):
+        '''
+        Returns the time taken to handle every message of the stream
+        '''
+        self.stream_size = len(stream)
+        start = time.perf_counter()
+        for entry in stream:
+            message = self.world.channel.post(self.world.user(entry["author"]), entry["content"])
+            self.client.dispatch("message", message)
+            # yield even at full speed, so handlers start while the stream is being played
+            await asyncio.sleep(entry.get("delay", 0))
+        if stream:
+            await self.stream_done.wait()
+        return time.perf_counter() - start
+
+    async def report(self, reporter, rng):
+        '''
+        Reports a random message of the stream posted so far as a crypto scam, like a user would
+        '''
+        messages = list(self.world.channel.messages.values())
+        if not messages:
+            return
+        target = rng.choice(messages)
+        start = time.perf_counter()
+        for content in ("report", target.jump_url, "4", "1", "skip", "n", "n"):
+            dm = reporter.dm_channel.post(reporter, content)
+            await self.client.on_message(dm)
+            if reporter.id not in self.client.reports:
+                break # submitted, or cancelled as a duplicate
+        self.histogram("report_flow").add((time.perf_counter() - start) * 1000)
+
+    async def play_reporters(self, count, duration, seed):
+        rng = random.Random(seed)
+
+        async def reporter(i):
+            await asyncio.sleep(rng.uniform(0, duration))
+            await self.report(self.world.user(f"reporter{i}"), rng)
+        await asyncio.gather(*[reporter(i) for i in range(count)])
+
+    async def moderate(self, reviews):
+        '''
+        Reviews up to `reviews` reports: flags the content, gives the account a short deactivation, and answers 'n'
+        to every yes/no question
+        '''
+        moderator = self.world.user("moderator")
+        inbox = asyncio.Queue()
+        self.world.mod_channel.on_send = inbox.put_nowait
+        review = self.histogram("review")
+
+        def answer(content):
+            self.client.dispatch("message", self.world.mod_channel.post(moderator, content))
+
+        for _ in range(reviews):
+            start = time.perf_counter()
+            answer("next report")
+            while True:
+                prompt = (await inbox.get()).content
+                if prompt.startswith("No more reports"):
+                    if self.stream_done.is_set():
+                        return
+                    await asyncio.sleep(1) # wait for the stream to flag something
+                    start = time.perf_counter()
+                    answer("next report")
+                if prompt.startswith("Finished processing"):
+                    review.add((time.perf_counter() - start) * 1000)
+                    break
+                if "Enter 'y' or 'n'" in prompt:
+                    answer("n")
+                elif "Please enter a number between 1 and" in prompt:
+                    answer("2")
+
+
+async def replay(stream, args):
+    api = FakeDiscord(latency=args.discord_latency / 1000, wait_on_rate_limit=True, seed=args.seed)
+    world = World(api, 16)
+    stub, perspective_url = await start_stub(port=args.port, latency=args.perspective_latency / 1000)
+    try:
+        with tempfile.TemporaryDirectory() as state_dir:
+            bot.BLACKLIST_PATH = os.path.join(state_dir, 'scamaddr.blacklist')
+            bot.CLASSIFIER_SNAPSHOT_DIR = os.path.join(state_dir, 'online')
+            bot.MODERATION_STORE_PATH = os.path.join(state_dir, 'moderation.db')
+            bot.ACTION_DRAIN_TIMEOUT = 0 # the raid's reactions left queued at the end don't matter here
+            bot.METRICS_PORT = None # --metrics prints them instead
+            bot.SCORING_POOL_PROCESSES = args.scoring_processes
+            # keep the bot's own output out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                client = ReplayBot(world, perspective_url)
+                async with client:
+                    await client.setup_hook()
+                    run = Replay(client, world)
+                    run.instrument()
+                    lag_monitor = asyncio.ensure_future(run.monitor_loop_lag())
+                    stream_duration = sum(entry.get("delay", 0) for entry in stream)
+                    start = time.perf_counter()
+                    stream_task = asyncio.ensure_future(run.play_stream(stream))
+                    await asyncio.gather(stream_task,
+                                         run.play_reporters(args.reporters, stream_duration, args.seed),
+                                         run.moderate(args.reviews))
+                    elapsed = time.perf_counter() - start
+                    run.finished = True
+                    await lag_monitor
+                    run.metrics = client.metrics.render()
+                    results = {
+                        "messages": len(stream),
+                        "seconds": elapsed,
+                        "stream_seconds": stream_task.result(),
+                        "errors": run.errors,
+                        "stages": {stage: histogram.summary() for stage, histogram in run.stages.items()},
+                        "cascade": dict(client.cascade.stats, remote_calls_avoided=client.cascade.remote_calls_avoided()),
+                        "score_cache": client.score_cache.stats,
+                        "flood": client.flood_detector.stats,
+                        "actions": dict(client.actions.stats, pending=client.actions.pending()),
+                        "message_cache": client.message_resolver.stats,
+                        "scoring_queue": client.scoring_queue.stats,
+                        "discord": api.stats,
+                        "queued_reports": sum(map(len, client.review_queues.values())),
+                    }
+                    if client.scoring_pool is not None:
+                        results["scoring_pool"] = dict(client.scoring_pool.stats, processes=client.scoring_pool.processes)
+        return results, run
+    finally:
+        await stub.cleanup()
+
+
+def print_results(results, run):
+    print(f"{results['messages']} messages in {results['seconds']:.2f} s")
+    print(f"channel stream: {results['messages'] / results['stream_seconds']:.1f} messages/s")
+    for stage in ("channel_message", "scoring", "classifier", "perspective", "dm", "report_flow", "mod_command",
+                  "review", "loop_lag"):
+        if stage not in run.stages:
+            continue
+        s = results["stages"][stage]
+        print(f"\n{stage}: n={s['count']} mean={s['mean']:.2f} p50={s['p50']:.2f} p90={s['p90']:.2f} "
+              f"p99={s['p99']:.2f} max={s['max']:.2f} ms")
+        print(run.stages[stage].render())
+    print()
+    for key in ("cascade", "score_cache", "scoring_queue", "scoring_pool", "flood", "actions", "message_cache", "discord",
+                "logging"):
+        if key in results:
+            print(f"{key}: {json.dumps(results[key])}")
+    print(f"reports still queued: {results['queued_reports']}, handler errors: {results['errors']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline replay benchmark of the moderation pipeline")
+    parser.add_argument('--stream', help="recorded stream (JSON lines) to replay instead of a synthetic one")
+    parser.add_argument('--save-stream', help="write the synthetic stream to this file, to replay it later")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200, help="messages per second, 0 for as fast as possible")
+    parser.add_argument('--authors', type=int, default=500)
+    parser.add_argument('--raid', type=int, default=50, help="messages of the raid in the middle of the stream")
+    parser.add_argument('--reporters', type=int, default=20)
+    parser.add_argument('--reviews', type=int, default=3)
+    parser.add_argument('--discord-latency', type=float, default=20, help="per request, in ms")
+    parser.add_argument('--perspective-latency', type=float, default=50, help="per request, in ms")
+    parser.add_argument('--port', type=int, default=8765, help="port of the local Perspective stub")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scoring-processes', type=int, default=0,
+                        help="normalize and classify messages in this many worker processes (bot.SCORING_POOL_PROCESSES)")
+    parser.add_argument('--text-repeat', type=int, default=1,
+                        help="repeat each synthetic message's text this many times, to make scoring costlier")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--metrics', action='store_true', help="also print the bot's Prometheus metrics")
+    parser.add_argument('--log', help="log like the bot does in production (async_logging.py) to this file")
+    args = parser.parse_args()
+
+    if args.stream:
+        stream = load_stream(args.stream)
+    else:
+        stream = synthetic_stream(load_corpus(), args.messages, args.rate, args.authors, args.raid, args.seed)
+        for entry in stream:
+            entry["content"] = " ".join([entry["content"]] * args.text_repeat)
+        if args.save_stream:
+            with open(args.save_stream, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in stream)
+
+    if args.log:
+        log_listener, log_handler = setup_logging(args.log, bot.LOG_LEVEL, queue_size=bot.LOG_QUEUE_SIZE,
+                                                  debug_sample_every=bot.LOG_DEBUG_SAMPLE_EVERY)
+    results, run = asyncio.run(replay(stream, args))
+    if args.log:
+        log_listener.stop()
+        results["logging"] = log_handler.stats
+    print_results(results, run)
+    if args.metrics:
+        print()
+        print(run.metrics, end="")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -2,7 +2,8 @@ from enum import Enum, auto
 import datetime;
 import discord
 import json
-import re
+from message_resolver import parse_message_url
+from action_scheduler import URGENT, NORMAL
 
 IMM_DANGER_RESPONSE = "Thank you for the information. Our content moderation team will review the message and notify the local authorities if necessary. Please contact 911 for immediate support."
 NORMAL_REPORT_RESPONSE = "Thank you for the information. Our content moderation team will review the message and reach out if needed. No further action is required on your part."
@@ -10,8 +11,12 @@ NORMAL_REPORT_RESPONSE = "Thank you for the information. Our content moderation
 class State(Enum):
     REPORT_START = auto()
     AWAITING_MESSAGE_URL = auto()
-    MESSAGE_IDENTIFIED = auto()
+    MESSAGE_IDENTIFIED = auto() # looking up the reported message
     CATEGORIZE_MESSAGE = auto()
+    AWAITING_SUB_CATEGORY = auto()
+    AWAITING_MORE_INFO = auto()
+    AWAITING_COMPROMISED = auto()
+    AWAITING_BLOCK = auto()
     REPORT_SUBMITTED = auto()
     REPORT_CANCELLED = auto()
 
@@ -21,7 +26,24 @@ class Categories(Enum):
     IMM_DANGER = "Immediate Danger"
     SCAM = "Fraud / Scam"
 
+HARASSMENT_SUB_CATEGORIES = ["Hate speech", "Cyberbulling", "Sexual Content", "Illegal Activity", "Fake News", "Other / I don't like this post"]
+SCAM_SUB_CATEGORIES = ["Cryptocurrency Scam", "Financial Scam", "Phishing", "Impersonation", "Other"]
+
+# Questions asked after the category (and sub-category) is known, in order
+FOLLOW_UP_STATES = {
+    Categories.COMP_ACCOUNT: (State.AWAITING_MORE_INFO, State.AWAITING_BLOCK),
+    Categories.HARASSMENT: (State.AWAITING_MORE_INFO, State.AWAITING_COMPROMISED, State.AWAITING_BLOCK),
+    Categories.IMM_DANGER: (),
+    Categories.SCAM: (State.AWAITING_MORE_INFO, State.AWAITING_COMPROMISED, State.AWAITING_BLOCK),
+}
+
+
 class Report:
+    '''
+    The state of one user's report. The reporting flow is a state machine driven by ModBot.handle_dm: every DM from
+    the reporter is passed to handle_message, which advances the state and returns the bot's replies. Nothing waits
+    for the next message in between, so an open report is just this record, however many reports are in progress.
+    '''
     START_KEYWORDS = {"r", "report"}
     CANCEL_KEYWORDS = {"c", "cancel"}
     HELP_KEYWORDS = {"h", "help"}
@@ -36,6 +58,39 @@ class Report:
         self.message_url = ""
         self.reporter_id = None
         self.mod_report = {}
+        self.category = None
+        self.follow_up = () # states still to go through before the report is submitted
+
+    def todict(self):
+        '''
+        Returns the state of the report as a JSON-serializable dictionary, so it survives a restart of the bot
+        '''
+        state = self.state
+        if state == State.MESSAGE_IDENTIFIED:
+            # the lookup did not finish; the reporter has to send the link again
+            state = State.AWAITING_MESSAGE_URL
+        return {
+            "state": state.name,
+            "timestamp": str(self.timestamp) if self.timestamp is not None else None,
+            "message_url": self.message_url,
+            "reporter_id": self.reporter_id,
+            "mod_report": self.mod_report,
+            "category": self.category.name if self.category is not None else None,
+            "follow_up": [s.name for s in self.follow_up],
+        }
+
+    @classmethod
+    def fromdict(cls, client, d):
+        report = cls(client)
+        report.state = State[d["state"]]
+        if d["timestamp"] is not None:
+            report.timestamp = datetime.datetime.fromisoformat(d["timestamp"])
+        report.message_url = d["message_url"]
+        report.reporter_id = d["reporter_id"]
+        report.mod_report = d["mod_report"]
+        report.category = Categories[d["category"]] if d["category"] is not None else None
+        report.follow_up = tuple(State[s] for s in d["follow_up"])
+        return report
     
     async def handle_message(self, message):
         '''
@@ -44,7 +99,7 @@ class Report:
         get you started and give you a model for working with Discord. 
         '''
 
-        if message.content.lower in self.STATE_KEYWORD:
+        if message.content.lower() in self.STATE_KEYWORD:
             return ["My state is " + str(self.state.name)]
 
         if message.content.lower() in self.CANCEL_KEYWORDS:
@@ -54,7 +109,22 @@ class Report:
             return self.report_start()
         
         if self.state == State.AWAITING_MESSAGE_URL:
-            await self.awaiting_message_url(message)
+            return await self.awaiting_message_url(message)
+
+        if self.state == State.CATEGORIZE_MESSAGE:
+            return await self.categorize_message(message)
+
+        if self.state == State.AWAITING_SUB_CATEGORY:
+            return await self.sub_category(message)
+
+        if self.state == State.AWAITING_MORE_INFO:
+            return await self.more_info(message)
+
+        if self.state == State.AWAITING_COMPROMISED:
+            return await self.compromised_acct(message)
+
+        if self.state == State.AWAITING_BLOCK:
+            return await self.block_user(message)
 
         return []
 
@@ -73,40 +143,48 @@ class Report:
     async def awaiting_message_url(self, message):
         # DEBUG: use known Link
         if message.content.lower() == "test": 
-            m = re.search('/(\d+)/(\d+)/(\d+)', "https://discord.com/channels/915746011757019217/930035531889401866/944172931141992468")
+            key = parse_message_url("https://discord.com/channels/915746011757019217/930035531889401866/944172931141992468")
 
         else:
             # Parse out the three ID strings from the message link
-            m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
+            key = parse_message_url(message.content)
         
-        if not m:
+        if key is None:
             return ["I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel."]
 
-        guild = self.client.get_guild(int(m.group(1)))
-        if not guild:
+        guild = self.client.get_guild(key.guild_id)
+        if guild:
+            channel = guild.get_channel(key.channel_id)
+        elif self.client.is_remote_guild(key.guild_id):
+            # the guild is served by another bot process (see sharding.py)
+            channel = await self.client.fetch_remote_channel(key.guild_id, key.channel_id)
+        else:
             return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."]
-        
-        channel = guild.get_channel(int(m.group(2)))
+
         if not channel:
             return ["It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."]
         
+        # Ignore further messages until the lookup is done
+        self.state = State.MESSAGE_IDENTIFIED
         try:
             # note that message is the user dm and self.message is the reported message!
-            self.message = await channel.fetch_message(int(m.group(3)))
-            self.message_url = message.content
-            self.dm_channel = message.channel
-            self.reporter_id = message.author.id
-            self.state = State.MESSAGE_IDENTIFIED
+            reported_message = await channel.fetch_message(key.message_id)
         except discord.errors.NotFound:
+            if self.state == State.MESSAGE_IDENTIFIED:
+                self.state = State.AWAITING_MESSAGE_URL
             return ["It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."]
+        if self.state != State.MESSAGE_IDENTIFIED:
+            # the report was cancelled meanwhile
+            return []
+        self.message = reported_message
+        self.message_url = message.content
+        self.dm_channel = message.channel
+        self.reporter_id = message.author.id
 
         # Here we've found the message
         if self.client.check_message_url_against_active_reports(message.author.id, message.content):
             self.state = State.REPORT_CANCELLED
-            await self.dm_channel.send("Report cancelled: you have already submitted a report on this message.")
-            return []
-
-        await self.dm_channel.send(f"I found this message:\n```{self.message.author.name}: {self.message.content}```\n")
+            return ["Report cancelled: you have already submitted a report on this message."]
 
         self.mod_report["report_dm_channel_id"] = message.channel.id
         self.mod_report["reporter"] = message.author.name
@@ -120,121 +198,129 @@ class Report:
             "url": self.message_url
         }
 
-        await self.categorize_message()
-        
-    async def categorize_message(self):
         self.state = State.CATEGORIZE_MESSAGE
-        await self.dm_channel.send("Please tell us a bit more about this message.")
+        return [f"I found this message:\n```{self.message.author.name}: {self.message.content}```\n",
+                "Please tell us a bit more about this message." + self.choice_prompt([e.value for e in Categories])]
 
+    async def categorize_message(self, message):
         choices = [e.value for e in Categories]
-        user_choice = await self.prompt_for_choice(choices)
+        user_choice = self.parse_choice(message, choices)
+        if user_choice is None:
+            return [self.choice_prompt(choices)]
+        self.category = Categories(choices[user_choice])
         self.mod_report["Category"] = choices[user_choice]
         self.mod_report["crypto_scam"] = False
+        self.follow_up = FOLLOW_UP_STATES[self.category]
 
-        if Categories(choices[user_choice]) == Categories.COMP_ACCOUNT:
+        if self.category == Categories.COMP_ACCOUNT:
             self.mod_report["account_status"] = "Reported to be compromised."
-            await self.more_info()
-            await self.block_user()
-
-        elif Categories(choices[user_choice]) == Categories.HARASSMENT:
-            sub_choices = ["Hate speech", "Cyberbulling", "Sexual Content", "Illegal Activity", "Fake News", "Other / I don't like this post"]
-            user_choice = await self.prompt_for_choice(sub_choices)
-            self.mod_report["Sub-category"] = sub_choices[user_choice]
-            
-            await self.more_info()
-            await self.compromised_acct()
-            await self.block_user()
-
-        elif Categories(choices[user_choice]) == Categories.IMM_DANGER:
-            self.mod_report["immediate_danger"] = True
-            await self.send_report(IMM_DANGER_RESPONSE, immediate_danger=True)
-            return
-        
-        elif Categories(choices[user_choice]) == Categories.SCAM:
-            sub_choices = ["Cryptocurrency Scam", "Financial Scam", "Phishing", "Impersonation", "Other"]
-            user_choice = await self.prompt_for_choice(sub_choices)
-            self.mod_report["Sub-category"] = sub_choices[user_choice]
-
-            if sub_choices[user_choice] == "Cryptocurrency Scam":
-                self.mod_report["crypto_scam"] = True
-                await self.crypto_specific()
 
-            await self.more_info()
-            await self.compromised_acct()
-            await self.block_user()
+        elif self.category == Categories.HARASSMENT:
+            self.state = State.AWAITING_SUB_CATEGORY
+            return [self.choice_prompt(HARASSMENT_SUB_CATEGORIES)]
 
-        await self.send_report(NORMAL_REPORT_RESPONSE)
-
-    async def prompt_for_choice(self, choices):
+        elif self.category == Categories.IMM_DANGER:
+            self.mod_report["immediate_danger"] = True
+            return await self.send_report(IMM_DANGER_RESPONSE, immediate_danger=True)
+        
+        elif self.category == Categories.SCAM:
+            self.state = State.AWAITING_SUB_CATEGORY
+            return [self.choice_prompt(SCAM_SUB_CATEGORIES)]
+
+        return await self.next_step()
+
+    async def sub_category(self, message):
+        sub_choices = HARASSMENT_SUB_CATEGORIES if self.category == Categories.HARASSMENT else SCAM_SUB_CATEGORIES
+        user_choice = self.parse_choice(message, sub_choices)
+        if user_choice is None:
+            return [self.choice_prompt(sub_choices)]
+        self.mod_report["Sub-category"] = sub_choices[user_choice]
+
+        replies = []
+        if sub_choices[user_choice] == "Cryptocurrency Scam":
+            self.mod_report["crypto_scam"] = True
+            replies += self.crypto_specific()
+        return replies + await self.next_step()
+
+    async def next_step(self):
+        '''
+        Moves on to the next follow-up question and returns its prompt, or submits the report once all are answered.
+        '''
+        if not self.follow_up:
+            return await self.send_report(NORMAL_REPORT_RESPONSE)
+        self.state, self.follow_up = self.follow_up[0], self.follow_up[1:]
+        if self.state == State.AWAITING_MORE_INFO:
+            self.mod_report["justification"] = []
+            return ["Would you like to provide more information? \nEnter 'skip' to skip this step, and 'done' when finished."]
+        if self.state == State.AWAITING_COMPROMISED:
+            return ["Do you think this account has been compromised? Enter 'y', 'n', or 'u' for 'unsure'."]
+        if self.state == State.AWAITING_BLOCK:
+            return ["Would you like to block this user? Enter 'y' or 'n'."]
+        raise Exception(f"Unexpected follow-up state {self.state}")
+
+    def choice_prompt(self, choices):
         reply = f"\n\nPlease enter a number between 1 and {len(choices)}:\n"
         for i, choice in enumerate(choices):
             reply += f"{i+1}) {choice}\n"
-        await self.dm_channel.send(reply)
-
-        def check(msg):
-            return msg.content.isnumeric() and 0 < int(msg.content) and int(msg.content) <= len(choices)
+        return reply
 
-        msg = await self.client.wait_for("message", check=check)
-        return int(msg.content)-1
+    def parse_choice(self, message, choices):
+        '''
+        Returns the index of the choice picked in message, or None if message is not a valid choice
+        '''
+        if message.content.isnumeric() and 0 < int(message.content) and int(message.content) <= len(choices):
+            return int(message.content)-1
+        return None
 
-    async def crypto_specific(self):
+    def crypto_specific(self):
         # #TODO: modify this part according to the updated user flow?
-        # await self.dm_channel.send("Would you like us to automatically filter out messages similar to this one for the next 24 hours? This change will only be visible to you. Enter 'y' or 'n'.")
-        #
-        # def check(msg):
-        #     return msg.content.lower() in {'y', 'n'}
-        #
-        # msg = await self.client.wait_for("message", check=check)
-        # if msg.content.lower() == 'y':
-        #     await self.dm_channel.send(f"MOCKED: Similar messages are filtered!")
-        return
-
-    async def more_info(self):
-        await self.dm_channel.send("Would you like to provide more information? \nEnter 'skip' to skip this step, and 'done' when finished.")
-        msg = await self.client.wait_for("message")
-        self.mod_report["justification"] = []
-
-        if msg.content.lower() != "skip":
-            while msg.content.lower() != "done":
-                self.mod_report["justification"].append(msg.content)
-                msg = await self.client.wait_for("message")
-        
-    async def block_user(self):
-        await self.dm_channel.send("Would you like to block this user? Enter 'y' or 'n'.")
-
-        def check(msg):
-            return msg.content.lower() in {'y', 'n'}
-
-        msg = await self.client.wait_for("message", check=check)
-        if msg.content.lower() == 'y':
-            await self.dm_channel.send(f"MOCKED: {self.message.author.name} is blocked!")
-            self.mod_report["user_action"] = f"Reporter blocked {self.message.author.name}."
-
-    async def compromised_acct(self):
-        await self.dm_channel.send("Do you think this account has been compromised? Enter 'y', 'n', or 'u' for 'unsure'.")
-
-        def check(msg):
-            return msg.content.lower() in {'y', 'n', 'u'}
+        # Ask: "Would you like us to automatically filter out messages similar to this one for the next 24 hours?
+        # This change will only be visible to you. Enter 'y' or 'n'." and reply "MOCKED: Similar messages are filtered!"
+        return []
 
-        msg = await self.client.wait_for("message", check=check)
-        if msg.content.lower() == 'y':
+    async def more_info(self, message):
+        if message.content.lower() == "done" or \
+                (message.content.lower() == "skip" and not self.mod_report["justification"]):
+            return await self.next_step()
+        self.mod_report["justification"].append(message.content)
+        return []
+        
+    async def block_user(self, message):
+        if message.content.lower() not in {'y', 'n'}:
+            return []
+        replies = []
+        if message.content.lower() == 'y':
+            author = self.mod_report["message"]["author"]
+            replies.append(f"MOCKED: {author} is blocked!")
+            self.mod_report["user_action"] = f"Reporter blocked {author}."
+        return replies + await self.next_step()
+
+    async def compromised_acct(self, message):
+        if message.content.lower() not in {'y', 'n', 'u'}:
+            return []
+        if message.content.lower() == 'y':
             self.mod_report["account_status"] = "Reported to be compromised."
-        elif msg.content.lower() == 'u':
+        elif message.content.lower() == 'u':
             self.mod_report["account_status"] = "Reported may be compromised."
         else:
             self.mod_report["account_status"] = "Reported not compromised."
+        return await self.next_step()
 
 
     async def send_report(self, success_message, immediate_danger = False):
         # ask bot to forward the message to the mod channel
         sent, reason = self.client.handle_user_report_submission(self.reporter_id, self.mod_report)
         if sent: 
-            await self.message.add_reaction("🇶") # means the message is reported
-            await self.dm_channel.send(success_message)
             self.state = State.REPORT_SUBMITTED
+            if self.message is None:
+                # report restored after a restart
+                self.message = await self.client.message_resolver.resolve(self.mod_report["message"]["url"])
+            # means the message is reported
+            await self.client.actions.react(self.message, "🇶", URGENT if immediate_danger else NORMAL)
+            return [success_message]
         else: 
-            await self.dm_channel.send(f"Your report is cancelled due to the following reason:\n{reason}")
             self.state = State.REPORT_CANCELLED
+            return [f"Your report is cancelled due to the following reason:\n{reason}"]
 
     def report_complete(self):
         return self.state == State.REPORT_SUBMITTED or self.state == State.REPORT_CANCELLED
@@ -247,8 +333,3 @@ class Report:
 
     def get_message_url(self):
         return self.message_url
-    
-
-
-    
-
@@ -0,0 +1,204 @@
+# review_queue.py
+import heapq
+import itertools
+
+
+class ReportIds(object):
+    '''
+    Allocates report ids. Review queues persisting to the same store (e.g. one per guild) share one, so their
+    report ids don't collide.
+    '''
+
+    def __init__(self):
+        self.next_id = 0
+
+    def allocate(self, report_id=None):
+        '''
+        Returns a new id, or records report_id (restored from the store) as taken and returns it
+        '''
+        if report_id is None:
+            report_id = self.next_id
+        self.next_id = max(self.next_id, report_id + 1)
+        return report_id
+
+
+class ReviewQueue(object):
+    '''
+    Priority queue of reports waiting for moderator review, with hash indexes so reports can be looked up,
+    deduplicated and cancelled without scanning the backlog.
+
+    - push/pop are O(log n). Ties in priority are broken by insertion order.
+    - A report is identified by (message URL, reporter); reporter is None for auto-flagged reports. Pushing a report
+      that is already queued or under review is rejected in O(1).
+    - cancel() is O(1): the heap entry is only marked dead, and dead entries are skipped by pop() and dropped in
+      bulk once they make up half the heap.
+    - pop() moves a report to "under review"; resolve() evicts it from every index once the moderator is done,
+      so memory only holds the open backlog, and requeue() puts it back if the review was abandoned.
+    - With a store (moderation_store.ModerationStore), queued and under review reports are persisted, and the bot
+      pushes them back with their original report ids after a restart. Reports must then have a todict() method.
+    '''
+    _COMPACT_MIN_SIZE = 64
+
+    def __init__(self, store=None, ids=None):
+        self.store = store
+        self.ids = ids if ids is not None else ReportIds()
+        # [priority, report id (breaks ties by insertion order), sequence number, report id or None once cancelled].
+        # The sequence number is unique per entry, so a dead entry and the live one replacing it (claim() then
+        # requeue()) never get compared on their last field.
+        self._heap = []
+        self._seq = itertools.count()
+        self.reports = {} # report id -> report, for queued and under review reports
+        self._entries = {} # report id -> heap entry, for queued reports
+        self.in_review = {} # report id -> heap entry, for reports popped but not resolved yet
+        self._keys = {} # report id -> (message url, reported account, reporter)
+        self.by_message = {} # (message url, reporter) -> report id
+        self.by_message_url = {} # message url -> set of report ids
+        self.by_reported_account = {} # account id -> set of report ids
+        self.by_reporter = {} # reporter id -> set of report ids
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def empty(self):
+        return not self._entries
+
+    def has_report(self, message_url, reporter=None):
+        return (message_url, reporter) in self.by_message
+
+    def push(self, report, priority, message_url, reported_account, reporter=None, report_id=None):
+        '''
+        Queues report and returns its report id, or None if the same reporter already has an open report on
+        message_url. The id is also stored on the report as report.report_id. report_id is only passed when
+        restoring reports from the store.
+        '''
+        if (message_url, reporter) in self.by_message:
+            return None
+        report_id = self.ids.allocate(report_id)
+        entry = [priority, report_id, next(self._seq), report_id]
+        heapq.heappush(self._heap, entry)
+        report.report_id = report_id
+        self.reports[report_id] = report
+        self._entries[report_id] = entry
+        self._keys[report_id] = (message_url, reported_account, reporter)
+        self.by_message[(message_url, reporter)] = report_id
+        self.by_message_url.setdefault(message_url, set()).add(report_id)
+        self.by_reported_account.setdefault(reported_account, set()).add(report_id)
+        if reporter is not None:
+            self.by_reporter.setdefault(reporter, set()).add(report_id)
+        if self.store is not None:
+            self.store.put_report(report_id, report.todict(), message_url, reported_account, reporter)
+        return report_id
+
+    def pop(self):
+        '''
+        Removes the highest priority report from the queue, marks it as under review and returns it (or None).
+        '''
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            report_id = entry[3]
+            if report_id is None:
+                self._dead -= 1
+                continue
+            del self._entries[report_id]
+            self.in_review[report_id] = entry
+            return self.reports[report_id]
+        return None
+
+    def is_queued(self, report_id):
+        return report_id in self._entries
+
+    def update(self, report_id):
+        '''
+        Persists changes made to a report after it was pushed
+        '''
+        if self.store is not None and report_id in self.reports:
+            message_url, reported_account, reporter = self._keys[report_id]
+            self.store.put_report(report_id, self.reports[report_id].todict(), message_url, reported_account, reporter)
+
+    def queued(self):
+        '''
+        Returns every queued report, highest priority first
+        '''
+        return [self.reports[entry[3]] for entry in sorted(self._entries.values())]
+
+    def claim(self, report_id):
+        '''
+        Like pop(), but for a given queued report (e.g. to review a whole cluster of reports at once).
+        Returns the report, or None if it is not queued.
+        '''
+        entry = self._entries.pop(report_id, None)
+        if entry is None:
+            return None
+        self.in_review[report_id] = [entry[0], entry[1], next(self._seq), report_id]
+        self._mark_dead(entry)
+        return self.reports[report_id]
+
+    def peek(self, n=1):
+        '''
+        Returns up to n of the highest priority queued reports without removing them.
+        '''
+        return [self.reports[entry[3]] for entry in heapq.nsmallest(n + self._dead, self._heap)
+                if entry[3] is not None][:n]
+
+    def _evict(self, report_id):
+        if self.store is not None:
+            self.store.delete_report(report_id)
+        message_url, reported_account, reporter = self._keys.pop(report_id)
+        del self.reports[report_id]
+        del self.by_message[(message_url, reporter)]
+        for index, key in ((self.by_message_url, message_url), (self.by_reported_account, reported_account),
+                           (self.by_reporter, reporter)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(report_id)
+                if not ids:
+                    del index[key]
+
+    def cancel(self, report_id):
+        '''
+        Removes a queued report. Returns False if it is not queued (e.g. already under review).
+        '''
+        entry = self._entries.pop(report_id, None)
+        if entry is None:
+            return False
+        self._mark_dead(entry)
+        self._evict(report_id)
+        return True
+
+    def _mark_dead(self, entry):
+        entry[3] = None
+        self._dead += 1
+        if self._dead > len(self._heap) // 2 and len(self._heap) > self._COMPACT_MIN_SIZE:
+            self._heap = [e for e in self._heap if e[3] is not None]
+            heapq.heapify(self._heap)
+            self._dead = 0
+
+    def cancel_message(self, message_url):
+        '''
+        Cancels every queued report on message_url (e.g. the message was deleted). Returns how many were cancelled.
+        '''
+        return sum(self.cancel(report_id) for report_id in list(self.by_message_url.get(message_url, ())))
+
+    def resolve(self, report_id):
+        '''
+        Evicts a report once the moderator has finished reviewing it, so the same message can be reported again.
+        '''
+        if self.in_review.pop(report_id, None) is not None:
+            self._evict(report_id)
+
+    def requeue(self, report_id):
+        '''
+        Puts a report that was under review back in the queue with its original priority (e.g. the moderator
+        reviewing it went away). Returns False if it was not under review.
+        '''
+        entry = self.in_review.pop(report_id, None)
+        if entry is None:
+            return False
+        entry = [entry[0], entry[1], next(self._seq), report_id]
+        heapq.heappush(self._heap, entry)
+        self._entries[report_id] = entry
+        return True
+
+    def reports_for(self, index, key):
+        return [self.reports[report_id] for report_id in index.get(key, ())]
@@ -0,0 +1,39 @@
+# review_session.py
+import time
+
+
+class ReviewTimeout(Exception):
+    '''
+    Raised when a moderator stops answering the prompts of a review session before its lease runs out.
+    '''
+    pass
+
+
+class ReviewSession(object):
+    '''
+    One moderator reviewing one report (or, in bulk triage, a cluster of reports), in one channel. The reports are
+    leased to the moderator: each answer renews the lease for another lease_time seconds, and if the lease runs out
+    the reports go back to the review queue. Only messages from this moderator in this channel can answer the
+    session's prompts.
+    '''
+
+    def __init__(self, moderator_id, channel, reports, lease_time):
+        self.moderator_id = moderator_id
+        self.channel = channel
+        self.reports = reports
+        self.lease_time = lease_time
+        self.lease_expires = None
+        self.renew()
+
+    @property
+    def report(self):
+        return self.reports[0]
+
+    def renew(self):
+        self.lease_expires = time.monotonic() + self.lease_time
+
+    def time_left(self):
+        return max(0.0, self.lease_expires - time.monotonic())
+
+    def owns(self, msg):
+        return msg.author.id == self.moderator_id and msg.channel.id == self.channel.id
@@ -0,0 +1,53 @@
+# routing.py
+MONITORED = "monitored" # channel roles: messages are scored and auto-flagged
+MOD = "mod" # moderators review the guild's reports here
+
+
+class RoutingTable(object):
+    '''
+    Maps every channel the bot acts on to its guild and role, and every guild to its mod channel, so handling a
+    message is one dict lookup instead of comparing channel names.
+
+    A guild's "group-#" channel is monitored and its "group-#-mod" channel is its mod channel. Channels of a guild
+    without a mod channel are not monitored, since nobody could review what they flag. Call add_guild() again
+    whenever a guild's channels change.
+    '''
+
+    def __init__(self, group_num):
+        self.group_num = group_num
+        self.channels = {} # channel id -> (guild id, role)
+        self.mod_channels = {} # guild id -> mod channel
+
+    def add_guild(self, guild):
+        self.remove_guild(guild.id)
+        mod_channel = None
+        monitored = []
+        for channel in guild.text_channels:
+            if channel.name == f'group-{self.group_num}-mod':
+                mod_channel = channel
+            elif channel.name == f'group-{self.group_num}':
+                monitored.append(channel)
+        if mod_channel is None:
+            return
+        self.mod_channels[guild.id] = mod_channel
+        self.channels[mod_channel.id] = (guild.id, MOD)
+        for channel in monitored:
+            self.channels[channel.id] = (guild.id, MONITORED)
+
+    def remove_guild(self, guild_id):
+        if self.mod_channels.pop(guild_id, None) is None:
+            return
+        self.channels = {channel_id: route for channel_id, route in self.channels.items() if route[0] != guild_id}
+
+    def role(self, channel_id):
+        '''
+        Returns MONITORED, MOD or None for channels the bot ignores
+        '''
+        route = self.channels.get(channel_id)
+        return route[1] if route is not None else None
+
+    def mod_channel(self, guild_id):
+        return self.mod_channels.get(guild_id)
+
+    def __len__(self):
+        return len(self.mod_channels)
@@ -0,0 +1,184 @@
+# score_cache.py
+import asyncio
+import hashlib
+import re
+import time
+from collections import OrderedDict
+import numpy as np
+
+WORD_REGEX = re.compile(r"\w+")
+
+
+def content_hash(text):
+    # text is already unidecoded and lowercased by the caller; also ignore differences in whitespace
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).digest()
+
+
+def simhash(text):
+    '''
+    64-bit SimHash over the word bigrams of text. Texts that differ in a few words get hashes that differ in a few bits.
+    Returns None for texts too short for the hash to be meaningful.
+    '''
+    words = WORD_REGEX.findall(text)
+    if len(words) < SimHashIndex.MIN_WORDS:
+        return None
+    shingles = {" ".join(words[i:i+2]) for i in range(len(words) - 1)}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+                       for s in shingles], dtype=np.uint64)
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    # Each bit of the result is set if most shingle hashes have it set
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(votes, bitorder="little").tobytes(), "little")
+
+
+class SimHashIndex(object):
+    '''
+    Finds stored SimHashes within max_distance bits of a query. The 64 bits are split into max_distance + 1 bands;
+    two hashes within max_distance bits must agree exactly on at least one band, so only entries sharing a band
+    with the query are compared.
+    '''
+    MIN_WORDS = 5
+
+    def __init__(self, max_distance=6):
+        self.max_distance = max_distance
+        self.n_bands = max_distance + 1
+        self.band_bits = 64 // self.n_bands
+        self.bands = {} # (band number, band value) -> set of keys
+        self.hashes = {} # key -> simhash
+
+    def _band_keys(self, h):
+        mask = (1 << self.band_bits) - 1
+        return [(i, (h >> (i * self.band_bits)) & mask) for i in range(self.n_bands)]
+
+    def add(self, key, h):
+        self.hashes[key] = h
+        for band in self._band_keys(h):
+            self.bands.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        h = self.hashes.pop(key, None)
+        if h is None:
+            return
+        for band in self._band_keys(h):
+            keys = self.bands.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.bands[band]
+
+    def find(self, h):
+        '''
+        Returns the key of a stored hash within max_distance bits of h, or None
+        '''
+        for band in self._band_keys(h):
+            for key in self.bands.get(band, ()):
+                if bin(self.hashes[key] ^ h).count("1") <= self.max_distance:
+                    return key
+        return None
+
+
+class ScoreCache(object):
+    '''
+    Bounded cache of message scores, so repeated spam (raids, edits that do not change the text) is scored only once.
+    - Exact tier: keyed on a hash of the normalized content, with LRU eviction beyond max_size entries and entries
+      expiring ttl seconds after they were scored (so classifier updates and Perspective changes are picked up).
+    - Near-duplicate tier (optional): messages whose SimHash is within max_distance bits of a cached message reuse
+      its scores, which catches spam variants that only change a word or two.
+    Concurrent requests for the same content share one scoring call.
+    '''
+
+    def __init__(self, max_size=10000, ttl=600, near_duplicates=True, max_distance=6):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict() # content hash -> (expiry time, scores)
+        self.near_index = SimHashIndex(max_distance) if near_duplicates else None
+        self._in_flight = {} # content hash -> future of the scoring call in progress
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        if self.near_index is not None:
+            self.near_index.remove(key)
+
+    def _lookup(self, key, text, now):
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self._remove(key)
+
+        if self.near_index is not None:
+            h = simhash(text)
+            if h is not None:
+                near_key = self.near_index.find(h)
+                if near_key is not None:
+                    entry = self.entries[near_key]
+                    if entry[0] > now:
+                        self.entries.move_to_end(near_key)
+                        self.stats["near_hits"] += 1
+                        return entry[1]
+                    self._remove(near_key)
+        return None
+
+    def put(self, text, scores, key=None):
+        key = key if key is not None else content_hash(text)
+        self._remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, scores)
+        if self.near_index is not None:
+            h = simhash(text)
+            if h is not None:
+                self.near_index.add(key, h)
+        while len(self.entries) > self.max_size:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def get(self, text):
+        '''
+        Returns a copy of the cached scores for text (or a near duplicate of it), or None
+        '''
+        scores = self._lookup(content_hash(text), text, time.monotonic())
+        return dict(scores) if scores is not None else None
+
+    async def get_or_score(self, text, score, should_cache=None):
+        '''
+        Returns a copy of the scores of text, calling `await score(text)` only on a cache miss.
+        If should_cache is given, fresh scores are only cached when should_cache(scores) is true.
+        '''
+        key = content_hash(text)
+        scores = self._lookup(key, text, time.monotonic())
+        if scores is not None:
+            return dict(scores)
+        if key in self._in_flight:
+            self.stats["hits"] += 1
+            return dict(await asyncio.shield(self._in_flight[key]))
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            scores = await score(text)
+        except BaseException as e:
+            # Wake up everyone waiting on this call too
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception() # mark it retrieved, so asyncio does not log it again if nobody was waiting
+            raise
+        finally:
+            del self._in_flight[key]
+        future.set_result(scores)
+        if should_cache is None or should_cache(scores):
+            self.put(text, scores, key=key)
+        return dict(scores)
+
+    def clear(self):
+        self.entries.clear()
+        if self.near_index is not None:
+            self.near_index = SimHashIndex(self.near_index.max_distance)
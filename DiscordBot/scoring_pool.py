@@ -0,0 +1,93 @@
+# scoring_pool.py
+import asyncio
+import concurrent.futures
+import multiprocessing
+from unidecode import unidecode
+from crypto_scam_classifier.compiled_model import load_compiled_model
+
+_models = {} # in a worker: model path -> CompiledModel, only the version last asked for is kept
+
+
+def normalize(content):
+    '''
+    The form messages are scored (and their scores cached) in
+    '''
+    return unidecode(content).lower()
+
+
+def normalize_batch(contents):
+    return [normalize(content) for content in contents]
+
+
+def _model(model_path):
+    model = _models.get(model_path)
+    if model is None:
+        model = load_compiled_model(model_path) # memory-mapped, so the workers share one copy of the weights
+        _models.clear()
+        _models[model_path] = model
+    return model
+
+
+def classify_batch(model_path, texts):
+    '''
+    Returns the crypto scam probability of each text with the model exported to model_path, loading it on first use
+    '''
+    model = _model(model_path)
+    return model.predict_proba(texts)[:, model.classes.index("Spam")]
+
+
+class ScoringPool(object):
+    '''
+    Runs CPU-bound scoring work (unidecode normalization and classification) in worker processes, so it neither
+    delays the event loop (heartbeats, every other handler) nor is limited to one core.
+
+    Each worker loads the classifier once, when it starts, and again only when the bot switches to another model
+    version (classify_batch is given the path of the current one). Work is sent as micro-batches (see
+    scoring_queue.py), so the cost of crossing processes is paid once per batch rather than per message.
+
+    At most max_in_flight batches are handed to the workers at once; further calls wait for a free slot on the event
+    loop, where their messages keep accumulating into larger batches, instead of piling up in the executor's queue.
+    '''
+
+    def __init__(self, processes, model_path, max_in_flight=None):
+        self.processes = processes
+        self.max_in_flight = max_in_flight or 2 * processes
+        # spawn, not fork: the bot process has an event loop and writer threads that must not be copied
+        self.executor = concurrent.futures.ProcessPoolExecutor(processes,
+                                                               mp_context=multiprocessing.get_context('spawn'),
+                                                               initializer=_model, initargs=(model_path,))
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self.in_flight = 0
+        self.stats = {"tasks": 0, "waited_for_slot": 0, "errors": 0}
+
+    async def run(self, function, *args):
+        '''
+        Returns function(*args), computed in a worker. function and args must be picklable.
+        '''
+        if self._slots.locked():
+            self.stats["waited_for_slot"] += 1
+        async with self._slots:
+            self.in_flight += 1
+            self.stats["tasks"] += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+            finally:
+                self.in_flight -= 1
+
+    async def normalize_batch(self, contents):
+        return await self.run(normalize_batch, contents)
+
+    async def classify_batch(self, model_path, texts):
+        return await self.run(classify_batch, model_path, texts)
+
+    async def start(self):
+        '''
+        Starts every worker (and loads the model in it) ahead of the first messages
+        '''
+        await asyncio.gather(*(self.run(len, ()) for _ in range(self.processes)))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,146 @@
+# scoring_queue.py
+import asyncio
+import inspect
+import logging
+import aiohttp
+from scoring_pool import normalize
+
+log = logging.getLogger('modbot')
+
+
+class MicroBatcher(object):
+    '''
+    Collects items from concurrent callers and hands them to batch_function together, as soon as max_batch_size items
+    are pending or max_wait seconds after the first one arrived, whichever comes first. batch_function returns one
+    result per item, either directly or as an awaitable (e.g. work done in a process pool, see scoring_pool.py), in
+    which case the batch is completed by a background task.
+    '''
+
+    def __init__(self, batch_function, max_batch_size, max_wait):
+        self.batch_function = batch_function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = [] #list of (item, future)
+        self._timer = None
+        self.stats = {"items": 0, "batches": 0, "largest_batch": 0}
+
+    def submit(self, item):
+        '''
+        Returns a future for item's result
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self.flush)
+        return future
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        self.stats["items"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+        try:
+            results = self.batch_function([item for item, _ in batch])
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        if inspect.isawaitable(results):
+            asyncio.ensure_future(self._complete(batch, results))
+        else:
+            self._resolve(batch, results)
+
+    async def _complete(self, batch, results):
+        try:
+            results = await results
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        self._resolve(batch, results)
+
+    @staticmethod
+    def _resolve(batch, results):
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _fail(batch, e):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+
+class ScoringQueue(object):
+    '''
+    Micro-batches crypto scam classifier calls across concurrently arriving messages.
+
+    Each call to score() starts its Perspective request right away (PerspectiveClient already limits how many are
+    in flight), and parks the text in a pending batch for the local classifier. The batch is classified in one
+    vectorizer transform + predict_proba as soon as it holds max_batch_size texts, or max_wait_ms after its first
+    text arrived, whichever comes first. So a quiet channel waits at most max_wait_ms extra, and a raid gets
+    classified max_batch_size rows at a time.
+
+    classify_batch may return an awaitable (when the classifier runs in a scoring_pool.ScoringPool). Given a
+    normalize_batch coroutine function, message normalization is batched the same way; without it, normalize()
+    runs inline.
+    '''
+
+    def __init__(self, perspective, classify_batch, max_batch_size=32, max_wait_ms=10, normalize_batch=None):
+        self.perspective = perspective
+        self.classify_batch = classify_batch #function: list of texts -> list of crypto scam probabilities
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._classifier = MicroBatcher(classify_batch, max_batch_size, self.max_wait)
+        self._normalizer = MicroBatcher(normalize_batch, max_batch_size, self.max_wait) if normalize_batch else None
+
+    @property
+    def stats(self):
+        stats = {"messages": self._classifier.stats["items"], "batches": self._classifier.stats["batches"],
+                 "largest_batch": self._classifier.stats["largest_batch"]}
+        if self._normalizer is not None:
+            stats["normalize_batches"] = self._normalizer.stats["batches"]
+        return stats
+
+    async def score(self, text):
+        '''
+        Returns the dictionary of Perspective scores for text, plus its 'CRYPTO_SCAM' probability.
+        If Perspective times out or fails, only the classifier score is returned.
+        '''
+        perspective_task = asyncio.ensure_future(self.perspective_score(text))
+        crypto_scam_proba = await self.classify(text)
+        scores = await perspective_task
+        scores['CRYPTO_SCAM'] = crypto_scam_proba
+        return scores
+
+    async def classify(self, text):
+        '''
+        Returns the crypto scam probability of text, classified together with whatever else arrives meanwhile.
+        '''
+        return float(await self._classifier.submit(text))
+
+    async def normalize(self, content):
+        '''
+        Returns the normalized form of a message's content (see scoring_pool.normalize)
+        '''
+        if self._normalizer is None:
+            return normalize(content)
+        return await self._normalizer.submit(content)
+
+    async def perspective_score(self, text):
+        '''
+        Returns the dictionary of Perspective scores for text, or an empty dictionary if Perspective fails.
+        '''
+        try:
+            return await self.perspective.score(text)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("Perspective request failed: %r", e)
+            return {}
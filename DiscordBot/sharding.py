@@ -0,0 +1,101 @@
+# sharding.py
+'''
+Runs the bot as several processes, each connected to a subset of the gateway shards, so that message handling and
+scoring use one core per process. Discord assigns guild g to shard (g >> 22) % shard_count, and process p runs
+shards p, p + processes, p + 2 * processes... Each process only sees (and reviews) the guilds of its shards.
+
+    python sharding.py --processes 4 --shards 8
+
+Process p keeps its own moderation state, classifier snapshots and log (moderation.shard<p>.db...) and serves its
+metrics on METRICS_PORT + p; keep the same number of processes across restarts so each finds its guilds' state.
+
+Discord only sends DMs to shard 0, so process 0 runs every user's reporting flow. A report on a message of a guild
+served by another process is forwarded to that process over a multiprocessing queue (ShardLink), and so are
+reporting suspensions decided by moderators of other processes.
+'''
+import argparse
+import asyncio
+import multiprocessing
+import os
+
+DM_PROCESS = 0 # the process running shard 0
+
+
+def shard_for(guild_id, shard_count):
+    return (guild_id >> 22) % shard_count
+
+
+class ShardLink(object):
+    '''
+    One bot process's view of a sharded deployment: which shards and guilds are local, and the queues to send items
+    to the other processes (inboxes[p] is process p's)
+    '''
+
+    def __init__(self, process, processes, shard_count, inboxes):
+        self.process = process
+        self.processes = processes
+        self.shard_count = shard_count
+        self.inboxes = inboxes
+        self.shard_ids = list(range(process, shard_count, processes))
+
+    def process_of(self, guild_id):
+        return shard_for(guild_id, self.shard_count) % self.processes
+
+    def is_local(self, guild_id):
+        return self.process_of(guild_id) == self.process
+
+    def path(self, path):
+        '''
+        Returns this process's version of a state file or folder path, e.g. moderation.db -> moderation.shard1.db
+        '''
+        root, ext = os.path.splitext(path.rstrip('/'))
+        return f"{root}.shard{self.process}{ext}" if ext else os.path.join(path, f"shard{self.process}")
+
+    def send(self, process, kind, data):
+        '''
+        Sends (kind, data) to process. data must be picklable; put() does not block (a feeder thread writes it).
+        '''
+        self.inboxes[process].put((kind, data))
+
+    async def receive(self):
+        '''
+        Yields the (kind, data) items sent to this process, until close()
+        '''
+        loop = asyncio.get_running_loop()
+        inbox = self.inboxes[self.process]
+        while True:
+            item = await loop.run_in_executor(None, inbox.get)
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        self.inboxes[self.process].put(None)
+
+
+def run_process(process, processes, shard_count, inboxes):
+    import bot
+    bot.main(ShardLink(process, processes, shard_count, inboxes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot as several processes sharing the gateway shards")
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--shards', type=int, default=None, help="total number of shards (default: one per process)")
+    args = parser.parse_args()
+    shard_count = args.shards or args.processes
+    if shard_count < args.processes:
+        raise ValueError(f"{args.processes} processes need at least as many shards, got {shard_count}")
+
+    context = multiprocessing.get_context('spawn')
+    inboxes = [context.Queue() for _ in range(args.processes)]
+    workers = [context.Process(target=run_process, args=(p, args.processes, shard_count, inboxes),
+                               name=f"bot-shard{p}") for p in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()
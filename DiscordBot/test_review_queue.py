@@ -0,0 +1,31 @@
+# test_review_queue.py
+from review_queue import ReviewQueue
+
+
+class Report(object):
+    pass
+
+
+def push_reports(queue, n, priority=0):
+    return [queue.push(Report(), priority, f"https://discord.com/channels/1/2/{i}", 100 + i) for i in range(n)]
+
+
+def test_claim_requeue_pop():
+    queue = ReviewQueue()
+    ids = push_reports(queue, 3)
+    assert queue.claim(ids[0]) is not None
+    assert queue.requeue(ids[0])
+    popped = [queue.pop().report_id for _ in range(3)]
+    assert popped == ids
+    assert queue.pop() is None
+    assert queue.empty()
+
+
+def test_claim_requeue_twice_keeps_priority_order():
+    queue = ReviewQueue()
+    ids = push_reports(queue, 3)
+    for _ in range(2):
+        queue.claim(ids[1])
+        queue.requeue(ids[1])
+    urgent = queue.push(Report(), -1, "https://discord.com/channels/1/2/99", 199)
+    assert [queue.pop().report_id for _ in range(4)] == [urgent] + ids
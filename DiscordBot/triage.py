@@ -0,0 +1,51 @@
+# triage.py
+import re
+from unidecode import unidecode
+from score_cache import SimHashIndex, content_hash, simhash
+
+GROUPINGS = ("content", "account", "blacklist")
+DIGITS_REGEX = re.compile(r"\d+")
+
+
+def cluster_reports(reports, by, blacklist=None):
+    '''
+    Groups reports for bulk triage and returns the clusters (lists of reports), largest first.
+    - "content": same message text up to case, accents, whitespace and numbers, or near duplicates of it (SimHash)
+    - "account": same reported account
+    - "blacklist": same blacklist entry matched by the message; reports without a match are left out, and a report
+      matching several entries goes in the cluster of the first one
+    '''
+    if by not in GROUPINGS:
+        raise ValueError(f"Unknown grouping {by!r}, expected one of {', '.join(GROUPINGS)}")
+    clusters = {} # cluster key -> list of reports
+    near_index = SimHashIndex()
+    for report in reports:
+        if by == "account":
+            key = report.reported_account
+        elif by == "content":
+            # raids often only vary amounts, counters and the like
+            text = DIGITS_REGEX.sub("0", unidecode(report.reported_content).lower())
+            key = content_hash(text)
+            if key not in clusters:
+                h = simhash(text)
+                if h is not None:
+                    near_key = near_index.find(h)
+                    if near_key is not None:
+                        key = near_key
+                    else:
+                        near_index.add(key, h)
+        else:
+            matches = blacklist.find_matches(report.reported_content)
+            if not matches:
+                continue
+            key = matches[0]
+        clusters.setdefault(key, []).append(report)
+    return sorted(clusters.values(), key=len, reverse=True)
+
+
+def describe_cluster(cluster, max_length=80):
+    accounts = {report.reported_account for report in cluster}
+    sample = " ".join(unidecode(cluster[0].reported_content).split())
+    if len(sample) > max_length:
+        sample = sample[:max_length - 3] + "..."
+    return f"{len(cluster)} report(s) from {len(accounts)} account(s): \"{sample}\""